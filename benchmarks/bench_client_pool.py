@@ -0,0 +1,115 @@
+"""Compare the number of client calls per second with and without a pooled,
+keep-alive HTTP session, and with the requests or urllib3 transports, against a
+local stub server.
+
+usage: python benchmarks/bench_client_pool.py [calls] [threads]
+"""
+import sys
+import json
+import time
+import logging
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pymacaron_core.swagger.api import API
+
+
+yaml_str = """
+swagger: '2.0'
+info:
+  version: '0.0.1'
+host: 127.0.0.1
+schemes:
+  - http
+produces:
+  - application/json
+paths:
+  /v1/foo:
+    get:
+      produces:
+        - application/json
+      x-bind-server: pymacaron_core.test.return_token
+      x-bind-client: get_foo
+      responses:
+        '200':
+          description: result
+          schema:
+            $ref: '#/definitions/Foo'
+definitions:
+  Foo:
+    type: object
+    description: foo
+    properties:
+      foo:
+        type: string
+        description: blabla
+"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = json.dumps({'foo': 'bar'}).encode('utf-8')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class NoPoolTransport():
+    """The behavior before pooling: one throwaway session per call"""
+
+    def get_method(self, method):
+        return getattr(requests, method)
+
+
+def bench(api, calls, threads):
+    def run():
+        for i in range(calls // threads):
+            api.client.get_foo()
+
+    ts = [threading.Thread(target=run) for i in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return calls / (time.perf_counter() - t0)
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    logging.disable(logging.CRITICAL)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    api = API('bench', yaml_str=yaml_str, port=port, pool_size=threads, preconnect=threads)
+    pooled = bench(api, calls, threads)
+
+    api = API('bench', yaml_str=yaml_str, port=port, pool_size=threads, preconnect=threads, transport='urllib3')
+    lean = bench(api, calls, threads)
+
+    api.transport = NoPoolTransport()
+    api._generate_client_callers()
+    unpooled = bench(api, calls, threads)
+
+    print("%s calls, %s threads" % (calls, threads))
+    print("  requests.<method> per call: %8.1f calls/sec" % unpooled)
+    print("  pooled requests session:    %8.1f calls/sec (x%.2f)" % (pooled, pooled / unpooled))
+    print("  pooled urllib3 transport:   %8.1f calls/sec (x%.2f)" % (lean, lean / unpooled))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import functools
+import contextvars
+
+
+# The context of the call being handled: set by the server's handler wrapper
+# and read by the client callers to pass on PymCallID and PymCallPath. Being
+# contextvars, they follow asyncio tasks and are isolated between threads.
+_call_id = contextvars.ContextVar('pym_call_id', default=None)
+_call_path = contextvars.ContextVar('pym_call_path', default=None)
+_span = contextvars.ContextVar('pym_span', default=None)
+_timing = contextvars.ContextVar('pym_timing', default=None)
+
+_vars = {
+    'call_id': _call_id,
+    'call_path': _call_path,
+    'span': _span,
+    'timing': _timing,
+}
+
+
+def get_call_id():
+    """Return the PymCallID of the call being handled, or None"""
+    return _call_id.get()
+
+
+def get_call_path():
+    """Return the PymCallPath of the call being handled, or None"""
+    return _call_path.get()
+
+
+def get_span():
+    """Return the tracing span of the call being handled, or None"""
+    return _span.get()
+
+
+def get_timing():
+    """Return the RequestTiming of the call being handled, or None"""
+    return _timing.get()
+
+
+def set_call_context(**values):
+    """Set some of call_id, call_path, span and timing in the current context,
+    and return a token to pass to reset_call_context() to restore their
+    previous values"""
+    return [_vars[k].set(v) for k, v in values.items()]
+
+
+def reset_call_context(token):
+    """Restore the call context as it was before set_call_context()"""
+    for t in reversed(token):
+        t.var.reset(t)
+
+
+def copy_call_context():
+    """Return a copy of the current context, to run code in another thread with
+    context.run(f, *args)"""
+    return contextvars.copy_context()
+
+
+def with_call_context(f):
+    """Return a function calling f within a copy of the current call context,
+    suitable for passing to another thread or executor"""
+    context = contextvars.copy_context()
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(f, *args, **kwargs)
+
+    return wrapper
+
+
+def scoped_call_context(f):
+    """Decorate f to run in a copy of the current context, so that the call
+    context it sets does not outlive it"""
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        return contextvars.copy_context().run(f, *args, **kwargs)
+
+    return wrapper
+
+
+def submit(executor, f, *args, **kwargs):
+    """Like executor.submit(f, *args, **kwargs), but running f within a copy of
+    the current call context"""
+    return executor.submit(contextvars.copy_context().run, f, *args, **kwargs)
@@ -24,6 +24,12 @@ class MergeApisException(PyMacaronCoreException):
 class PyMacaronModelException(PyMacaronCoreException):
     status_code = 500
 
+class CircuitOpenError(PyMacaronCoreException):
+    status_code = 503
+
+class RequestTooLargeError(ValidationError):
+    status_code = 413
+
 def add_error_handlers(app):
     """Add custom error handlers for PyMacaronCoreExceptions to the app"""
 
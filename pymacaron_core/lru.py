@@ -0,0 +1,59 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache():
+    """A thread-safe dict holding at most max_size items, evicting the least
+    recently used ones first. Items may be given a time-to-live in seconds,
+    after which get() no longer returns them."""
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        """Return the value stored under key, or default if there is none or it
+        expired"""
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.items[key]
+                return default
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, for ttl seconds if ttl is not None. Return the
+        number of items evicted to make room for it"""
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        evicted = 0
+        with self.lock:
+            self.items[key] = (value, expires_at)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        return evicted
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.items.pop(key, None)
+        return item[0] if item else default
+
+    def keys(self):
+        with self.lock:
+            return list(self.items.keys())
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
@@ -0,0 +1,252 @@
+import threading
+import logging
+from bisect import bisect_left
+
+
+log = logging.getLogger(__name__)
+
+
+# Upper bounds of histogram buckets, in seconds for latencies and in bytes for
+# payload sizes. They are fixed so that observing a value is a bisect and an
+# increment, and nothing more.
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    s = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs)
+    return '{%s}' % s
+
+
+def _format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+class Counter():
+    """A monotonic counter, with one value per tuple of label values"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, labelvalues=(), amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def get(self, labelvalues=()):
+        return self.values.get(tuple(labelvalues), 0)
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def expose(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for labelvalues, value in items:
+            yield '%s%s %s' % (self.name, _format_labels(self.labelnames, labelvalues), _format_value(value))
+
+
+class Histogram():
+    """A histogram with fixed buckets, with one set of buckets per tuple of
+    label values"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # labelvalues => [count per bucket..., count in +Inf, sum]
+        self.values = {}
+
+    def observe(self, labelvalues=(), value=0):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            v = self.values.get(labelvalues)
+            if v is None:
+                v = [0] * (len(self.buckets) + 2)
+                self.values[labelvalues] = v
+            v[i] += 1
+            v[-1] += value
+
+    def get_count(self, labelvalues=()):
+        v = self.values.get(tuple(labelvalues))
+        return sum(v[:-1]) if v else 0
+
+    def get_sum(self, labelvalues=()):
+        v = self.values.get(tuple(labelvalues))
+        return v[-1] if v else 0
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def expose(self):
+        with self.lock:
+            items = sorted((k, list(v)) for k, v in self.values.items())
+        bounds = self.buckets + (float('inf'),)
+        for labelvalues, v in items:
+            cumulated = 0
+            for bound, count in zip(bounds, v):
+                cumulated += count
+                yield '%s_bucket%s %s' % (self.name, _format_labels(self.labelnames, labelvalues, ('le', _format_value(float(bound)))), cumulated)
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield '%s_sum%s %s' % (self.name, labels, _format_value(v[-1]))
+            yield '%s_count%s %s' % (self.name, labels, cumulated)
+
+
+class MetricsRegistry():
+    """Hold all metrics of this process and render them in the Prometheus text
+    exposition format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self.lock:
+            m = self.metrics.get(name)
+            if m is None:
+                m = cls(name, *args, **kwargs)
+                self.metrics[name] = m
+            elif not isinstance(m, cls):
+                raise Exception("Metric %s is already registered as a %s" % (name, m.type_name))
+            return m
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def clear(self):
+        """Reset all metric values (but keep the metrics registered)"""
+        for m in list(self.metrics.values()):
+            m.clear()
+
+    def expose(self):
+        """Return all metrics as a string in the Prometheus text format"""
+        lines = []
+        for name in sorted(self.metrics.keys()):
+            m = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, m.documentation))
+            lines.append('# TYPE %s %s' % (name, m.type_name))
+            lines.extend(m.expose())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+#
+# Metrics recorded by the server and client stubs. Labels are (api, method, path)
+# where path is the endpoint's path as declared in the swagger spec, so as to
+# keep a bounded number of label values.
+#
+
+ENDPOINT_LABELS = ('api', 'method', 'path')
+
+server_requests = registry.counter('pym_server_requests_total', 'Requests handled by the server stub', ENDPOINT_LABELS + ('status',))
+server_latency = registry.histogram('pym_server_request_duration_seconds', 'Time spent in the server stub, in seconds', ENDPOINT_LABELS)
+server_request_bytes = registry.histogram('pym_server_request_bytes', 'Size of request bodies received by the server stub', ENDPOINT_LABELS, buckets=SIZE_BUCKETS)
+server_response_bytes = registry.histogram('pym_server_response_bytes', 'Size of response bodies returned by the server stub', ENDPOINT_LABELS, buckets=SIZE_BUCKETS)
+server_cache = registry.counter('pym_server_cache_total', 'Lookups in the server response cache, by result (hit or miss)', ENDPOINT_LABELS + ('result',))
+server_cache_evictions = registry.counter('pym_server_cache_evictions_total', 'Responses evicted from the server response cache to make room for those of this endpoint', ENDPOINT_LABELS)
+server_coalesced = registry.counter('pym_server_coalesced_total', 'Requests that shared the response of an identical request in flight', ENDPOINT_LABELS)
+
+client_requests = registry.counter('pym_client_requests_total', 'Calls made by the client stub', ENDPOINT_LABELS + ('status',))
+client_latency = registry.histogram('pym_client_request_duration_seconds', 'Time spent in client calls, including retries, in seconds', ENDPOINT_LABELS)
+client_request_bytes = registry.histogram('pym_client_request_bytes', 'Size of request bodies sent by the client stub', ENDPOINT_LABELS, buckets=SIZE_BUCKETS)
+client_response_bytes = registry.histogram('pym_client_response_bytes', 'Size of response bodies received by the client stub', ENDPOINT_LABELS, buckets=SIZE_BUCKETS)
+client_retries = registry.counter('pym_client_retries_total', 'Retries made by the client stub', ENDPOINT_LABELS)
+client_circuit_rejected = registry.counter('pym_client_circuit_rejected_total', 'Calls not made by the client stub because the circuit breaker of the api\'s host was open', ENDPOINT_LABELS)
+client_cache = registry.counter('pym_client_cache_total', 'Lookups in the client stub\'s response cache, by result (hit, miss, revalidated or delta)', ENDPOINT_LABELS + ('result',))
+client_hedges = registry.counter('pym_client_hedges_total', 'Hedged requests sent by the client stub', ENDPOINT_LABELS)
+client_hedges_won = registry.counter('pym_client_hedges_won_total', 'Hedged requests that answered before the original request', ENDPOINT_LABELS)
+client_coalesced = registry.counter('pym_client_coalesced_total', 'Calls that shared the response of an identical call in flight', ENDPOINT_LABELS)
+client_retries_throttled = registry.counter('pym_client_retries_throttled_total', 'Retries not made by the client stub because the api\'s retry budget was exhausted', ENDPOINT_LABELS)
+
+
+def observe_server_request(labels, status, duration, request_bytes, response_bytes):
+    """Record one request handled by a server endpoint"""
+    server_requests.inc(labels + (str(status),))
+    server_latency.observe(labels, duration)
+    server_request_bytes.observe(labels, request_bytes)
+    if response_bytes is not None:
+        server_response_bytes.observe(labels, response_bytes)
+
+
+def observe_server_cache(labels, result):
+    """Record a lookup in the server response cache"""
+    server_cache.inc(labels + (result,))
+
+
+def observe_server_cache_evictions(labels, count):
+    """Record responses evicted from the server response cache"""
+    server_cache_evictions.inc(labels, count)
+
+
+def observe_server_coalesced(labels):
+    """Record a request that got the response of an identical request in flight"""
+    server_coalesced.inc(labels)
+
+
+def observe_client_call(labels, status, duration, request_bytes, response_bytes, retries):
+    """Record one call made by a client stub"""
+    client_requests.inc(labels + (str(status),))
+    client_latency.observe(labels, duration)
+    client_request_bytes.observe(labels, request_bytes)
+    if response_bytes is not None:
+        client_response_bytes.observe(labels, response_bytes)
+    if retries:
+        client_retries.inc(labels, retries)
+
+
+def observe_client_retry_throttled(labels):
+    """Record a retry prevented by the retry budget"""
+    client_retries_throttled.inc(labels)
+
+
+def observe_client_circuit_rejected(labels):
+    """Record a call rejected by an open circuit breaker"""
+    client_circuit_rejected.inc(labels)
+
+
+def observe_client_cache(labels, result):
+    """Record a lookup in the client response cache"""
+    client_cache.inc(labels + (result,))
+
+
+def observe_client_hedge_issued(labels):
+    """Record a hedged request"""
+    client_hedges.inc(labels)
+
+
+def observe_client_hedge_won(labels):
+    """Record a hedged request answering first"""
+    client_hedges_won.inc(labels)
+
+
+def observe_client_coalesced(labels):
+    """Record a call that got the result of an identical call in flight"""
+    client_coalesced.inc(labels)
@@ -0,0 +1,116 @@
+import os
+import re
+import hmac
+import pstats
+import logging
+import cProfile
+import threading
+import itertools
+
+
+log = logging.getLogger(__name__)
+
+
+# Header that a caller can set to the profiler's token to force profiling
+PROFILE_HEADER = 'PymProfile'
+
+
+class RequestProfiler():
+    """Profile some of the requests handled by server endpoints with cProfile,
+    and aggregate the results per endpoint into pstats files. Disabled until
+    configure() is called."""
+
+    def __init__(self):
+        self.directory = None
+        self.sample_every = 0
+        self.token = None
+        self.counters = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        # Only one request is profiled at a time
+        self.running = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def configure(self, directory=None, sample_every=0, token=None):
+        """Start profiling 1 in sample_every requests of each endpoint, as well as
+        requests having the header 'PymProfile' set to token. Results are written
+        to one pstats file per endpoint in directory."""
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self.lock:
+            self.directory = directory
+            self.sample_every = sample_every or 0
+            self.token = token
+            self.counters = {}
+            self.stats = {}
+
+    def disable(self):
+        self.configure(directory=None)
+
+    def should_profile(self, key, headers):
+        """Tell whether to profile this request to the endpoint identified by key"""
+        if self.token:
+            v = headers.get(PROFILE_HEADER, None)
+            if v and hmac.compare_digest(v, self.token):
+                return True
+        if self.sample_every:
+            c = self.counters.get(key)
+            if c is None:
+                c = self.counters.setdefault(key, itertools.count(1))
+            return next(c) % self.sample_every == 0
+        return False
+
+    def get_path(self, key):
+        """Return the path of the pstats file for the endpoint identified by key"""
+        name = re.sub(r'[^A-Za-z0-9\-]+', '_', '_'.join(str(k) for k in key)).strip('_')
+        return os.path.join(self.directory, '%s.pstats' % name)
+
+    def run(self, key, f, *args, **kwargs):
+        """Call f under cProfile and add its stats to those of that endpoint"""
+        if not self.running.acquire(blocking=False):
+            # Another request is being profiled
+            return f(*args, **kwargs)
+
+        try:
+            p = cProfile.Profile()
+            try:
+                p.enable()
+            except ValueError as e:
+                # Another profiler is already active (python >= 3.12)
+                log.info("Cannot profile request: %s" % str(e))
+                return f(*args, **kwargs)
+
+            try:
+                return f(*args, **kwargs)
+            finally:
+                p.disable()
+                self._add_stats(key, p)
+        finally:
+            self.running.release()
+
+    def _add_stats(self, key, p):
+        directory = self.directory
+        if not directory:
+            return
+        try:
+            with self.lock:
+                s = self.stats.get(key)
+                if s is None:
+                    s = pstats.Stats(p)
+                    self.stats[key] = s
+                else:
+                    s.add(p)
+                s.dump_stats(self.get_path(key))
+        except Exception as e:
+            log.warn("Failed to write profile of %s: %s" % (key, str(e)))
+
+
+profiler = RequestProfiler()
+
+
+def configure_profiling(directory=None, sample_every=0, token=None):
+    """Configure the process-wide request profiler. See RequestProfiler.configure()"""
+    profiler.configure(directory=directory, sample_every=sample_every, token=token)
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class Flight():
+    """A call in flight, whose outcome is shared by all identical calls made
+    while it runs"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight():
+    """Coalesce identical concurrent calls: while a call with a given key is
+    in flight, other calls with the same key wait for it and get its result
+    (or exception) instead of running again. Calls are keyed by url, query
+    parameters and key_headers (those that change the response, such as
+    'Authorization').
+
+    Results are shared between calls: do not modify them."""
+
+    def __init__(self, key_headers=('Authorization',)):
+        self.key_headers = key_headers
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def get_key(self, url, params, headers):
+        key = [url]
+        if params:
+            key.append(tuple(sorted((k, str(v)) for k, v in params.items())))
+        if headers:
+            key.append(tuple(headers.get(h) for h in self.key_headers))
+        return tuple(key)
+
+    def do(self, key, f, *args, **kwargs):
+        """Return f(*args, **kwargs), or the result of the identical call in
+        flight if any. Return a tuple (result, coalesced)"""
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            return flight.result, True
+
+        try:
+            flight.result = f(*args, **kwargs)
+            return flight.result, False
+        except BaseException as e:
+            flight.exception = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    async def async_do(self, key, f, *args, **kwargs):
+        """Same as do(), for a coroutine function f. Calls are only coalesced
+        with those made in the same event loop"""
+        key = (id(asyncio.get_event_loop()),) + key
+        with self.lock:
+            future = self.flights.get(key)
+            leader = future is None
+            if leader:
+                future = self.flights[key] = asyncio.ensure_future(f(*args, **kwargs))
+
+        try:
+            # A cancelled waiter must not cancel the shared call
+            return await asyncio.shield(future), not leader
+        finally:
+            if leader:
+                with self.lock:
+                    if self.flights.get(key) is future:
+                        del self.flights[key]
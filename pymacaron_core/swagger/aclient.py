@@ -0,0 +1,299 @@
+import time
+import asyncio
+import logging
+import weakref
+from requests.exceptions import ReadTimeout, ConnectTimeout, ConnectionError
+from pymacaron_core.exceptions import PyMacaronCoreException, ValidationError, CircuitOpenError
+from pymacaron_core.utils import get_function
+from pymacaron_core.tracing import tracer
+from pymacaron_core.swagger.client import ClientCaller, _generate_request_arguments, _pop_client_kwargs, _start_client_span, _get_hedger, _compress_request
+from pymacaron_core.swagger.retry import RetryPolicy
+from pymacaron_core.swagger.breaker import CircuitBreakerPolicy
+from pymacaron_core.swagger.codec import json_codec
+
+
+log = logging.getLogger(__name__)
+
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncResponse():
+    """The subset of a requests Response used by the client callers, built from
+    an aiohttp response whose body has been read"""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.raw_bytes = content
+
+    @property
+    def text(self):
+        charset = 'utf-8'
+        ctype = self.headers.get('Content-Type', '')
+        if 'charset=' in ctype:
+            charset = ctype.split('charset=')[-1].split(';')[0].strip()
+        return self.content.decode(charset, errors='replace')
+
+    def json(self):
+        return json_codec.loads(self.content)
+
+
+def _to_query(params):
+    """Turn query parameters into a list of (key, value) acceptable by aiohttp,
+    formatted as requests would"""
+    query = []
+    for k, v in params.items():
+        for vv in (v if type(v) in (list, tuple) else [v]):
+            if vv is None:
+                continue
+            if type(vv) in (bool, float) or not isinstance(vv, (str, int)):
+                vv = str(vv)
+            query.append((k, vv))
+    return query
+
+
+class AiohttpTransport():
+    """Send the HTTP requests of an API's async client callers via aiohttp, with
+    one connection pool per event loop, shared by all the async callers of
+    that API.
+
+    get_method(method) returns a coroutine function with the same signature
+    and exceptions as requests.get/post/etc.
+    """
+
+    def __init__(self, pool_size=10, keep_alive=True, verify_ssl=True):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.verify_ssl = verify_ssl
+        self.sessions = weakref.WeakKeyDictionary()
+
+    def get_session(self):
+        """Return the aiohttp session of the running event loop"""
+        if not aiohttp:
+            raise PyMacaronCoreException("Async client callers require the 'aiohttp' package")
+        loop = asyncio.get_running_loop()
+        session = self.sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.pool_size,
+                force_close=not self.keep_alive,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+            self.sessions[loop] = session
+        return session
+
+    def get_method(self, method):
+        method = method.upper()
+
+        async def request(url, data=None, params=None, headers=None, timeout=None, verify=True):
+            return await self.request(method, url, data=data, params=params, headers=headers, timeout=timeout, verify=verify)
+
+        return request
+
+    async def request(self, method, url, data=None, params=None, headers=None, timeout=None, verify=True):
+        session = self.get_session()
+        kwargs = {}
+        if type(timeout) is tuple:
+            kwargs['timeout'] = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        elif timeout:
+            kwargs['timeout'] = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+        if not verify:
+            kwargs['ssl'] = False
+
+        connect_timeout_error = getattr(aiohttp, 'ConnectionTimeoutError', ())
+        try:
+            async with session.request(
+                method,
+                url,
+                data=data,
+                params=_to_query(params) if params else None,
+                headers=headers,
+                **kwargs
+            ) as r:
+                content = await r.read()
+                return AsyncResponse(r.status, r.headers, content)
+        except connect_timeout_error as e:
+            raise ConnectTimeout(e)
+        except asyncio.TimeoutError as e:
+            raise ReadTimeout(e)
+        except aiohttp.ClientConnectionError as e:
+            raise ConnectionError(e)
+
+    async def close(self):
+        """Close the connection pool of the running event loop"""
+        loop = asyncio.get_running_loop()
+        session = self.sessions.pop(loop, None)
+        if session:
+            await session.close()
+
+
+class AsyncClientCaller(ClientCaller):
+    """A ClientCaller awaiting an async requests_method"""
+
+    async def _send(self):
+        backend = self.backend
+        if backend:
+            backend.start()
+        t0 = time.perf_counter()
+        response = None
+        try:
+            if self.hedger:
+                delay = self.hedger.get_delay(self.hedge_delay)
+                response = await self.hedger.async_call(delay, self.requests_method, self.url, **self._get_request_kwargs())
+            else:
+                response = await self.requests_method(self.url, **self._get_request_kwargs())
+            return response
+        finally:
+            if backend:
+                backend.finish(time.perf_counter() - t0, failed=response is None or str(response.status_code).startswith('5'))
+
+    async def _call_retry(self, force_retry):
+        last_exception = None
+        for i in range(self.max_attempts):
+            if i > 0:
+                delay = self._get_retry_delay(i - 1)
+                if delay is None:
+                    break
+                if delay:
+                    await asyncio.sleep(delay)
+
+            self._check_circuit()
+            self.attempts = i + 1
+            try:
+                log.info("Calling %s %s" % (self.method, self.url))
+                response = await self._send()
+            except Exception as e:
+                self._record_outcome(None)
+                last_exception = e
+                if self._should_retry(e, force_retry):
+                    continue
+                else:
+                    raise e
+
+            self._record_outcome(response)
+
+            if response is None:
+                self._check_empty_response()
+                continue
+
+            return response
+
+        self._give_up(last_exception)
+
+    async def call(self, force_retry=False):
+        cached = self._get_cached()
+        if cached and cached.is_fresh():
+            return cached.result
+
+        if not self.singleflight:
+            return await self._call(cached, force_retry)
+
+        key = self.singleflight.get_key(self.url, self.params, self.headers)
+        result, coalesced = await self.singleflight.async_do(key, self._call, cached, force_retry)
+        self._observe_coalesced(coalesced)
+        return result
+
+    async def _call(self, cached, force_retry):
+        if self.retry_policy:
+            self.retry_policy.on_call()
+        t0 = time.perf_counter()
+        response = None
+        try:
+            response = await self._call_retry(force_retry)
+        except CircuitOpenError as e:
+            return self._fail_fast(e)
+        finally:
+            self._observe(response, time.perf_counter() - t0)
+        return self._to_result(response, cached)
+
+
+def generate_async_client_callers(spec, timeout, error_callback, api_name=None, transport=None, retry_policy=None, circuit_breaker=None, cache=None, balancer=None, singleflight=None, compress_min_size=None, compress_level=6, prefer_msgpack=False):
+    """Return a dict mapping method names to coroutine functions that call the
+    server's endpoint of the corresponding name, like the callers returned by
+    generate_client_callers() but without blocking the event loop"""
+
+    callers_dict = {}
+
+    if not transport:
+        transport = AiohttpTransport(verify_ssl=spec.verify_ssl)
+    if not retry_policy:
+        retry_policy = RetryPolicy()
+    if circuit_breaker is None:
+        circuit_breaker = CircuitBreakerPolicy()
+
+    def mycallback(endpoint):
+        if not endpoint.handler_client:
+            return
+
+        callers_dict[endpoint.handler_client] = _generate_async_client_caller(spec, endpoint, timeout, error_callback, api_name, transport, retry_policy, circuit_breaker, cache, balancer, singleflight, compress_min_size, compress_level, prefer_msgpack)
+
+    spec.call_on_each_endpoint(mycallback)
+
+    return callers_dict
+
+
+def _generate_async_client_caller(spec, endpoint, timeout, error_callback, api_name, transport, retry_policy, circuit_breaker, cache, balancer, singleflight=None, compress_min_size=None, compress_level=6, prefer_msgpack=False):
+
+    if balancer:
+        url = endpoint.path.lstrip('/')
+    else:
+        url = "%s://%s:%s/%s" % (
+            spec.protocol,
+            spec.host,
+            spec.port,
+            endpoint.path.lstrip('/')
+        )
+
+    method = endpoint.method.lower()
+    if method not in ('get', 'post', 'patch', 'put', 'delete'):
+        raise PyMacaronCoreException("BUG: method %s for %s is not supported. Only get and post are." %
+                                     (endpoint.method, endpoint.path))
+
+    metric_labels = (api_name or '', endpoint.method, endpoint.path)
+    span_name = '%s %s %s' % (api_name or '', endpoint.method, endpoint.path)
+
+    requests_method = transport.get_method(method)
+    if endpoint.decorate_request:
+        requests_method = get_function(endpoint.decorate_request)(requests_method)
+
+    breaker = circuit_breaker.get('%s:%s' % (spec.host, spec.port)) if circuit_breaker and not balancer else None
+
+    if cache and not cache.is_enabled(endpoint):
+        cache = None
+
+    hedger = _get_hedger(endpoint, metric_labels)
+
+    if endpoint.method != 'GET':
+        singleflight = None
+
+    async def aclient(*args, **kwargs):
+        """Call the server endpoint asynchronously and handle marshaling/unmarshaling
+        of parameters/result. Takes the same arguments as the sync client caller."""
+
+        headers, max_attempts, read_timeout, connect_timeout, hedge_delay = _pop_client_kwargs(kwargs, timeout)
+
+        custom_url, params, data, headers = _generate_request_arguments(url, spec, endpoint, headers, args, kwargs, prefer_msgpack)
+
+        if '<' in custom_url:
+            # Some arguments were missing
+            return error_callback(ValidationError("Missing some arguments to format url: %s" % custom_url))
+
+        data = _compress_request(data, headers, compress_min_size, compress_level)
+
+        caller = AsyncClientCaller(requests_method, custom_url, data, params, headers, read_timeout, connect_timeout, endpoint.operation, endpoint.method, error_callback, max_attempts, spec.verify_ssl, metric_labels=metric_labels, retry_policy=retry_policy, breaker=breaker, cache=cache, hedger=hedger, hedge_delay=hedge_delay, balancer=balancer, singleflight=singleflight, delta=endpoint.delta)
+        span = _start_client_span(span_name, headers)
+        try:
+            return await caller.call()
+        finally:
+            if span:
+                tracer.finish(span, url=custom_url, attempts=caller.attempts)
+
+    return aclient
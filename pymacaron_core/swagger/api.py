@@ -1,9 +1,18 @@
 import yaml
 import logging
-from pymacaron_core.swagger.server import spawn_server_api
+from pymacaron_core.swagger.server import spawn_server_api, add_metrics_route
 from pymacaron_core.swagger.client import generate_client_callers
+from pymacaron_core.swagger.aclient import generate_async_client_callers, AiohttpTransport
 from pymacaron_core.swagger.spec import ApiSpec
+from pymacaron_core.swagger.transport import get_transport
+from pymacaron_core.swagger.retry import RetryPolicy
+from pymacaron_core.swagger.breaker import CircuitBreakerPolicy
+from pymacaron_core.swagger.httpcache import ClientCache
+from pymacaron_core.swagger.balancer import Balancer
+from pymacaron_core.singleflight import SingleFlight
 from pymacaron_core.models import get_model
+from pymacaron_core.exceptions import PyMacaronCoreException
+from pymacaron_core.watchdog import watchdog
 
 
 log = logging.getLogger(__name__)
@@ -34,6 +43,12 @@ def generate_model_instantiator(model_name, definitions):
     return instantiate_model
 
 
+def _generate_async_local_caller(caller):
+    async def acaller(*args, **kwargs):
+        return caller(*args, **kwargs)
+    return acaller
+
+
 class API():
     """Describes a REST client/server API, with sugar coating:
     - easily instantiating the objects defined in the API
@@ -42,14 +57,40 @@ class API():
     usage: See apipool.py
     """
 
-    def __init__(self, name, yaml_str=None, yaml_path=None, timeout=10, error_callback=None, formats=None, do_persist=True, host=None, port=None, local=False, proto=None, verify_ssl=True):
-        """An API Specification"""
+    def __init__(self, name, yaml_str=None, yaml_path=None, timeout=10, error_callback=None, formats=None, do_persist=True, host=None, port=None, local=False, proto=None, verify_ssl=True, pool_size=10, keep_alive=True, preconnect=0, transport=None, retry_policy=None, circuit_breaker=None, client_cache=None, hosts=None, local_dispatch='test_client', coalesce=False, compress_min_size=None, compress_level=6, prefer_msgpack=False):
+        """An API Specification. Client calls to the API share a pool of up to
+        pool_size connections per host, kept alive between calls unless
+        keep_alive is false. If preconnect is set, that many connections are
+        opened right away. transport is the name of the HTTP backend sending
+        client calls ('requests', the default, or 'urllib3') or a Transport
+        instance. retry_policy is the RetryPolicy deciding when and how fast
+        client calls are retried (by default, an exponential backoff and a
+        budget of retries of 10% of calls). circuit_breaker is the
+        CircuitBreakerPolicy making client calls fail fast when the api's host
+        is down, or False to disable circuit breaking. If client_cache is true
+        (or a ClientCache), the results of all GET client calls are cached,
+        otherwise only those of endpoints with 'x-client-cache: true'. hosts is
+        an optional list of 'host' or 'host:port' serving the api, over which
+        client calls are load balanced. local_dispatch tells how local client
+        calls reach the api's server: 'test_client' (the default) sends them
+        through flask's test_client, while 'direct' calls the endpoint
+        handlers in-process, skipping the flask request and the json
+        serialization but not validation or the global decorator. If coalesce is true (or a
+        SingleFlight), identical concurrent GET client calls share one request
+        and its result. If compress_min_size is set, client calls send json
+        bodies of at least that many bytes gzip compressed at compress_level
+        (1 to 9). If prefer_msgpack
+        is true, client calls to endpoints that list 'application/msgpack' in
+        their 'produces' or 'consumes' use MessagePack instead of json."""
 
         self.name = name
 
         # Is the endpoint callable directly as a python method from within the server?
         # (true is the flask server also serves that api)
         self.local = local
+        if local_dispatch not in ('test_client', 'direct'):
+            raise PyMacaronCoreException("Invalid local_dispatch '%s': should be 'test_client' or 'direct'" % local_dispatch)
+        self.local_dispatch = local_dispatch
 
         # Callback to handle exceptions
         self.error_callback = default_error_callback
@@ -61,6 +102,9 @@ class API():
         # Object holding the client side code to call the API
         self.client = APIClient()
 
+        # Same, but with coroutines for use with asyncio
+        self.aclient = APIClient()
+
         # Object holding constructors for the API's objects
         self.model = APIModels()
 
@@ -81,7 +125,41 @@ class API():
         else:
             raise Exception("No swagger file specified")
 
-        self.api_spec = ApiSpec(swagger_dict, formats, host, port, proto, verify_ssl)
+        self.api_spec = ApiSpec(swagger_dict, formats, host, port, proto, verify_ssl, hosts=hosts)
+
+        # HTTP connection pool shared by all client callers of this API
+        self.transport = get_transport(transport, pool_size=pool_size, keep_alive=keep_alive, verify_ssl=self.api_spec.verify_ssl)
+        self.async_transport = AiohttpTransport(pool_size=pool_size, keep_alive=keep_alive, verify_ssl=self.api_spec.verify_ssl)
+
+        # Retry backoff and budget shared by all client callers of this API
+        self.retry_policy = retry_policy or RetryPolicy()
+
+        # Circuit breakers shared by the sync and async client callers
+        self.circuit_breaker = CircuitBreakerPolicy() if circuit_breaker is None else circuit_breaker
+
+        # Cache of the results of GET client calls
+        if isinstance(client_cache, ClientCache):
+            self.client_cache = client_cache
+        else:
+            self.client_cache = ClientCache(all_endpoints=bool(client_cache))
+
+        # Coalescing of identical concurrent GET client calls
+        if isinstance(coalesce, SingleFlight):
+            self.singleflight = coalesce
+        else:
+            self.singleflight = SingleFlight() if coalesce else None
+
+        # Minimum size of request bodies to compress
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+
+        # Should client calls use MessagePack where the api supports it?
+        self.prefer_msgpack = prefer_msgpack
+
+        # Load balancer, if the api is served by several hosts
+        self.balancer = None
+        if len(self.api_spec.hosts) > 1:
+            self.balancer = Balancer(self.api_spec.protocol, self.api_spec.hosts, circuit_breaker=self.circuit_breaker, failure_penalty=self.client_timeout)
 
         model_names = self.api_spec.load_models(do_persist=do_persist)
 
@@ -97,30 +175,73 @@ class API():
         # 'ApiPool.<api_name>.call.login(param)' to call the login endpoint
         self._generate_client_callers()
 
+        if preconnect:
+            for url in self.get_base_urls():
+                self.transport.preconnect(url, preconnect)
+
 
-    def _generate_client_callers(self, app=None):
+    def _generate_client_callers(self, app=None, direct_handlers=None):
         # If app is defined, we are doing local calls
         if app:
-            callers_dict = generate_client_callers(self.api_spec, self.client_timeout, self.error_callback, True, app)
+            callers_dict = generate_client_callers(self.api_spec, self.client_timeout, self.error_callback, True, app, api_name=self.name, direct_handlers=direct_handlers)
         else:
-            callers_dict = generate_client_callers(self.api_spec, self.client_timeout, self.error_callback, False, None)
+            callers_dict = generate_client_callers(self.api_spec, self.client_timeout, self.error_callback, False, None, api_name=self.name, transport=self.transport, retry_policy=self.retry_policy, circuit_breaker=self.circuit_breaker, cache=self.client_cache, balancer=self.balancer, singleflight=self.singleflight, compress_min_size=self.compress_min_size, compress_level=self.compress_level, prefer_msgpack=self.prefer_msgpack)
 
         for method, caller in list(callers_dict.items()):
             setattr(self.client, method, caller)
 
-
-    def spawn_api(self, app, decorator=None):
-        """Auto-generate server endpoints implementing the API into this Flask app"""
+        # And the async versions of the same callers, so a developer may write:
+        # 'await ApiPool.<api_name>.aclient.login(param)'
+        if app:
+            # Local calls do not go over the network anyway
+            acallers_dict = {method: _generate_async_local_caller(caller) for method, caller in callers_dict.items()}
+        else:
+            acallers_dict = generate_async_client_callers(self.api_spec, self.client_timeout, self.error_callback, api_name=self.name, transport=self.async_transport, retry_policy=self.retry_policy, circuit_breaker=self.circuit_breaker, cache=self.client_cache, balancer=self.balancer, singleflight=self.singleflight, compress_min_size=self.compress_min_size, compress_level=self.compress_level, prefer_msgpack=self.prefer_msgpack)
+
+        for method, caller in list(acallers_dict.items()):
+            setattr(self.aclient, method, caller)
+
+
+    def spawn_api(self, app, decorator=None, metrics_path=None, server_timing=False, watchdog_threshold=None, compress_level=0, compress_min_size=1024, max_decompressed_size=10 * 1024 * 1024):
+        """Auto-generate server endpoints implementing the API into this Flask app.
+        If metrics_path is set, also add a route at that path that returns
+        client and server metrics in the Prometheus text format.
+        If server_timing is true, add a 'Server-Timing' header to every response.
+        If watchdog_threshold is set, start a watchdog thread logging stack samples
+        of requests taking longer than that many seconds (or than the endpoint's
+        'x-watchdog-threshold').
+        If compress_level is set (1 to 9), compress responses of at least
+        compress_min_size bytes with gzip or deflate, as accepted by the caller.
+        Compressed request bodies may decompress to at most max_decompressed_size
+        bytes (or the app's MAX_CONTENT_LENGTH, if lower).
+        """
         if decorator:
             assert type(decorator).__name__ == 'function'
         self.is_server = True
         self.app = app
 
+        if metrics_path:
+            add_metrics_route(app, metrics_path)
+
+        if watchdog_threshold:
+            watchdog.start(threshold=watchdog_threshold)
+
+        direct_handlers = spawn_server_api(self.name, app, self.api_spec, self.error_callback, decorator, server_timing=server_timing, compress_level=compress_level, compress_min_size=compress_min_size, max_decompressed_size=max_decompressed_size)
+
         if self.local:
             # Re-generate client callers, this time as local and passing them the app
-            self._generate_client_callers(app)
+            if self.local_dispatch != 'direct':
+                direct_handlers = None
+            self._generate_client_callers(app, direct_handlers)
+
+
+    def get_base_url(self):
+        """Return the url of the server the client calls"""
+        return "%s://%s:%s/" % (self.api_spec.protocol, self.api_spec.host, self.api_spec.port)
 
-        return spawn_server_api(self.name, app, self.api_spec, self.error_callback, decorator)
+    def get_base_urls(self):
+        """Return the urls of all the servers the client calls"""
+        return ["%s://%s:%s/" % (self.api_spec.protocol, host, port) for host, port in self.api_spec.hosts]
 
 
     def get_version(self):
@@ -2,6 +2,7 @@ import pprint
 import logging
 import copy
 from pymacaron_core.swagger.api import API
+from pymacaron_core.swagger.parallel import parallel
 from pymacaron_core.exceptions import MergeApisException
 
 
@@ -34,6 +35,12 @@ class ApiPool():
       param = api.model.Param(..)
       result = api.client.server_method(param)
 
+    To call multiple endpoints concurrently:
+      result1, result2 = ApiPool.parallel([
+          (api.client.server_method, [param]),
+          (api.client.other_method, [], {'arg': 'value'}),
+      ])
+
     Where result is an instance of the model returned by the endpoint
     bound to 'server_method' according to the 'x-bind-client' key in
     the YAML file.
@@ -47,6 +54,13 @@ class ApiPool():
         setattr(ApiPool, name, api)
         return api
 
+    @classmethod
+    def parallel(self, calls, max_workers=None, raise_errors=False):
+        """Run a list of client calls (f, args, kwargs) concurrently, passing on
+        the current call context, and return their results (or exceptions) in
+        order. See swagger.parallel"""
+        return parallel(calls, max_workers=max_workers, raise_errors=raise_errors)
+
     @property
     def current_server_name(self):
         names = []
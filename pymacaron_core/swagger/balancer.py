@@ -0,0 +1,87 @@
+import math
+import time
+import random
+import logging
+import threading
+from pymacaron_core.swagger.breaker import OPEN
+
+
+log = logging.getLogger(__name__)
+
+
+class Backend():
+    """One of the hosts serving an api, with its load: the number of requests in
+    flight and an exponentially weighted moving average of its latency. Failed
+    requests count as taking at least failure_penalty seconds, so that a host
+    failing fast does not look like the fastest one"""
+
+    def __init__(self, protocol, host, port, breaker=None, decay=10.0, failure_penalty=10.0):
+        self.host = host
+        self.port = port
+        self.name = '%s:%s' % (host, port)
+        self.base_url = '%s://%s:%s/' % (protocol, host, port)
+        self.breaker = breaker
+        self.decay = decay
+        self.failure_penalty = failure_penalty
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Record a request sent to this host"""
+        with self.lock:
+            self.outstanding += 1
+
+    def finish(self, duration, failed=False):
+        """Record a request answered, or failed, after duration seconds"""
+        if failed:
+            duration = max(duration, self.failure_penalty)
+        with self.lock:
+            self.outstanding -= 1
+            now = time.monotonic()
+            # Older latencies weigh less the longer ago they were observed
+            w = math.exp(-(now - self.last_update) / self.decay)
+            self.ewma = self.ewma * w + duration * (1 - w)
+            self.last_update = now
+
+    def get_cost(self):
+        # Hosts never called yet have no latency: try them first
+        return self.ewma * (self.outstanding + 1)
+
+    def is_available(self):
+        """Tell whether this host's circuit breaker would let a call through"""
+        b = self.breaker
+        if not b or b.state != OPEN:
+            return True
+        return time.monotonic() - b.opened_at >= b.open_duration
+
+
+class Balancer():
+    """Spread the client calls of an api over several hosts, by picking the
+    least loaded of two hosts chosen at random (power of two choices), the
+    load of a host being its latency (EWMA) times its number of requests in
+    flight. Hosts whose circuit breaker is open are ejected until it lets
+    probes through, and retries go to a host not tried yet by that call.
+    Failed requests weigh as much as failure_penalty seconds of latency (by
+    default the api's timeout)."""
+
+    def __init__(self, protocol, hosts, circuit_breaker=None, decay=10.0, failure_penalty=10.0):
+        self.backends = []
+        for host, port in hosts:
+            breaker = circuit_breaker.get('%s:%s' % (host, port)) if circuit_breaker else None
+            self.backends.append(Backend(protocol, host, port, breaker=breaker, decay=decay, failure_penalty=failure_penalty))
+
+    def pick(self, exclude=()):
+        """Return the host to send a call to, avoiding those in exclude if
+        possible, or None if all hosts are ejected"""
+        candidates = [b for b in self.backends if b not in exclude and b.is_available()]
+        if not candidates:
+            # All hosts were tried: retry on any that is available
+            candidates = [b for b in self.backends if b.is_available()]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        a, b = random.sample(candidates, 2)
+        return a if a.get_cost() <= b.get_cost() else b
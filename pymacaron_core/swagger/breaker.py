@@ -0,0 +1,105 @@
+import time
+import logging
+import threading
+from collections import deque
+
+
+log = logging.getLogger(__name__)
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker():
+    """The circuit breaker of one host: closed while the host answers, open
+    (rejecting all calls) once the rate of failed calls among the last 'window'
+    ones reaches 'failure_rate', and half-open (letting 'probes' calls through)
+    'open_duration' seconds later. The circuit closes again when the probes
+    succeed, or re-opens if one fails.
+
+    A call fails if it raises a connection error or a timeout, or returns an
+    empty response or a 5xx status."""
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=10, open_duration=5.0, probes=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_duration = open_duration
+        self.probes = probes
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = None
+        self.probes_inflight = 0
+        self.probes_succeeded = 0
+        self.lock = threading.Lock()
+
+    def _set_state(self, state):
+        log.warn("Circuit breaker for %s is now %s" % (self.name, state))
+        self.state = state
+        self.outcomes.clear()
+        self.probes_inflight = 0
+        self.probes_succeeded = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+
+    def allow(self):
+        """Return True if a call may be made now. Every allowed call must be
+        followed by a call to record()"""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_duration:
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.probes_inflight + self.probes_succeeded >= self.probes:
+                return False
+            self.probes_inflight += 1
+            return True
+
+    def record(self, success):
+        """Record the outcome of a call allowed by allow()"""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                if not self.probes_inflight:
+                    # A call made before the circuit opened
+                    return
+                self.probes_inflight -= 1
+                if not success:
+                    self._set_state(OPEN)
+                else:
+                    self.probes_succeeded += 1
+                    if self.probes_succeeded >= self.probes:
+                        self._set_state(CLOSED)
+            elif self.state == CLOSED:
+                self.outcomes.append(success)
+                if len(self.outcomes) >= self.min_calls:
+                    failures = self.outcomes.count(False)
+                    if failures >= self.failure_rate * len(self.outcomes):
+                        self._set_state(OPEN)
+
+
+class CircuitBreakerPolicy():
+    """The circuit breakers of an api, one per host it is called on, all
+    configured the same way (see CircuitBreaker)"""
+
+    def __init__(self, failure_rate=0.5, window=20, min_calls=10, open_duration=5.0, probes=1):
+        self.kwargs = {
+            'failure_rate': failure_rate,
+            'window': window,
+            'min_calls': min_calls,
+            'open_duration': open_duration,
+            'probes': probes,
+        }
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        """Return the circuit breaker of that host ('host:port')"""
+        b = self.breakers.get(host)
+        if b is None:
+            with self.lock:
+                b = self.breakers.setdefault(host, CircuitBreaker(host, **self.kwargs))
+        return b
@@ -1,55 +1,87 @@
-import requests
+import re
 import pprint
 import jsonschema
-import json
+import requests
 import logging
 import time
 import urllib.request
 import urllib.parse
 import urllib.error
-from requests.exceptions import ReadTimeout, ConnectTimeout
-from pymacaron_core.exceptions import PyMacaronCoreException, ValidationError
+from requests.exceptions import ReadTimeout, ConnectTimeout, ConnectionError
+from werkzeug.wrappers import Response as BaseResponse
+from pymacaron_core.exceptions import PyMacaronCoreException, ValidationError, CircuitOpenError
 from pymacaron_core.utils import get_function
+from pymacaron_core.metrics import observe_client_call, observe_client_retry_throttled, observe_client_circuit_rejected, observe_client_cache, observe_client_coalesced
+from pymacaron_core.tracing import tracer
+from pymacaron_core.swagger.transport import get_transport
+from pymacaron_core.swagger.retry import RetryPolicy
+from pymacaron_core.swagger.breaker import CircuitBreakerPolicy
+from pymacaron_core.swagger.hedge import Hedger
+from pymacaron_core.swagger.delta import MERGE_PATCH, PatchedResponse, apply_merge_patch
+from pymacaron_core.swagger.compression import compress
+from pymacaron_core.swagger.codec import json_codec, msgpack_dumps, MSGPACK_MIMETYPE
+from pymacaron_core.context import get_call_id, get_call_path, get_span
 from bravado_core.response import unmarshal_response
 
 
 log = logging.getLogger(__name__)
 
 
-try:
-    from flask import _app_ctx_stack as stack
-except ImportError:
-    from flask import _request_ctx_stack as stack
-
-
-def generate_client_callers(spec, timeout, error_callback, local, app):
+def generate_client_callers(spec, timeout, error_callback, local, app, api_name=None, transport=None, retry_policy=None, circuit_breaker=None, cache=None, balancer=None, direct_handlers=None, singleflight=None, compress_min_size=None, compress_level=6, prefer_msgpack=False):
     """Return a dict mapping method names to anonymous functions that
     will call the server's endpoint of the corresponding name as
-    described in the api defined by the swagger dict and bravado spec"""
+    described in the api defined by the swagger dict and bravado spec.
+    api_name is used to label the client metrics. All callers send their
+    requests via the same transport (a new RequestsTransport if none given)
+    and share the same retry policy (and its retry budget) and circuit
+    breakers. Set circuit_breaker to False to disable circuit breaking. If
+    cache is a ClientCache, results of GET calls are cached in it. If balancer
+    is set, calls are spread over its hosts instead of going to spec.host. If
+    local and direct_handlers is set (as returned by spawn_server_api), local
+    calls invoke the server's handlers in-process instead of going through
+    flask's test_client. If singleflight is a SingleFlight, identical
+    concurrent GET calls share one request and its result. If
+    compress_min_size is set, json bodies of at least that many bytes are sent
+    gzip compressed at compress_level. If prefer_msgpack is true, calls to endpoints supporting
+    'application/msgpack' send and receive MessagePack instead of json."""
 
     callers_dict = {}
 
+    if not transport and not local:
+        transport = get_transport(verify_ssl=spec.verify_ssl)
+    if not retry_policy:
+        retry_policy = RetryPolicy()
+    if circuit_breaker is None:
+        circuit_breaker = CircuitBreakerPolicy()
+
     def mycallback(endpoint):
         if not endpoint.handler_client:
             return
 
-        callers_dict[endpoint.handler_client] = _generate_client_caller(spec, endpoint, timeout, error_callback, local, app)
+        direct_handler = direct_handlers.get((endpoint.method, endpoint.path)) if direct_handlers else None
+        callers_dict[endpoint.handler_client] = _generate_client_caller(spec, endpoint, timeout, error_callback, local, app, api_name, transport, retry_policy, circuit_breaker, cache, balancer, direct_handler, singleflight, compress_min_size, compress_level, prefer_msgpack)
 
     spec.call_on_each_endpoint(mycallback)
 
     return callers_dict
 
 
-def _generate_request_arguments(url, spec, endpoint, headers, args, kwargs):
+def _generate_request_arguments(url, spec, endpoint, headers, args, kwargs, prefer_msgpack=False):
     # Prepare (g)requests arguments
     data = None
     params = None
     custom_url = url
 
-    if hasattr(stack.top, 'call_id'):
-        headers['PymCallID'] = stack.top.call_id
-    if hasattr(stack.top, 'call_path'):
-        headers['PymCallPath'] = stack.top.call_path
+    call_id = get_call_id()
+    if call_id:
+        headers['PymCallID'] = call_id
+    call_path = get_call_path()
+    if call_path:
+        headers['PymCallPath'] = call_path
+
+    # Delta responses are json merge patches: stick to json
+    if prefer_msgpack and endpoint.produces_msgpack and not endpoint.delta and 'Accept' not in headers:
+        headers['Accept'] = '%s, application/json;q=0.9' % MSGPACK_MIMETYPE
 
     if endpoint.param_in_path:
         # Fill url with values from kwargs, and remove those params from kwargs
@@ -63,7 +95,11 @@ def _generate_request_arguments(url, spec, endpoint, headers, args, kwargs):
         # The body parameter is the first elem in *args
         if len(args) != 1:
             raise ValidationError("%s expects exactly 1 parameter" % endpoint.handler_client)
-        data = json.dumps(spec.model_to_json(args[0]))
+        if prefer_msgpack and endpoint.consumes_msgpack:
+            data = msgpack_dumps(spec.model_to_json(args[0]))
+            headers['Content-Type'] = MSGPACK_MIMETYPE
+        else:
+            data = json_codec.dumps(spec.model_to_json(args[0]))
 
     # Prune undefined parameters that would otherwise be turned into '=None'
     # query params
@@ -75,13 +111,60 @@ def _generate_request_arguments(url, spec, endpoint, headers, args, kwargs):
     return custom_url, params, data, headers
 
 
-def _generate_client_caller(spec, endpoint, timeout, error_callback, local, app):
+def _compress_request(data, headers, min_size, level=6):
+    """Return data gzip compressed at level if it is at least min_size bytes
+    long, and set the matching 'Content-Encoding' in headers"""
+    if data is None or min_size is None or len(data) < min_size:
+        return data
+    headers['Content-Encoding'] = 'gzip'
+    return compress(data, 'gzip', level)
+
+
+def _pop_client_kwargs(kwargs, timeout):
+    """Extract the custom client parameters from **kwargs, and return a tuple
+    (headers, max_attempts, read_timeout, connect_timeout, hedge_delay)"""
+    headers = {'Content-Type': 'application/json'}
+    max_attempts = 3
+    read_timeout = timeout
+    connect_timeout = timeout
+    hedge_delay = None
+
+    if 'max_attempts' in kwargs:
+        max_attempts = kwargs['max_attempts']
+        del kwargs['max_attempts']
+    if 'read_timeout' in kwargs:
+        read_timeout = kwargs['read_timeout']
+        del kwargs['read_timeout']
+    if 'connect_timeout' in kwargs:
+        connect_timeout = kwargs['connect_timeout']
+        del kwargs['connect_timeout']
+    if 'request_headers' in kwargs:
+        headers.update(kwargs['request_headers'])
+        del kwargs['request_headers']
+    if 'hedge_delay' in kwargs:
+        hedge_delay = kwargs['hedge_delay']
+        del kwargs['hedge_delay']
+
+    return headers, max_attempts, read_timeout, connect_timeout, hedge_delay
+
+
+def _start_client_span(span_name, headers):
+    """Start a tracing span for a client call, child of the span of the request
+    being handled if any, and add the headers propagating it to the callee"""
+    span = tracer.start_client_span(span_name, get_span(), trace_id=headers.get('PymCallID', None))
+    if span:
+        headers.update(span.get_headers())
+    return span
+
+
+def _generate_client_caller(spec, endpoint, timeout, error_callback, local, app, api_name=None, transport=None, retry_policy=None, circuit_breaker=None, cache=None, balancer=None, direct_handler=None, singleflight=None, compress_min_size=None, compress_level=6, prefer_msgpack=False):
 
     if local:
         assert app
 
     # Is the endpoint available locally?
-    if local:
+    if local or balancer:
+        # The balancer prepends the url of the host it picks
         url = endpoint.path.lstrip('/')
     else:
         url = "%s://%s:%s/%s" % (
@@ -101,6 +184,13 @@ def _generate_client_caller(spec, endpoint, timeout, error_callback, local, app)
         raise PyMacaronCoreException("BUG: method %s for %s is not supported. Only get and post are." %
                                      (endpoint.method, endpoint.path))
 
+    metric_labels = (api_name or '', endpoint.method, endpoint.path)
+    span_name = '%s %s %s' % (api_name or '', endpoint.method, endpoint.path)
+
+    # Can we call the server's handler directly?
+    if local and direct_handler:
+        return _generate_direct_client(endpoint, error_callback, direct_handler, metric_labels, span_name)
+
     # Are we doing a local call?
     if local:
         def local_client(*args, **kwargs):
@@ -111,7 +201,7 @@ def _generate_client_caller(spec, endpoint, timeout, error_callback, local, app)
             headers.update(kwargs.get('request_headers', {}))
 
             # Remove magic client parameters before passing on
-            for k in ('max_attempts', 'read_timeout', 'connect_timeout', 'request_headers'):
+            for k in ('max_attempts', 'read_timeout', 'connect_timeout', 'request_headers', 'hedge_delay'):
                 if k in kwargs:
                     del kwargs[k]
 
@@ -127,26 +217,43 @@ def _generate_client_caller(spec, endpoint, timeout, error_callback, local, app)
                 custom_url = custom_url + '?' + urllib.parse.urlencode(params)
             log.info("Calling with params [%s]" % params)
 
-            with app.test_client() as c:
-                requests_method = getattr(c, method)
-                if decorator:
-                    requests_method = decorator(requests_method)
-
-                response = requests_method(
-                    custom_url,
-                    data=data,
-                    headers=headers
-                )
+            span = _start_client_span(span_name, headers)
+            t0 = time.perf_counter()
+            try:
+                with app.test_client() as c:
+                    requests_method = getattr(c, method)
+                    if decorator:
+                        requests_method = decorator(requests_method)
+
+                    response = requests_method(
+                        custom_url,
+                        data=data,
+                        headers=headers
+                    )
+            finally:
+                if span:
+                    tracer.finish(span, url=custom_url)
+            observe_client_call(metric_labels, response.status_code, time.perf_counter() - t0, len(data or ''), len(response.data), 0)
 
             return response_to_result(response, method, custom_url, endpoint.operation, error_callback)
 
         return local_client
 
     # Else call over HTTP/HTTPS
-    requests_method = getattr(requests, method)
+    requests_method = transport.get_method(method)
     if decorator:
         requests_method = decorator(requests_method)
 
+    breaker = circuit_breaker.get('%s:%s' % (spec.host, spec.port)) if circuit_breaker and not balancer else None
+
+    if cache and not cache.is_enabled(endpoint):
+        cache = None
+
+    hedger = _get_hedger(endpoint, metric_labels)
+
+    if endpoint.method != 'GET':
+        singleflight = None
+
     def client(*args, **kwargs):
         """Call the server endpoint and handle marshaling/unmarshaling of parameters/result.
 
@@ -154,37 +261,108 @@ def _generate_client_caller(spec, endpoint, timeout, error_callback, local, app)
         body parameter.
         """
 
-        # Extract custom parameters from **kwargs
-        headers = {'Content-Type': 'application/json'}
-        max_attempts = 3
-        read_timeout = timeout
-        connect_timeout = timeout
-
-        if 'max_attempts' in kwargs:
-            max_attempts = kwargs['max_attempts']
-            del kwargs['max_attempts']
-        if 'read_timeout' in kwargs:
-            read_timeout = kwargs['read_timeout']
-            del kwargs['read_timeout']
-        if 'connect_timeout' in kwargs:
-            connect_timeout = kwargs['connect_timeout']
-            del kwargs['connect_timeout']
-        if 'request_headers' in kwargs:
-            headers.update(kwargs['request_headers'])
-            del kwargs['request_headers']
-
-        custom_url, params, data, headers = _generate_request_arguments(url, spec, endpoint, headers, args, kwargs)
+        headers, max_attempts, read_timeout, connect_timeout, hedge_delay = _pop_client_kwargs(kwargs, timeout)
+
+        custom_url, params, data, headers = _generate_request_arguments(url, spec, endpoint, headers, args, kwargs, prefer_msgpack)
 
         if '<' in custom_url:
             # Some arguments were missing
             return error_callback(ValidationError("Missing some arguments to format url: %s" % custom_url))
 
+        data = _compress_request(data, headers, compress_min_size, compress_level)
+
         # TODO: refactor this left-over from the time of async/grequests support and simplify!
-        return ClientCaller(requests_method, custom_url, data, params, headers, read_timeout, connect_timeout, endpoint.operation, endpoint.method, error_callback, max_attempts, spec.verify_ssl).call()
+        caller = ClientCaller(requests_method, custom_url, data, params, headers, read_timeout, connect_timeout, endpoint.operation, endpoint.method, error_callback, max_attempts, spec.verify_ssl, metric_labels=metric_labels, retry_policy=retry_policy, breaker=breaker, cache=cache, hedger=hedger, hedge_delay=hedge_delay, balancer=balancer, singleflight=singleflight, delta=endpoint.delta)
+        span = _start_client_span(span_name, headers)
+        try:
+            return caller.call()
+        finally:
+            if span:
+                tracer.finish(span, url=custom_url, attempts=caller.attempts)
 
     return client
 
 
+def _generate_direct_client(endpoint, error_callback, direct_handler, metric_labels, span_name):
+    """Return a client caller passing its arguments to the server's handler
+    in-process. The model instance returned by the handler is validated and
+    unmarshalled like a response's, without being serialized to json text, so
+    the caller gets the same result as over HTTP. Responses returned by the
+    handler (errors in particular) and exceptions it raises are passed to
+    error_callback as for other calls"""
+
+    path_params = re.findall('<([^>]+)>', endpoint.path)
+
+    def direct_client(*args, **kwargs):
+        """Call the server's handler directly"""
+        log.info("Calling %s locally" % (endpoint.path))
+
+        # Remove magic client parameters before passing on
+        for k in ('max_attempts', 'read_timeout', 'connect_timeout', 'request_headers', 'hedge_delay'):
+            if k in kwargs:
+                del kwargs[k]
+
+        missing = [name for name in path_params if name not in kwargs]
+        if missing:
+            return error_callback(ValidationError("Missing some arguments to format url: %s" % ', '.join(missing)))
+        if endpoint.param_in_body and len(args) != 1:
+            raise ValidationError("%s expects exactly 1 parameter" % endpoint.handler_client)
+
+        # Undefined parameters are not sent as query params either
+        kwargs = {k: v for k, v in kwargs.items() if v is not None}
+
+        c = error_callback
+        if hasattr(c, '__func__'):
+            c = c.__func__
+
+        span = _start_client_span(span_name, {})
+        t0 = time.perf_counter()
+        status = 'error'
+        try:
+            result = direct_handler(*args, **kwargs)
+            status = result.status_code if isinstance(result, BaseResponse) else 200
+        except Exception as e:
+            log.warn("Local call to %s %s raised: %s" % (endpoint.method, endpoint.path, e))
+            return c(e)
+        finally:
+            if span:
+                tracer.finish(span, url=endpoint.path)
+            observe_client_call(metric_labels, status, time.perf_counter() - t0, 0, None, 0)
+
+        if not result:
+            k = PyMacaronCoreException("Have nothing to send in response")
+            k.status_code = 500
+            return c(k)
+
+        if isinstance(result, BaseResponse):
+            # An error, or a response built by the handler
+            return response_to_result(result, endpoint.method, endpoint.path, endpoint.operation, error_callback)
+
+        if not hasattr(result, '__module__') or not hasattr(result, '__class__'):
+            k = PyMacaronCoreException("Method %s did not return a class instance but a %s" % (endpoint.handler_server, type(result)))
+            k.status_code = 500
+            return c(k)
+
+        return response_to_result(DirectResponse(result.to_json()), endpoint.method, endpoint.path, endpoint.operation, error_callback)
+
+    return direct_client
+
+
+class DirectResponse(PatchedResponse):
+    """The json document of the model instance returned by a handler called
+    in-process, to be unmarshalled like a 200 response"""
+
+
+def _get_hedger(endpoint, metric_labels):
+    """Return the Hedger of calls to a GET endpoint, or None. Calls are hedged
+    if the endpoint has 'x-hedge-delay' or the call has a 'hedge_delay' kwarg"""
+    if endpoint.method != 'GET':
+        if endpoint.hedge_delay is not None:
+            log.warn("Ignoring x-hedge-delay of non-idempotent endpoint %s %s" % (endpoint.method, endpoint.path))
+        return None
+    return Hedger(endpoint.hedge_delay, max_rate=endpoint.hedge_max_rate, labels=metric_labels)
+
+
 def _format_flask_url(url, params):
     # TODO: make this code more robust: error if some params are left unmatched
     # or if url still contains placeholders after replacing
@@ -200,18 +378,34 @@ def _format_flask_url(url, params):
     return url
 
 
-def response_to_result(response, method, url, operation, error_callback):
+def response_to_result(response, method, url, operation, error_callback, on_result=None, base=None):
+    """Return the model instance unmarshalled from the response, or pass an
+    exception to error_callback. If on_result is set, it is called with the
+    unmarshalled result and the response it was unmarshalled from. If base is
+    the json document of a version held by the caller, a delta response is
+    applied to it."""
 
     # Monkey patching flask test_client response if necessary
     if not hasattr(response, 'text'):
         data = response.data.decode("utf-8")
         setattr(response, 'text', data)
-        j = json.loads(data)
+        j = json_codec.loads(data)
 
         def get_json():
             return j
 
         setattr(response, 'json', get_json)
+    elif isinstance(response, requests.Response):
+        # Parse the body with the configured json codec, not requests', and
+        # let bravado find MessagePack bodies where it expects them
+        content = response.content
+        setattr(response, 'json', lambda: json_codec.loads(content))
+        setattr(response, 'raw_bytes', content)
+
+    # A delta response: patch the version we hold
+    if base is not None and str(response.status_code) == '226':
+        log.info("Call to %s %s returned a delta response" % (method, url))
+        response = PatchedResponse(apply_merge_patch(base, response.json()))
 
     # If the remote-server returned an error, raise it as a local PyMacaronCoreException
     if str(response.status_code) != '200':
@@ -244,12 +438,14 @@ def response_to_result(response, method, url, operation, error_callback):
         return c(k)
 
     log.info("Call to %s %s returned an instance of %s" % (method, url, type(result)))
+    if on_result:
+        on_result(result, response)
     return result
 
 
 class ClientCaller():
 
-    def __init__(self, requests_method, url, data, params, headers, read_timeout, connect_timeout, operation, method, error_callback, max_attempts, verify_ssl):
+    def __init__(self, requests_method, url, data, params, headers, read_timeout, connect_timeout, operation, method, error_callback, max_attempts, verify_ssl, metric_labels=None, retry_policy=None, breaker=None, cache=None, hedger=None, hedge_delay=None, balancer=None, singleflight=None, delta=False):
         assert max_attempts >= 1
         self.requests_method = requests_method
         self.url = url
@@ -263,6 +459,21 @@ class ClientCaller():
         self.error_callback = error_callback
         self.max_attempts = max_attempts
         self.verify_ssl = verify_ssl
+        self.metric_labels = metric_labels
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+        self.cache = cache
+        self.cache_key = None
+        self.hedger = hedger
+        self.hedge_delay = hedge_delay
+        self.balancer = balancer
+        self.singleflight = singleflight
+        self.delta = delta
+        self.backend = None
+        self.tried_backends = []
+        # With a balancer, url is relative to the base url of the picked host
+        self.path = url
+        self.attempts = 0
 
     def _method_is_safe_to_retry(self):
         return self.method in ('GET', 'PATCH')
@@ -271,67 +482,240 @@ class ClientCaller():
         """Call request and retry up to max_attempts times (or none if self.max_attempts=1)"""
         last_exception = None
         for i in range(self.max_attempts):
+            if i > 0:
+                delay = self._get_retry_delay(i - 1)
+                if delay is None:
+                    break
+                if delay:
+                    time.sleep(delay)
+
+            self._check_circuit()
+            self.attempts = i + 1
             try:
                 log.info("Calling %s %s" % (self.method, self.url))
-                response = self.requests_method(
-                    self.url,
-                    data=self.data,
-                    params=self.params,
-                    headers=self.headers,
-                    timeout=(self.connect_timeout, self.read_timeout),
-                    verify=self.verify_ssl,
-                )
-
-                if response is None:
-                    log.warn("Got response None")
-                    if self._method_is_safe_to_retry():
-                        delay = 0.5 + i * 0.5
-                        log.info("Waiting %s sec and Retrying since call is a %s" % (delay, self.method))
-                        time.sleep(delay)
-                        continue
-                    else:
-                        raise PyMacaronCoreException("Call %s %s returned empty response" % (self.method, self.url))
-
-                return response
-
+                response = self._send()
             except Exception as e:
-
+                self._record_outcome(None)
                 last_exception = e
-
-                retry = force_retry
-
-                if isinstance(e, ReadTimeout):
-                    # Log enough to help debugging...
-                    log.warn("Got a ReadTimeout calling %s %s" % (self.method, self.url))
-                    log.warn("Exception was: %s" % str(e))
-                    resp = e.response
-                    if not resp:
-                        log.info("Requests error has no response.")
-                        # TODO: retry=True? Is it really safe?
-                    else:
-                        b = resp.content
-                        log.info("Requests has a response with content: " + pprint.pformat(b))
-                    if self._method_is_safe_to_retry():
-                        # It is safe to retry
-                        log.info("Retrying since call is a %s" % self.method)
-                        retry = True
-
-                elif isinstance(e, ConnectTimeout):
-                    log.warn("Got a ConnectTimeout calling %s %s" % (self.method, self.url))
-                    log.warn("Exception was: %s" % str(e))
-                    # ConnectTimeouts are safe to retry whatever the call...
-                    retry = True
-
-                if retry:
+                if self._should_retry(e, force_retry):
                     continue
                 else:
                     raise e
 
-        # max_attempts has been reached: propagate the last received Exception
+            self._record_outcome(response)
+
+            if response is None:
+                self._check_empty_response()
+                continue
+
+            return response
+
+        self._give_up(last_exception)
+
+    def _get_request_kwargs(self):
+        return {
+            'data': self.data,
+            'params': self.params,
+            'headers': self.headers,
+            'timeout': (self.connect_timeout, self.read_timeout),
+            'verify': self.verify_ssl,
+        }
+
+    def _send(self):
+        """Send the request once, hedged if enabled"""
+        backend = self.backend
+        if backend:
+            backend.start()
+        t0 = time.perf_counter()
+        response = None
+        try:
+            if self.hedger:
+                delay = self.hedger.get_delay(self.hedge_delay)
+                response = self.hedger.call(delay, self.requests_method, self.url, **self._get_request_kwargs())
+            else:
+                response = self.requests_method(self.url, **self._get_request_kwargs())
+            return response
+        finally:
+            if backend:
+                backend.finish(time.perf_counter() - t0, failed=response is None or str(response.status_code).startswith('5'))
+
+    def _pick_host(self):
+        """If the api has several hosts, pick the one to send the next attempt
+        to, preferably one not tried yet"""
+        self.backend = self.balancer.pick(exclude=self.tried_backends)
+        if self.backend is None:
+            self._reject("All hosts are ejected: not calling %s %s" % (self.method, self.path))
+        self.tried_backends.append(self.backend)
+        self.breaker = self.backend.breaker
+        self.url = self.backend.base_url + self.path
+
+    def _check_circuit(self):
+        """Raise a CircuitOpenError if the circuit breaker of the called host
+        forbids calling it"""
+        if self.balancer:
+            self._pick_host()
+        if self.breaker and not self.breaker.allow():
+            self._reject("Circuit breaker for %s is open: not calling %s %s" % (self.breaker.name, self.method, self.url))
+
+    def _reject(self, msg):
+        if self.metric_labels:
+            observe_client_circuit_rejected(self.metric_labels)
+        raise CircuitOpenError(msg)
+
+    def _record_outcome(self, response):
+        """Tell the circuit breaker whether the host answered"""
+        if self.breaker:
+            self.breaker.record(response is not None and not str(response.status_code).startswith('5'))
+
+    def _get_retry_delay(self, retry):
+        """Return how long to wait before the given retry (counted from 0), or
+        None if the api's retry budget forbids it"""
+        if not self.retry_policy:
+            return 0
+        if not self.retry_policy.can_retry():
+            log.warn("Retry budget exhausted: not retrying %s %s" % (self.method, self.url))
+            if self.metric_labels:
+                observe_client_retry_throttled(self.metric_labels)
+            return None
+        delay = self.retry_policy.get_delay(retry)
+        log.info("Waiting %.3f sec before retrying %s %s" % (delay, self.method, self.url))
+        return delay
+
+    def _check_empty_response(self):
+        """Raise an exception if the call can't be retried after getting an
+        empty response"""
+        log.warn("Got response None")
+        if not self._method_is_safe_to_retry():
+            raise PyMacaronCoreException("Call %s %s returned empty response" % (self.method, self.url))
+        log.info("Retrying since call is a %s" % self.method)
+
+    def _should_retry(self, e, force_retry):
+        """Tell whether the call should be retried after raising exception e"""
+        retry = force_retry
+
+        if isinstance(e, ReadTimeout):
+            # Log enough to help debugging...
+            log.warn("Got a ReadTimeout calling %s %s" % (self.method, self.url))
+            log.warn("Exception was: %s" % str(e))
+            resp = e.response
+            if not resp:
+                log.info("Requests error has no response.")
+                # TODO: retry=True? Is it really safe?
+            else:
+                b = resp.content
+                log.info("Requests has a response with content: " + pprint.pformat(b))
+            if self._method_is_safe_to_retry():
+                # It is safe to retry
+                log.info("Retrying since call is a %s" % self.method)
+                retry = True
+
+        elif isinstance(e, ConnectTimeout):
+            log.warn("Got a ConnectTimeout calling %s %s" % (self.method, self.url))
+            log.warn("Exception was: %s" % str(e))
+            # ConnectTimeouts are safe to retry whatever the call...
+            retry = True
+
+        elif isinstance(e, ConnectionError) and self.balancer and self._method_is_safe_to_retry():
+            log.warn("Got a ConnectionError calling %s %s: retrying on another host" % (self.method, self.url))
+            retry = True
+
+        return retry
+
+    def _give_up(self, last_exception):
+        """max_attempts has been reached, or the retry budget is exhausted:
+        propagate the last received Exception"""
         if not last_exception:
-            last_exception = Exception("Reached max-attempts (%s). Giving up calling %s %s" % (self.max_attempts, self.method, self.url))
+            last_exception = Exception("Gave up after %s attempts calling %s %s" % (self.attempts, self.method, self.url))
         raise last_exception
 
+    def _get_cached(self):
+        """Return the cached result of this call if any, fresh or not. If it is
+        stale but has an ETag, ask the server to revalidate it"""
+        if not self.cache:
+            return None
+        self.cache_key = self.cache.get_key(self.url, self.params, self.headers)
+        cached = self.cache.get(self.cache_key)
+        if cached is None:
+            return None
+        if cached.is_fresh():
+            self._observe_cache('hit')
+        elif cached.etag:
+            self.headers['If-None-Match'] = cached.etag
+            if self.delta and cached.doc is not None:
+                # Accept a patch from the version we hold
+                self.headers['A-IM'] = MERGE_PATCH
+        return cached
+
+    def _to_result(self, response, cached):
+        """Turn the response into a result, via the cache if enabled"""
+        if not self.cache:
+            return response_to_result(response, self.method, self.url, self.operation, self.error_callback)
+
+        if cached and str(response.status_code) == '304':
+            self._observe_cache('revalidated')
+            self.cache.refresh(self.cache_key, cached, response.headers)
+            return cached.result
+
+        status = str(response.status_code)
+        self._observe_cache('delta' if status == '226' else 'miss')
+        on_result = None
+        if status in ('200', '226'):
+            def on_result(result, r):
+                doc = r.json() if self.delta else None
+                self.cache.store(self.cache_key, result, response.headers, doc=doc)
+        base = cached.doc if cached and self.delta else None
+        return response_to_result(response, self.method, self.url, self.operation, self.error_callback, on_result=on_result, base=base)
+
+    def _fail_fast(self, e):
+        """Pass a CircuitOpenError to the error callback"""
+        log.warn(str(e))
+        c = self.error_callback
+        if hasattr(c, '__func__'):
+            c = c.__func__
+        return c(e)
+
+    def _observe_cache(self, result):
+        if self.metric_labels:
+            observe_client_cache(self.metric_labels, result)
+
+    def _observe(self, response, duration):
+        """Record this call's metrics"""
+        if not self.metric_labels:
+            return
+        status = 'error'
+        response_bytes = None
+        if response is not None:
+            status = response.status_code
+            response_bytes = len(response.content)
+        observe_client_call(self.metric_labels, status, duration, len(self.data or ''), response_bytes, max(self.attempts - 1, 0))
+
+    def _observe_coalesced(self, coalesced):
+        if coalesced and self.metric_labels:
+            observe_client_coalesced(self.metric_labels)
+
     def call(self, force_retry=False):
-        response = self._call_retry(force_retry)
-        return response_to_result(response, self.method, self.url, self.operation, self.error_callback)
+        cached = self._get_cached()
+        if cached and cached.is_fresh():
+            return cached.result
+
+        if not self.singleflight:
+            return self._call(cached, force_retry)
+
+        # Share the request and result of an identical call in flight
+        key = self.singleflight.get_key(self.url, self.params, self.headers)
+        result, coalesced = self.singleflight.do(key, self._call, cached, force_retry)
+        self._observe_coalesced(coalesced)
+        return result
+
+    def _call(self, cached, force_retry):
+        if self.retry_policy:
+            self.retry_policy.on_call()
+        t0 = time.perf_counter()
+        response = None
+        try:
+            response = self._call_retry(force_retry)
+        except CircuitOpenError as e:
+            return self._fail_fast(e)
+        finally:
+            self._observe(response, time.perf_counter() - t0)
+        return self._to_result(response, cached)
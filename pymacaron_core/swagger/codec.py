@@ -0,0 +1,124 @@
+import json
+import uuid
+import logging
+from datetime import date
+from werkzeug.http import http_date
+from pymacaron_core.exceptions import PyMacaronCoreException
+
+
+log = logging.getLogger(__name__)
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# The binary wire format supported next to json
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def _default(o):
+    """Serialize datetimes, dates and uuids like flask's jsonify does, so objects
+    marshalled with to_json(keep_datetime=True) look the same with all codecs"""
+    if isinstance(o, date):
+        return http_date(o.timetuple())
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError("Object of type %s is not JSON serializable" % type(o).__name__)
+
+
+def _json_dumps(o):
+    return json.dumps(o, default=_default, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def _orjson_dumps(o):
+    return orjson.dumps(o, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS)
+
+
+def _ujson_dumps(o):
+    return ujson.dumps(o, default=_default, sort_keys=True, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+
+
+CODECS = ('json', 'orjson', 'ujson')
+
+
+def _get_codec(name):
+    """Return the functions (dumps, loads) of a codec, or None if it isn't
+    installed"""
+    if name == 'json':
+        return _json_dumps, json.loads
+    if name == 'orjson' and orjson:
+        return _orjson_dumps, orjson.loads
+    if name == 'ujson' and ujson:
+        return _ujson_dumps, ujson.loads
+    return None
+
+
+class JsonCodec():
+    """Serialize and parse the json bodies of requests and responses, on both
+    the server and client side, with the stdlib's json module, orjson or
+    ujson. 'auto' picks the fastest one installed."""
+
+    def __init__(self, name='auto'):
+        self.configure(name)
+
+    def configure(self, name='auto'):
+        if name == 'auto':
+            name = 'orjson' if orjson else 'ujson' if ujson else 'json'
+        if name not in CODECS:
+            raise PyMacaronCoreException("Unknown json codec '%s': should be one of auto, %s" % (name, ', '.join(CODECS)))
+        codec = _get_codec(name)
+        if not codec:
+            raise PyMacaronCoreException("Cannot use json codec '%s': it is not installed" % name)
+        self._dumps, self._loads = codec
+        log.debug("Using json codec %s" % name)
+        self.name = name
+
+    def dumps(self, o):
+        """Return o serialized to json, as utf-8 bytes"""
+        try:
+            return self._dumps(o)
+        except (TypeError, OverflowError):
+            if self.name == 'json':
+                raise
+            # Such as integers larger than 64 bits
+            return _json_dumps(o)
+
+    def loads(self, data):
+        """Return the object parsed from json data (bytes or str). Raise a
+        ValueError if data isn't valid json"""
+        return self._loads(data)
+
+
+json_codec = JsonCodec()
+
+
+def msgpack_dumps(o):
+    """Return o serialized to MessagePack"""
+    return msgpack.packb(o, default=_default, use_bin_type=True)
+
+
+def msgpack_loads(data):
+    """Return the object parsed from MessagePack data. Raise a ValueError if
+    data isn't valid MessagePack"""
+    return msgpack.unpackb(data, raw=False)
+
+
+def configure_json_codec(name='auto'):
+    """Set the json library used by server stubs and client callers: 'json'
+    (the stdlib), 'orjson', 'ujson', or 'auto' (the default)"""
+    json_codec.configure(name)
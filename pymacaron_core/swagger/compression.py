@@ -0,0 +1,59 @@
+import gzip
+import zlib
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+# Supported content encodings, by order of preference
+ENCODINGS = ('gzip', 'deflate')
+
+# The zlib window bits matching each content encoding
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class DataTooLarge(Exception):
+    pass
+
+
+def compress(data, encoding, level=6):
+    """Compress data (bytes) with the given content encoding"""
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level)
+    if encoding == 'deflate':
+        return zlib.compress(data, level)
+    raise ValueError("Unsupported content encoding: %s" % encoding)
+
+
+def decompress(data, encoding, max_size=None):
+    """Decompress data (bytes) sent with the given content encoding. Raise a
+    ValueError if it can't be decompressed, or DataTooLarge if it would
+    decompress to more than max_size bytes"""
+    if encoding not in WBITS:
+        raise ValueError("Unsupported content encoding: %s" % encoding)
+    d = zlib.decompressobj(WBITS[encoding])
+    try:
+        if max_size is None:
+            result = d.decompress(data)
+        else:
+            # Stop as soon as we know it's too large
+            result = d.decompress(data, max_size + 1)
+            if len(result) > max_size:
+                raise DataTooLarge("%s data decompresses to more than %s bytes" % (encoding, max_size))
+    except zlib.error as e:
+        raise ValueError("Cannot decompress %s data: %s" % (encoding, e))
+    if not d.eof:
+        raise ValueError("Cannot decompress %s data: it is truncated" % encoding)
+    if d.unused_data:
+        raise ValueError("Cannot decompress %s data: it has trailing data" % encoding)
+    return result
+
+
+def pick_encoding(accept_encodings):
+    """Return the supported encoding preferred by the caller, given its
+    'Accept-Encoding' as a werkzeug Accept object, or None"""
+    return accept_encodings.best_match(ENCODINGS)
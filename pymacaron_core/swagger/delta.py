@@ -0,0 +1,112 @@
+import json
+import logging
+from pymacaron_core.lru import LRUCache
+from pymacaron_core.swagger.codec import json_codec
+
+
+log = logging.getLogger(__name__)
+
+
+# Value of the 'A-IM' request header and 'IM' response header of delta
+# responses (RFC 3229), whose body is a json merge patch (RFC 7386)
+MERGE_PATCH = 'merge-patch'
+MERGE_PATCH_MIMETYPE = 'application/merge-patch+json'
+
+
+class CannotPatch(Exception):
+    pass
+
+
+def _diff(old, new):
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    patch = {}
+    for k in old:
+        if k not in new:
+            patch[k] = None
+    for k, v in new.items():
+        if k in old and old[k] == v:
+            continue
+        if v is None:
+            # null means 'remove' in a merge patch
+            raise CannotPatch()
+        patch[k] = _diff(old.get(k), v)
+    return patch
+
+
+def make_merge_patch(old, new):
+    """Return the json merge patch turning the document old into new, or None
+    if new can't be expressed as a merge patch (it has null values)"""
+    if not isinstance(new, dict):
+        return None
+    try:
+        return _diff(old, new)
+    except CannotPatch:
+        return None
+
+
+def apply_merge_patch(target, patch):
+    """Return the document target with the json merge patch applied to it"""
+    if not isinstance(patch, dict):
+        return patch
+    if not isinstance(target, dict):
+        target = {}
+    result = dict(target)
+    for k, v in patch.items():
+        if v is None:
+            result.pop(k, None)
+        else:
+            result[k] = apply_merge_patch(result.get(k), v)
+    return result
+
+
+class DeltaHistory():
+    """The last max_size versions of an endpoint's responses, as json documents
+    keyed by their ETag, against which to compute delta responses"""
+
+    def __init__(self, max_size=100):
+        self.lru = LRUCache(max_size)
+
+    def add(self, etag, doc):
+        self.lru.set(etag, doc)
+
+    def get_patch(self, base_etags, etag, body):
+        """Return a tuple (base_etag, patch) where patch is the serialized json
+        merge patch from one of the versions in base_etags to the version
+        etag whose serialized body is body, or (None, None) if there is none
+        smaller than body"""
+        new = None
+        for base_etag in base_etags:
+            old = self.lru.get(base_etag)
+            if old is None or base_etag == etag:
+                continue
+            if new is None:
+                new = self.lru.get(etag)
+                if new is None:
+                    new = json_codec.loads(body)
+                    self.add(etag, new)
+            patch = make_merge_patch(old, new)
+            if patch is None:
+                return None, None
+            patch = json_codec.dumps(patch)
+            if len(patch) < len(body):
+                return base_etag, patch
+        return None, None
+
+
+class PatchedResponse():
+    """The document obtained by applying a delta response to the version held
+    by the client, to be unmarshalled like a 200 response"""
+
+    status_code = 200
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.headers = {'content-type': 'application/json'}
+
+    @property
+    def text(self):
+        return json.dumps(self.doc)
+
+    def json(self):
+        return self.doc
@@ -0,0 +1,185 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pymacaron_core.metrics import observe_client_hedge_issued, observe_client_hedge_won
+from pymacaron_core.swagger.retry import RetryBudget
+
+
+log = logging.getLogger(__name__)
+
+
+# Maximum number of threads sending hedge requests, across all apis. The first
+# request of a call is sent from a thread of its own, so that neither this cap
+# nor the pool's queue delays it
+pool_size = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the thread pool sending the requests of hedged calls"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='pym-hedge')
+    return _executor
+
+
+def parse_hedge_delay(delay):
+    """Parse a hedge delay: a number of seconds, or a percentile of observed
+    latencies such as 'p95'. Return a tuple (seconds, percentile)"""
+    if delay is None:
+        return None, None
+    if isinstance(delay, str) and delay.lower().startswith('p'):
+        percentile = float(delay[1:])
+        if not 0 < percentile < 100:
+            raise ValueError("Invalid hedge delay percentile: %s" % delay)
+        return None, percentile
+    return float(delay), None
+
+
+class Hedger():
+    """Hedge the calls to one idempotent endpoint: if a request has not answered
+    after delay seconds, send a second identical one and return the response of
+    whichever answers first. delay is either a number of seconds or a
+    percentile of the endpoint's observed latencies, such as 'p95'.
+
+    At most max_rate of calls are hedged (a budget refilled by each call), so
+    that hedging never adds more than that fraction of load on the server."""
+
+    def __init__(self, delay=None, max_rate=0.1, min_samples=20, max_samples=1000, labels=None):
+        self.delay, self.percentile = parse_hedge_delay(delay)
+        self.budget = RetryBudget(ratio=max_rate, min_per_sec=0, burst=max(1, max_rate * 100))
+        self.min_samples = min_samples
+        self.labels = labels
+        self.latencies = deque(maxlen=max_samples)
+        self.lock = threading.Lock()
+        self.observed_delay = None
+        self.samples_since_update = 0
+
+    def observe(self, duration):
+        """Record the latency of a request"""
+        with self.lock:
+            self.latencies.append(duration)
+            self.samples_since_update += 1
+
+    def _get_percentile(self, percentile):
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            # Sorting is not free: only do it every 50 samples
+            if self.observed_delay is None or self.samples_since_update >= 50 or self.observed_delay[0] != percentile:
+                latencies = sorted(self.latencies)
+                i = min(int(len(latencies) * percentile / 100), len(latencies) - 1)
+                self.observed_delay = (percentile, latencies[i])
+                self.samples_since_update = 0
+            return self.observed_delay[1]
+
+    def get_delay(self, delay=None):
+        """Return after how long to hedge a call, or None if it should not be
+        hedged. delay overrides the endpoint's hedge delay (False disables
+        hedging)"""
+        if delay is False:
+            return None
+        seconds, percentile = self.delay, self.percentile
+        if delay is not None:
+            seconds, percentile = parse_hedge_delay(delay)
+        if percentile:
+            return self._get_percentile(percentile)
+        return seconds
+
+    def _timed(self, f, args, kwargs):
+        t0 = time.perf_counter()
+        r = f(*args, **kwargs)
+        self.observe(time.perf_counter() - t0)
+        return r
+
+    def _should_hedge(self, delay):
+        if not self.budget.withdraw():
+            log.debug("Hedge budget exhausted")
+            return False
+        log.info("Hedging call after %.3f sec" % delay)
+        if self.labels:
+            observe_client_hedge_issued(self.labels)
+        return True
+
+    def _won(self):
+        """Record that the hedged request answered first"""
+        if self.labels:
+            observe_client_hedge_won(self.labels)
+
+    def call(self, delay, f, *args, **kwargs):
+        """Call f(*args, **kwargs), and call it again from the hedge thread pool if
+        it has not returned after delay seconds. Return the result of whichever
+        call returns first, or of the other one if it failed. Raise the first
+        exception if both calls fail"""
+        self.budget.deposit()
+        if delay is None:
+            return self._timed(f, args, kwargs)
+
+        first = Future()
+
+        def send_first():
+            try:
+                first.set_result(self._timed(f, args, kwargs))
+            except Exception as e:
+                first.set_exception(e)
+
+        # The caller's thread waits on whichever request answers first, so the
+        # first request is sent from a thread of its own
+        t = threading.Thread(target=contextvars.copy_context().run, args=(send_first,), name='pym-hedge-first')
+        t.daemon = True
+        t.start()
+
+        done, _ = wait([first], timeout=delay)
+        if done or not self._should_hedge(delay):
+            return first.result()
+
+        second = get_executor().submit(contextvars.copy_context().run, self._timed, f, args, kwargs)
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (first, second):
+                if future in done and (future.exception() is None or not pending):
+                    if future is second:
+                        self._won()
+                    return future.result()
+
+    async def async_call(self, delay, f, *args, **kwargs):
+        """Same as call(), for a coroutine function f. The slower call is
+        cancelled"""
+        self.budget.deposit()
+
+        async def timed():
+            t0 = time.perf_counter()
+            r = await f(*args, **kwargs)
+            self.observe(time.perf_counter() - t0)
+            return r
+
+        if delay is None:
+            return await timed()
+
+        first = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done or not self._should_hedge(delay):
+            return await first
+
+        second = asyncio.ensure_future(timed())
+        pending = {first, second}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in (first, second):
+                    if task in done and (task.exception() is None or not pending):
+                        if task is second:
+                            self._won()
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
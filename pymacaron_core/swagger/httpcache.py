@@ -0,0 +1,136 @@
+import time
+import logging
+from pymacaron_core.lru import LRUCache
+
+
+log = logging.getLogger(__name__)
+
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into a dict mapping directives to their
+    value (or True for directives without value)"""
+    directives = {}
+    for d in (value or '').split(','):
+        d = d.strip().lower()
+        if not d:
+            continue
+        if '=' in d:
+            k, v = d.split('=', 1)
+            directives[k.strip()] = v.strip().strip('"')
+        else:
+            directives[d] = True
+    return directives
+
+
+class CachedResult():
+    """An unmarshalled result, along with what is needed to revalidate it,
+    and the json document it was unmarshalled from if delta responses are
+    accepted"""
+
+    def __init__(self, result, etag, expires_at, doc=None):
+        self.result = result
+        self.etag = etag
+        self.expires_at = expires_at
+        self.doc = doc
+
+    def is_fresh(self):
+        return self.expires_at > time.monotonic()
+
+
+class ClientCache():
+    """A cache of the results of an api's GET client calls, honoring the
+    'Cache-Control' and 'ETag' headers of responses:
+
+    - results stay fresh for 'max-age' seconds (minus the response's 'Age'),
+      or default_ttl seconds if the response has no max-age, but never more
+      than max_ttl seconds. Fresh results are returned without calling the
+      server.
+
+    - results with an ETag are kept after they expire, and revalidated by
+      sending 'If-None-Match': a '304 Not Modified' response refreshes them.
+      For endpoints with 'x-delta: true', the server may instead send a
+      json merge patch from the cached version to the new one.
+
+    - responses with 'no-store', or neither a ttl nor an ETag, are not cached.
+
+    Calls are keyed by url, query parameters and key_headers (those that
+    change the response, such as 'Authorization'). At most max_size results are
+    kept, least recently used first out. If all_endpoints is true, all the GET
+    endpoints of the api are cached, otherwise only those marked with
+    'x-client-cache: true' (or 'x-delta: true') in the swagger spec.
+
+    Cached results are shared between calls: do not modify them.
+    """
+
+    def __init__(self, max_size=1000, default_ttl=0, max_ttl=3600, key_headers=('Authorization',), all_endpoints=True):
+        self.lru = LRUCache(max_size)
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.key_headers = key_headers
+        self.all_endpoints = all_endpoints
+
+    def is_enabled(self, endpoint):
+        """Tell whether calls to that endpoint should be cached"""
+        if endpoint.method != 'GET':
+            return False
+        if endpoint.client_cache is not None:
+            return endpoint.client_cache
+        # Delta responses patch the cached version
+        return self.all_endpoints or endpoint.delta
+
+    def get_key(self, url, params, headers):
+        key = [url]
+        if params:
+            key.append(tuple(sorted((k, str(v)) for k, v in params.items())))
+        if headers:
+            key.append(tuple(headers.get(h) for h in self.key_headers))
+        return tuple(key)
+
+    def get(self, key):
+        """Return the CachedResult stored under key, fresh or not, or None"""
+        return self.lru.get(key)
+
+    def _get_ttl(self, headers):
+        """Return how long the response with those headers is fresh, or None if
+        it should not be stored"""
+        cc = parse_cache_control(headers.get('Cache-Control'))
+        if 'no-store' in cc:
+            return None
+        ttl = self.default_ttl
+        if 'no-cache' in cc:
+            ttl = 0
+        elif 'max-age' in cc:
+            try:
+                ttl = int(cc['max-age']) - int(headers.get('Age') or 0)
+            except ValueError:
+                return None
+        return max(min(ttl, self.max_ttl), 0)
+
+    def store(self, key, result, headers, doc=None):
+        """Store the result of a 200 (or delta) response, if its headers allow
+        it"""
+        ttl = self._get_ttl(headers)
+        etag = headers.get('ETag')
+        if ttl is None or (not ttl and not etag):
+            return
+        entry = CachedResult(result, etag, time.monotonic() + ttl, doc=doc)
+        # Entries with an ETag outlive their freshness, to be revalidated
+        self.lru.set(key, entry, ttl=None if etag else ttl)
+
+    def refresh(self, key, entry, headers):
+        """Mark a revalidated entry as fresh again, after a 304 response"""
+        ttl = self._get_ttl(headers)
+        if ttl is None:
+            self.lru.pop(key)
+            return
+        entry.etag = headers.get('ETag') or entry.etag
+        entry.expires_at = time.monotonic() + ttl
+
+    def invalidate(self, url=None):
+        """Drop all cached results, or only those of calls to url"""
+        if url is None:
+            self.lru.clear()
+            return
+        for key in self.lru.keys():
+            if key[0] == url:
+                self.lru.pop(key)
@@ -0,0 +1,94 @@
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pymacaron_core.context import submit
+
+
+log = logging.getLogger(__name__)
+
+
+# Maximum number of threads running client calls in parallel, across all
+# calls to parallel()
+pool_size = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_pool = contextvars.ContextVar('pym_in_pool', default=False)
+
+
+def get_executor():
+    """Return the thread pool shared by all calls to parallel()"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='pym-parallel')
+    return _executor
+
+
+def _run_in_pool(f, args, kwargs):
+    """Call f in a thread of the pool, within a copy of the caller's context"""
+    _in_pool.set(True)
+    return f(*args, **kwargs)
+
+
+def _parse_call(call):
+    """Turn f, (f,), (f, args) or (f, args, kwargs) into (f, args, kwargs)"""
+    if callable(call):
+        return call, (), {}
+    call = tuple(call)
+    f = call[0]
+    args = tuple(call[1]) if len(call) > 1 and call[1] else ()
+    kwargs = dict(call[2]) if len(call) > 2 and call[2] else {}
+    return f, args, kwargs
+
+
+def parallel(calls, max_workers=None, raise_errors=False):
+    """Run a list of client calls concurrently and return their results in the
+    same order. Each call is a tuple (f, args, kwargs), where f is typically a
+    client caller like ApiPool.<api>.client.<method>. Calls run on a thread
+    pool shared by the whole process, with at most max_workers of them at once,
+    and carry the caller's PymCallID, PymCallPath and tracing span.
+
+    If a call raises an exception, the exception is returned in place of its
+    result, unless raise_errors is true, in which case the first exception (in
+    the order of calls) is raised once all calls are done.
+    """
+
+    calls = [_parse_call(c) for c in calls]
+    results = [None] * len(calls)
+
+    def run_sequentially():
+        for i, (f, args, kwargs) in enumerate(calls):
+            try:
+                results[i] = f(*args, **kwargs)
+            except Exception as e:
+                results[i] = e
+
+    if len(calls) <= 1 or _in_pool.get():
+        # Calls made from within the pool are run sequentially, to avoid
+        # exhausting the pool and deadlocking
+        run_sequentially()
+    else:
+        executor = get_executor()
+        slots = threading.BoundedSemaphore(max_workers or len(calls))
+        futures = []
+        for f, args, kwargs in calls:
+            slots.acquire()
+            future = submit(executor, _run_in_pool, f, args, kwargs)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+
+        for i, future in enumerate(futures):
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = e
+
+    if raise_errors:
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+
+    return results
@@ -1,6 +1,9 @@
 import logging
 from werkzeug import FileStorage
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
 from bravado_core.request import IncomingRequest
+from pymacaron_core.swagger.compression import ENCODINGS, DataTooLarge, decompress
+from pymacaron_core.swagger.codec import json_codec, msgpack_loads, MSGPACK_MIMETYPE
 
 
 log = logging.getLogger(__name__)
@@ -8,7 +11,8 @@ log = logging.getLogger(__name__)
 
 class FlaskRequestProxy(IncomingRequest):
     """Take a flask.request object and make it look like a
-    bravado_core.request.IncomingRequest"""
+    bravado_core.request.IncomingRequest. MessagePack bodies are only parsed
+    if consumes_msgpack is true"""
 
     path = None
     query = None
@@ -16,7 +20,7 @@ class FlaskRequestProxy(IncomingRequest):
     headers = None
     _json = None
 
-    def __init__(self, request, has_data):
+    def __init__(self, request, has_data, max_size=None, consumes_msgpack=False):
         self.request = request
         self.query = request.args
         self.path = request.view_args
@@ -59,9 +63,38 @@ class FlaskRequestProxy(IncomingRequest):
                     else:
                         raise Exception("Support for multipart/form-data containing %s is not implemented" % type(v))
             else:
-                # Assuming we got a json body
-                self._json = self.request.get_json(force=True)
+                # Assuming we got a json (or MessagePack) body, possibly compressed
+                try:
+                    data = self.request.get_data()
+                    if self.request.content_encoding in ENCODINGS:
+                        # Don't let a small compressed body blow up in memory
+                        data = decompress(data, self.request.content_encoding, max_size)
+                    if ctype.startswith(MSGPACK_MIMETYPE) and consumes_msgpack:
+                        self._json = msgpack_loads(data)
+                    else:
+                        self._json = json_codec.loads(data)
+                except DataTooLarge as e:
+                    raise RequestEntityTooLarge(str(e))
+                except ValueError as e:
+                    raise BadRequest(str(e))
 
     def json(self):
         # Convert a weltkreuz ImmutableDict to a simple python dict
         return self._json
+
+
+class DirectRequest(IncomingRequest):
+    """Take the json body and the path and query parameters of a direct call to
+    a handler, and make them look like a bravado_core.request.IncomingRequest,
+    to be validated and unmarshalled as if sent over HTTP"""
+
+    def __init__(self, body, params):
+        self.query = params
+        self.path = params
+        self.headers = {}
+        self.form = {}
+        self.files = {}
+        self._json = body
+
+    def json(self):
+        return self._json
@@ -0,0 +1,75 @@
+import time
+import random
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class RetryBudget():
+    """A token bucket capping retries at a fraction of calls: every call deposits
+    'ratio' tokens, every retry withdraws one. The bucket also refills by
+    'min_per_sec' tokens per second, so that low-traffic apis can still retry,
+    and holds at most 'burst' tokens."""
+
+    def __init__(self, ratio=0.1, min_per_sec=1.0, burst=10):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, tokens):
+        now = time.monotonic()
+        tokens += (now - self.last_refill) * self.min_per_sec
+        self.last_refill = now
+        self.tokens = min(self.burst, self.tokens + tokens)
+
+    def deposit(self):
+        """Record a call"""
+        with self.lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Take a token for a retry and return True, or return False if the
+        budget is exhausted"""
+        with self.lock:
+            self._refill(0)
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy():
+    """How the client callers of an api retry failed calls: after an exponential
+    backoff with full jitter (a random delay between 0 and
+    min(backoff_max, backoff * 2^retry) seconds), and only as long as the api's
+    retry budget allows it. budget is the fraction of calls that may be
+    retried, or None for no limit."""
+
+    def __init__(self, backoff=0.1, backoff_max=5.0, budget=0.1, budget_min_per_sec=1.0, budget_burst=10):
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.budget = None
+        if budget is not None:
+            self.budget = RetryBudget(ratio=budget, min_per_sec=budget_min_per_sec, burst=budget_burst)
+
+    def on_call(self):
+        """Record a call in the retry budget"""
+        if self.budget:
+            self.budget.deposit()
+
+    def can_retry(self):
+        """Return True if the retry budget allows one more retry, and spend it"""
+        if not self.budget:
+            return True
+        return self.budget.withdraw()
+
+    def get_delay(self, retry):
+        """Return how long to wait before the given retry (0 for the first one)"""
+        if not self.backoff:
+            return 0
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** retry)))
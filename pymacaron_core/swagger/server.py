@@ -1,15 +1,30 @@
+import re
 import jsonschema
 import logging
 import uuid
 import os
+import time
+import hashlib
+from contextvars import ContextVar
 from functools import wraps
-from werkzeug.exceptions import BadRequest
-from flask import request, jsonify
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, HTTPException
+from werkzeug.wrappers import Response as BaseResponse
+from flask import request, Response, has_request_context, current_app
 from flask_cors import cross_origin
-from pymacaron_core.exceptions import PyMacaronCoreException, ValidationError, add_error_handlers
+from pymacaron_core.exceptions import PyMacaronCoreException, ValidationError, RequestTooLargeError, add_error_handlers
 from pymacaron_core.utils import get_function
 from pymacaron_core.models import get_model
-from pymacaron_core.swagger.request import FlaskRequestProxy
+from pymacaron_core.swagger.request import FlaskRequestProxy, DirectRequest
+from pymacaron_core.metrics import registry, observe_server_request, observe_server_coalesced
+from pymacaron_core.tracing import tracer
+from pymacaron_core.profiling import profiler
+from pymacaron_core.watchdog import watchdog
+from pymacaron_core.singleflight import SingleFlight
+from pymacaron_core.swagger.servercache import response_cache
+from pymacaron_core.swagger.delta import DeltaHistory, MERGE_PATCH, MERGE_PATCH_MIMETYPE
+from pymacaron_core.swagger.compression import compress, pick_encoding
+from pymacaron_core.swagger.codec import json_codec, msgpack_dumps, MSGPACK_MIMETYPE
+from pymacaron_core.context import get_timing, get_call_id, get_call_path, set_call_context, scoped_call_context
 from bravado_core.request import unmarshal_request
 
 
@@ -19,41 +34,239 @@ log = logging.getLogger(__name__)
 try:
     from flask import _app_ctx_stack as stack
 except ImportError:
-    from flask import _request_ctx_stack as stack
+    try:
+        from flask import _request_ctx_stack as stack
+    except ImportError:
+        # Removed in flask 2.3: the call context is only in pymacaron_core.context
+        stack = None
 
 
-def spawn_server_api(api_name, app, api_spec, error_callback, decorator):
+def spawn_server_api(api_name, app, api_spec, error_callback, decorator, server_timing=False, compress_level=0, compress_min_size=1024, max_decompressed_size=10 * 1024 * 1024):
     """Take a a Flask app and a swagger file in YAML format describing a REST
     API, and populate the app with routes handling all the paths and methods
     declared in the swagger file.
 
     Also handle marshaling and unmarshaling between json and object instances
     representing the definitions from the swagger file.
+
+    If server_timing is true, responses get a 'Server-Timing' header telling
+    how long each stage of handling the request took.
+
+    If compress_level is set (1 to 9), response bodies of at least
+    compress_min_size bytes are compressed with gzip or deflate at that level,
+    if the caller accepts it.
+
+    Compressed request bodies are rejected with a 413 if they decompress to
+    more than max_decompressed_size bytes, or than the app's
+    MAX_CONTENT_LENGTH.
+
+    Return a dict mapping the (method, path) of each endpoint to a function
+    calling its handler in-process (see _generate_direct_handler), or to None
+    if the endpoint can only be called over HTTP.
     """
 
+    direct_handlers = {}
+
     def mycallback(endpoint):
         handler_func = get_function(endpoint.handler_server)
 
         # Generate api endpoint around that handler
-        handler_wrapper = _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_callback, decorator)
+        handler_wrapper = _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_callback, decorator, server_timing, compress_level, compress_min_size, max_decompressed_size)
 
         # Bind handler to the API path
         log.info("Binding %s %s ==> %s" % (endpoint.method, endpoint.path, endpoint.handler_server))
         endpoint_name = '_'.join([endpoint.method, endpoint.path]).replace('/', '_')
         app.add_url_rule(endpoint.path, endpoint_name, handler_wrapper, methods=[endpoint.method])
 
+        direct_handlers[(endpoint.method, endpoint.path)] = _generate_direct_handler(api_name, app, api_spec, endpoint, handler_func, decorator)
+
 
     api_spec.call_on_each_endpoint(mycallback)
 
     # Add custom error handlers to the app
     add_error_handlers(app)
 
+    return direct_handlers
+
+
+def add_metrics_route(app, path):
+    """Add a route to the Flask app, returning all metrics in the Prometheus text
+    format"""
+
+    if 'pym_metrics' in app.view_functions:
+        # Another api already mounted the metrics route
+        return
+
+    def get_metrics():
+        return Response(registry.expose(), mimetype='text/plain; version=0.0.4')
+
+    log.info("Binding GET %s ==> metrics" % path)
+    app.add_url_rule(path, 'pym_metrics', get_metrics, methods=['GET'])
+
+
+class RequestTiming():
+    """Record how long each stage of handling a request takes, from parsing the
+    request to serializing the response"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+        self.total = None
+
+    def add(self, name, t0):
+        """Record a stage that started at t0, and return the current time"""
+        now = time.perf_counter()
+        self.stages.append((name, now - t0))
+        return now
+
+    def stop(self):
+        self.total = time.perf_counter() - self.start
+        return self.total
+
+    def to_dict(self):
+        """Return a dict mapping stage names to their durations in seconds"""
+        d = dict(self.stages)
+        if self.total is not None:
+            d['total'] = self.total
+        return d
+
+    def to_header(self):
+        """Return the stages as the value of a Server-Timing header (durations in ms)"""
+        return ', '.join('%s;dur=%.3f' % (name, duration * 1000) for name, duration in list(self.to_dict().items()))
+
+
+def get_request_timing():
+    """Return the RequestTiming of the request being handled, or None. Can be called
+    from within endpoint handlers and from the global decorator passed to
+    spawn_api"""
+    return get_timing()
+
+
+# Version of the response, as set by the handler with set_etag()
+_etag = ContextVar('pym_etag', default=None)
+
+# True while a handler is called by a local client caller (see
+# _generate_direct_handler), even if the caller is itself handling a request
+_direct_call = ContextVar('pym_direct_call', default=False)
+
+
+def set_etag(version):
+    """Set the version of the response to the current request, to be sent as
+    its ETag instead of a hash of its body. Return True if the caller already
+    has that version, in which case the handler may return right away: the
+    caller gets a '304 Not Modified' response whatever the handler returns, and
+    the result is not serialized. Always return False when the handler is
+    called directly, by a local client caller or outside of a request."""
+    if _direct_call.get() or not has_request_context():
+        return False
+    version = str(version)
+    _etag.set(version)
+    return request.if_none_match.contains_weak(version)
+
+
+def _hash_body(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _not_modified(etag):
+    r = Response(status=304)
+    r.set_etag(etag)
+    return r
+
+
+def _delta_response(r, history):
+    """If the caller holds an older version of the response r and accepts
+    merge patches, return a '226 IM Used' response with the json merge patch
+    from that version to r, if smaller than r"""
+    if MERGE_PATCH not in request.headers.get('A-IM', ''):
+        return r
+    base_etags = request.if_none_match.as_set(include_weak=True)
+    base_etag, patch = history.get_patch(base_etags, r.get_etag()[0], r.get_data())
+    if patch is None:
+        return r
+    d = Response(patch, status=226, mimetype=MERGE_PATCH_MIMETYPE)
+    for k, v in r.headers.items():
+        if k.lower() not in ('content-type', 'content-length'):
+            d.headers.add(k, v)
+    d.headers['IM'] = MERGE_PATCH
+    d.headers['Delta-Base'] = '"%s"' % base_etag
+    return d
+
+
+def _compress_response(r, level, min_size, timing):
+    """Compress the body of r if large enough, with the encoding preferred by
+    the caller"""
+    t = time.perf_counter()
+    if r.status_code not in (200, 226) or r.direct_passthrough or 'Content-Encoding' in r.headers:
+        return r
+    data = r.get_data()
+    if len(data) < min_size:
+        return r
+    r.vary.add('Accept-Encoding')
+    encoding = pick_encoding(request.accept_encodings)
+    if not encoding:
+        return r
+    r.set_data(compress(data, encoding, level))
+    r.headers['Content-Encoding'] = encoding
+    timing.add('compress', t)
+    etag, weak = r.get_etag()
+    if etag and not weak:
+        # Same content, different bytes
+        r.set_etag(etag, weak=True)
+    return r
+
+
+def _get_exception_status(e):
+    """Return the status of the response an exception raised by a handler_wrapper
+    will be turned into"""
+    if isinstance(e, HTTPException):
+        return e.code
+    return getattr(e, 'status_code', 500)
+
+
+def _get_status_and_size(r):
+    """Return the status code and body size of whatever a handler_wrapper returned"""
+    if isinstance(r, BaseResponse):
+        return r.status_code, r.calculate_content_length()
+    if type(r) is tuple:
+        status = r[1] if len(r) > 1 and type(r[1]) is int else 200
+        body = r[0]
+    else:
+        status = 200
+        body = r
+    if isinstance(body, (str, bytes)):
+        return status, len(body)
+    return status, None
+
+
+def _jsonify(j):
+    """Like flask's jsonify, but serializing j with the configured json codec"""
+    return current_app.response_class(json_codec.dumps(j), mimetype=current_app.config.get('JSONIFY_MIMETYPE', 'application/json'))
+
+
+def _get_max_body_size(max_size):
+    """Return the maximum size of decompressed request bodies"""
+    max_content_length = current_app.config.get('MAX_CONTENT_LENGTH')
+    if max_content_length and (max_size is None or max_content_length < max_size):
+        return max_content_length
+    return max_size
+
+
+def _msgpackify(j):
+    """Like _jsonify, but serializing j to MessagePack"""
+    return current_app.response_class(msgpack_dumps(j), mimetype=MSGPACK_MIMETYPE)
+
+
+def _accepts_msgpack():
+    """Return true if the caller prefers MessagePack to json"""
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
 
 def _responsify(api_spec, error, status):
     """Take a bravado-core model representing an error, and return a Flask Response
     with the given error code and error instance as body"""
     result_json = api_spec.model_to_json(error)
-    r = jsonify(result_json)
+    r = _jsonify(result_json)
     r.status_code = status
     return r
 
@@ -84,10 +297,9 @@ def log_endpoint(f, endpoint):
     return decorator
 
 
-def _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_callback, global_decorator):
-    """Generate a handler method for the given url method+path and operation"""
-
-    # Add logging around the handler function
+def _decorate_handler(handler_func, endpoint):
+    """Add logging and the endpoint's 'x-decorate-server' decorator, if any,
+    around the handler function"""
     handler_func = log_endpoint(handler_func, endpoint)
 
     # Decorate the handler function, if Swagger spec tells us to
@@ -95,33 +307,185 @@ def _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_
         endpoint_decorator = get_function(endpoint.decorate_server)
         handler_func = endpoint_decorator(handler_func)
 
+    return handler_func
+
+
+def _call_direct(handler_func, args, kwargs):
+    result = handler_func(*args, **kwargs)
+    if result and hasattr(result, 'http_reply'):
+        # A pymacaron error instance, to be unmarshalled by the caller
+        log.info("Looks like a pymacaron error instance - calling .http_reply()")
+        return result.http_reply()
+    return result
+
+
+def _generate_direct_handler(api_name, app, api_spec, endpoint, handler_func, global_decorator):
+    """Generate a function calling the endpoint's handler in-process, for the
+    local client callers of an api served by this app. It takes the arguments
+    of the endpoint's client caller (the body model instance and the path and
+    query parameters), validates and unmarshals them into new instances as if
+    they had been sent over HTTP, and calls the handler, wrapped in the global
+    decorator. The flask request and the serialization to json text are
+    skipped. The call context is the same as when the handler is called over
+    HTTP, and so is the flask request context if the caller is itself handling
+    a request.
+
+    Return None for endpoints returning html or taking formData parameters,
+    which are called via flask's test_client instead."""
+
+    if endpoint.produces_html or endpoint.param_in_formdata:
+        return None
+
+    handler_func = _decorate_handler(handler_func, endpoint)
+
+    metric_labels = (api_name, endpoint.method, endpoint.path)
+
+    def call_handler(*args, **kwargs):
+        if endpoint.param_in_body or endpoint.param_in_query:
+            # Validate the arguments, and copy them into new instances, as
+            # handle_request does with the request's
+            body = api_spec.model_to_json(args[0]) if endpoint.param_in_body and args[0] is not None else None
+            try:
+                parameters = unmarshal_request(DirectRequest(body, kwargs), endpoint.operation)
+            except jsonschema.exceptions.ValidationError as e:
+                raise ValidationError(str(e))
+
+            if endpoint.param_in_body:
+                body = [v for k, v in parameters.items() if k not in kwargs][0]
+                if body is not None:
+                    body = get_model(body.__class__.__name__).from_bravado(body)
+                args = [body]
+
+            if endpoint.param_in_query:
+                kwargs = parameters
+
+        return _call_direct(handler_func, args, kwargs)
+
+    if global_decorator:
+        call_handler = global_decorator(call_handler)
+
     @wraps(handler_func)
-    def handler_wrapper(**path_params):
-        if os.environ.get('PYM_DEBUG', None) == '1':
-            log.debug("PYM_DEBUG: Request headers are: %s" % dict(request.headers))
+    def direct_handler(*args, **kwargs):
+        call_id = get_call_id() or str(uuid.uuid4())
+        call_path = get_call_path()
+        call_path = "%s.%s" % (call_path, api_name) if call_path else api_name
+        set_call_context(call_id=call_id, call_path=call_path)
+
+        # The flask request, if any, is the caller's: not the one to this handler
+        direct_call = _direct_call.set(True)
+        t0 = time.perf_counter()
+        status = 500
+        try:
+            if has_request_context():
+                result = call_handler(*args, **kwargs)
+            else:
+                # The global decorator may look at the request
+                path = re.sub('<([^>]+)>', lambda m: str(kwargs.get(m.group(1))), endpoint.path)
+                with app.test_request_context(path, method=endpoint.method):
+                    result = call_handler(*args, **kwargs)
+            status = result.status_code if isinstance(result, BaseResponse) else 200
+            return result
+        except Exception as e:
+            status = _get_exception_status(e)
+            raise
+        finally:
+            _direct_call.reset(direct_call)
+            observe_server_request(metric_labels, status, time.perf_counter() - t0, 0, None)
 
-        # Get caller's pym-call-id or generate one
-        call_id = request.headers.get('PymCallID', None)
-        if not call_id:
-            call_id = str(uuid.uuid4())
-        stack.top.call_id = call_id
+    # Like handler_wrapper, the call context is restored once the handler is done
+    return scoped_call_context(direct_handler)
 
-        # Append current server to call path, or start one
-        call_path = request.headers.get('PymCallPath', None)
-        if call_path:
-            call_path = "%s.%s" % (call_path, api_name)
-        else:
-            call_path = api_name
-        stack.top.call_path = call_path
 
+def _freeze_response(r):
+    """Turn whatever handle_request returned into a tuple (body, status,
+    headers) that can be shared between requests"""
+    r = current_app.make_response(r)
+    return r.get_data(), r.status_code, list(r.headers.items())
+
+
+def _thaw_response(frozen):
+    """Make a new flask Response out of a frozen one, so that each request
+    sets its own headers on it"""
+    data, status, headers = frozen
+    return Response(data, status=status, headers=headers)
+
+
+def _coalesce_requests(handle_request, endpoint, metric_labels):
+    """Wrap handle_request so that identical concurrent requests (same path,
+    query parameters and 'x-coalesce-headers') share one execution of the
+    handler and its serialized response"""
+
+    # Requests holding different versions may get different responses
+    singleflight = SingleFlight(key_headers=endpoint.coalesce_headers + ('If-None-Match',))
+
+    def freeze(timing, path_params):
+        return _freeze_response(handle_request(timing, path_params))
+
+    def coalesced_handle_request(timing, path_params):
+        key = singleflight.get_key(request.path, dict(request.args.lists()), request.headers)
+        t = time.perf_counter()
+        frozen, coalesced = singleflight.do(key, freeze, timing, path_params)
+        if coalesced:
+            timing.add('coalesced', t)
+            observe_server_coalesced(metric_labels)
+        return _thaw_response(frozen)
+
+    return coalesced_handle_request
+
+
+def _cache_responses(handle_request, endpoint, metric_labels):
+    """Wrap handle_request so that the serialized 200 responses of the
+    endpoint are stored in the server's response cache for 'x-cache-ttl'
+    seconds, and returned as is to identical requests (same path, query
+    parameters and 'x-cache-vary' headers)"""
+
+    def cached_handle_request(timing, path_params):
+        key = response_cache.get_key(request.path, request.args, request.headers, endpoint.cache_vary)
+        t = time.perf_counter()
+        frozen = response_cache.get(key, metric_labels)
+        if frozen is not None:
+            timing.add('cache', t)
+            return _thaw_response(frozen)
+
+        r = current_app.make_response(handle_request(timing, path_params))
+        if r.status_code == 200:
+            response_cache.store(key, _freeze_response(r), endpoint.cache_ttl, metric_labels)
+        return r
+
+    return cached_handle_request
+
+
+def _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_callback, global_decorator, server_timing=False, compress_level=0, compress_min_size=1024, max_decompressed_size=None):
+    """Generate a handler method for the given url method+path and operation"""
+
+    handler_func = _decorate_handler(handler_func, endpoint)
+
+    # Should responses get an ETag, and be answered with a 304 when the caller
+    # already has them?
+    use_etag = endpoint.etag and endpoint.method == 'GET' and endpoint.produces_json
+
+    # Recent versions of the responses, to send delta responses to callers
+    # holding an older one
+    history = DeltaHistory(endpoint.delta_history) if use_etag and endpoint.delta else None
+
+    def handle_request(timing, path_params):
         if endpoint.param_in_body or endpoint.param_in_query or endpoint.param_in_formdata:
             # Turn the flask request into something bravado-core can process...
             has_data = endpoint.param_in_body or endpoint.param_in_formdata
+            t = time.perf_counter()
             try:
-                req = FlaskRequestProxy(request, has_data)
-            except BadRequest:
-                ee = error_callback(ValidationError("Cannot parse json data: have you set 'Content-Type' to 'application/json'?"))
+                req = FlaskRequestProxy(request, has_data, _get_max_body_size(max_decompressed_size), endpoint.consumes_msgpack)
+            except RequestEntityTooLarge as e:
+                ee = error_callback(RequestTooLargeError(e.description))
+                return _responsify(api_spec, ee, 413)
+            except BadRequest as e:
+                if endpoint.consumes_msgpack and (request.content_type or '').startswith(MSGPACK_MIMETYPE):
+                    msg = "Cannot parse MessagePack data: %s" % e.description
+                else:
+                    msg = "Cannot parse json data: have you set 'Content-Type' to 'application/json'?"
+                ee = error_callback(ValidationError(msg))
                 return _responsify(api_spec, ee, 400)
+            t = timing.add('parse', t)
 
             try:
                 # Note: unmarshall validates parameters but does not fail
@@ -131,6 +495,7 @@ def _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_
             except jsonschema.exceptions.ValidationError as e:
                 ee = error_callback(ValidationError(str(e)))
                 return _responsify(api_spec, ee, 400)
+            timing.add('unmarshal', t)
 
         # Call the endpoint, with proper parameters depending on whether
         # parameters are in body, query or url
@@ -148,10 +513,12 @@ def _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_
             assert len(lst) == 1
 
             # Now convert the Bravado body object into a pymacaron model
+            t = time.perf_counter()
             body = lst[0]
             cls = get_model(body.__class__.__name__)
             body = cls.from_bravado(body)
             args.append(body)
+            timing.add('convert', t)
 
         if endpoint.param_in_query:
             kwargs.update(parameters)
@@ -164,7 +531,14 @@ def _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_
         if os.environ.get('PYM_DEBUG', None) == '1':
             log.debug("PYM_DEBUG: Request args are: [args: %s] [kwargs: %s]" % (args, kwargs))
 
+        t = time.perf_counter()
         result = handler_func(*args, **kwargs)
+        timing.add('handler', t)
+
+        etag = _etag.get() if use_etag else None
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            # The caller already has this version: skip serialization
+            return _not_modified(etag)
 
         if not result:
             e = error_callback(PyMacaronCoreException("Have nothing to send in response"))
@@ -204,12 +578,106 @@ def _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_
             # the result.
 
             # TODO: check that result is an instance of a model expected as response from this endpoint
+            t = time.perf_counter()
             result_json = api_spec.model_to_json(result)
-
-            # Send a Flask Response with code 200 and result_json
-            r = jsonify(result_json)
+            t = timing.add('serialize', t)
+
+            # Send a Flask Response with code 200 and result_json, in the
+            # format preferred by the caller
+            if endpoint.produces_msgpack and _accepts_msgpack():
+                r = _msgpackify(result_json)
+            else:
+                r = _jsonify(result_json)
             r.status_code = 200
+            if endpoint.produces_msgpack:
+                r.vary.add('Accept')
+            if use_etag:
+                etag = etag if etag is not None else _hash_body(r.get_data())
+                r.set_etag(etag)
+                if history:
+                    history.add(etag, result_json)
+            timing.add('jsonify', t)
+            return r
+
+    metric_labels = (api_name, endpoint.method, endpoint.path)
+    span_name = '%s %s %s' % (api_name, endpoint.method, endpoint.path)
+
+    if endpoint.coalesce:
+        if endpoint.method == 'GET' and endpoint.produces_json:
+            handle_request = _coalesce_requests(handle_request, endpoint, metric_labels)
+        else:
+            log.warn("Ignoring x-coalesce of %s %s: only GET json endpoints can be coalesced" % (endpoint.method, endpoint.path))
+
+    if endpoint.cache_ttl:
+        if endpoint.method == 'GET' and endpoint.produces_json:
+            # Check the cache before waiting for an identical request
+            handle_request = _cache_responses(handle_request, endpoint, metric_labels)
+        else:
+            log.warn("Ignoring x-cache-ttl of %s %s: only GET json endpoints can be cached" % (endpoint.method, endpoint.path))
+
+    @wraps(handler_func)
+    def handler_wrapper(**path_params):
+        timing = RequestTiming()
+
+        if os.environ.get('PYM_DEBUG', None) == '1':
+            log.debug("PYM_DEBUG: Request headers are: %s" % dict(request.headers))
+
+        # Get caller's pym-call-id or generate one
+        call_id = request.headers.get('PymCallID', None)
+        if not call_id:
+            call_id = str(uuid.uuid4())
+
+        # Append current server to call path, or start one
+        call_path = request.headers.get('PymCallPath', None)
+        if call_path:
+            call_path = "%s.%s" % (call_path, api_name)
+        else:
+            call_path = api_name
+
+        span = tracer.start_server_span(span_name, call_id, request.headers)
+
+        set_call_context(call_id=call_id, call_path=call_path, span=span, timing=timing)
+
+        # Deprecated: kept for code reading the call context from flask's
+        # app context. Use pymacaron_core.context instead.
+        if stack is not None and stack.top is not None:
+            stack.top.call_id = call_id
+            stack.top.call_path = call_path
+
+        inflight = watchdog.track(span_name, call_id, call_path, endpoint.watchdog_threshold) if watchdog.running else None
+
+        r = None
+        status = 500
+        try:
+            if profiler.enabled and profiler.should_profile(metric_labels, request.headers):
+                r = profiler.run(metric_labels, handle_request, timing, path_params)
+            else:
+                r = handle_request(timing, path_params)
+            if use_etag and isinstance(r, BaseResponse) and r.status_code == 200:
+                # Also covers cached and coalesced responses
+                r = r.make_conditional(request)
+                if history and r.status_code == 200 and r.mimetype != MSGPACK_MIMETYPE:
+                    r = _delta_response(r, history)
+            if compress_level and isinstance(r, BaseResponse):
+                r = _compress_response(r, compress_level, compress_min_size, timing)
+            if server_timing and isinstance(r, BaseResponse):
+                timing.stop()
+                r.headers['Server-Timing'] = timing.to_header()
             return r
+        except Exception as e:
+            # Raised by the error callback, to be turned into a response by
+            # the app's error handlers
+            status = _get_exception_status(e)
+            raise
+        finally:
+            size = None
+            if r is not None:
+                status, size = _get_status_and_size(r)
+            observe_server_request(metric_labels, status, timing.stop(), request.content_length or 0, size)
+            if span:
+                tracer.finish(span, status=status, call_path=call_path)
+            if inflight:
+                watchdog.untrack(inflight)
 
     handler_wrapper = cross_origin(headers=['Content-Type', 'Authorization'])(handler_wrapper)
 
@@ -217,4 +685,6 @@ def _generate_handler_wrapper(api_name, api_spec, endpoint, handler_func, error_
     if global_decorator:
         handler_wrapper = global_decorator(handler_wrapper)
 
-    return handler_wrapper
+    # The call context set by handler_wrapper is visible to the global
+    # decorator, and restored when the request is done
+    return scoped_call_context(handler_wrapper)
@@ -0,0 +1,80 @@
+import logging
+from pymacaron_core.lru import LRUCache
+from pymacaron_core.metrics import observe_server_cache, observe_server_cache_evictions
+
+
+log = logging.getLogger(__name__)
+
+
+class MemoryBackend():
+    """Store cached responses in this process's memory, in an LRU cache of at
+    most max_size responses"""
+
+    def __init__(self, max_size=1000):
+        self.lru = LRUCache(max_size)
+
+    def get(self, key):
+        return self.lru.get(key)
+
+    def set(self, key, value, ttl):
+        """Store value under key for ttl seconds, and return the number of
+        entries evicted to make room for it"""
+        return self.lru.set(key, value, ttl=ttl)
+
+    def invalidate(self, path=None):
+        if path is None:
+            self.lru.clear()
+            return
+        for key in self.lru.keys():
+            if key[0] == path:
+                self.lru.pop(key)
+
+
+class ResponseCache():
+    """A cache of the serialized responses of the GET endpoints marked with
+    'x-cache-ttl' in the swagger spec, shared by all the apis of the server.
+
+    Responses are keyed by path, query parameters and the endpoint's
+    'x-cache-vary' headers, and stored by a backend (by default, a
+    MemoryBackend) as a tuple (body, status, headers)."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+
+    def configure(self, backend=None, max_size=1000):
+        """Replace the cache's backend, dropping all cached responses"""
+        self.backend = backend or MemoryBackend(max_size=max_size)
+
+    def get_key(self, path, args, headers, vary):
+        query = tuple(sorted(args.items(multi=True))) if args else ()
+        return (path, query, tuple(headers.get(h) or '' for h in vary))
+
+    def get(self, key, labels):
+        """Return the response stored under key, or None"""
+        value = self.backend.get(key)
+        observe_server_cache(labels, 'hit' if value is not None else 'miss')
+        return value
+
+    def store(self, key, value, ttl, labels):
+        evicted = self.backend.set(key, value, ttl)
+        if evicted:
+            observe_server_cache_evictions(labels, evicted)
+
+    def invalidate(self, path=None):
+        """Drop all cached responses, or only those of requests to path"""
+        self.backend.invalidate(path)
+
+
+response_cache = ResponseCache()
+
+
+def configure_response_cache(backend=None, max_size=1000):
+    """Set the backend storing the server's cached responses, or the size of
+    the default in-process backend"""
+    response_cache.configure(backend=backend, max_size=max_size)
+
+
+def invalidate_response_cache(path=None):
+    """Drop all the server's cached responses, or only those of requests to
+    path (such as '/v1/user/1234')"""
+    response_cache.invalidate(path)
@@ -0,0 +1,251 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import marshal
+import hashlib
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+MAGIC = b'PYMCACH1'
+
+# magic, number of slots, size of a slot, position of the clock hand
+HEADER = struct.Struct('<8sIII')
+HEADER_SIZE = 32
+
+# key digest, slot number
+INDEX_ENTRY = struct.Struct('<16sI')
+
+# in use, referenced, key digest, path digest, expiry time, payload size
+SLOT_HEADER = struct.Struct('<BB16s8sdI')
+
+EMPTY_DIGEST = b'\0' * 16
+
+
+def _digest(s, size):
+    return hashlib.blake2b(s.encode('utf-8'), digest_size=size).digest()
+
+
+class SharedMemoryBackend():
+    """A backend of the server response cache (see servercache) shared by all
+    the processes of a host that open the same file, such as the prefork
+    workers of a server. The file is memory-mapped, and preferably lives in
+    a tmpfs such as /dev/shm.
+
+    Responses are stored in a fixed number of slots of slot_size bytes each
+    (larger responses are not cached), found via an open-addressing hash
+    index of the digests of their keys. When all slots are used, the slot to
+    reuse is picked by the CLOCK algorithm: slots read since the clock hand
+    last passed them get a second chance.
+
+    Writes are serialized across processes with flock(), and across the
+    threads of a process with a lock."""
+
+    def __init__(self, path='/dev/shm/pymacaron-response-cache', slots=1024, slot_size=16384):
+        if slot_size <= SLOT_HEADER.size:
+            raise ValueError("slot_size must be larger than %s bytes" % SLOT_HEADER.size)
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.index_size = slots * 2
+        self.index_offset = HEADER_SIZE
+        self.slots_offset = HEADER_SIZE + self.index_size * INDEX_ENTRY.size
+        self.size = self.slots_offset + slots * slot_size
+        self.lock = threading.Lock()
+        self.pid = None
+        self._open()
+
+    def _open(self):
+        """Map the file, initializing it unless another process already did.
+        Raise a ValueError if the file holds a cache of another geometry,
+        which other processes may still be using"""
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.pid = os.getpid()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self.fd).st_size
+            if size == 0:
+                log.info("Initializing shared response cache in %s" % self.path)
+                os.ftruncate(self.fd, self.size)
+                self.mm = mmap.mmap(self.fd, self.size)
+                HEADER.pack_into(self.mm, 0, MAGIC, self.slots, self.slot_size, 0)
+            else:
+                magic, slots, slot_size, hand = HEADER.unpack(os.pread(self.fd, HEADER.size, 0).ljust(HEADER.size, b'\0'))
+                if magic != MAGIC:
+                    raise ValueError("%s is not a shared response cache" % self.path)
+                if (slots, slot_size, size) != (self.slots, self.slot_size, self.size):
+                    raise ValueError("%s holds a shared response cache of %s slots of %s bytes, not %s slots of %s bytes" % (self.path, slots, slot_size, self.slots, self.slot_size))
+                self.mm = mmap.mmap(self.fd, self.size)
+        except Exception:
+            # Also releases the flock
+            os.close(self.fd)
+            raise
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _check_fork(self):
+        # A forked process shares the parent's open file, and therefore its
+        # flock: open the file again
+        if os.getpid() != self.pid:
+            self.mm.close()
+            os.close(self.fd)
+            self.lock = threading.Lock()
+            self._open()
+
+    def _locked(self, f, *args, exclusive=True):
+        self._check_fork()
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                return f(*args)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    #
+    # Hash index
+    #
+
+    def _home(self, digest):
+        return int.from_bytes(digest[:8], 'little') % self.index_size
+
+    def _read_entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.mm, self.index_offset + i * INDEX_ENTRY.size)
+
+    def _write_entry(self, i, digest, slot):
+        INDEX_ENTRY.pack_into(self.mm, self.index_offset + i * INDEX_ENTRY.size, digest, slot)
+
+    def _find(self, digest):
+        """Return the index position of digest, or of the empty entry where it
+        would go"""
+        i = self._home(digest)
+        for _ in range(self.index_size):
+            d, slot = self._read_entry(i)
+            if d == digest or d == EMPTY_DIGEST:
+                return i
+            i = (i + 1) % self.index_size
+        raise Exception("BUG: shared response cache index is full")
+
+    def _delete_entry(self, i):
+        """Remove an index entry, shifting back the entries that probed past it"""
+        j = i
+        while True:
+            j = (j + 1) % self.index_size
+            d, slot = self._read_entry(j)
+            if d == EMPTY_DIGEST:
+                break
+            k = self._home(d)
+            # Entries whose home is cyclically within (i, j] stay where they are
+            if (i < j and i < k <= j) or (i > j and (k > i or k <= j)):
+                continue
+            self._write_entry(i, d, slot)
+            i = j
+        self._write_entry(i, EMPTY_DIGEST, 0)
+
+    #
+    # Slots
+    #
+
+    def _slot_offset(self, slot):
+        return self.slots_offset + slot * self.slot_size
+
+    def _read_slot(self, slot):
+        return SLOT_HEADER.unpack_from(self.mm, self._slot_offset(slot))
+
+    def _free_slot(self, slot):
+        """Remove a slot's entry from the index, and mark it as unused"""
+        in_use, ref, digest, path_digest, expires_at, size = self._read_slot(slot)
+        if in_use:
+            i = self._find(digest)
+            if self._read_entry(i)[0] == digest:
+                self._delete_entry(i)
+        self.mm[self._slot_offset(slot)] = 0
+
+    def _pick_victim(self):
+        """Return a slot to store a new response in, and whether a live response
+        was evicted from it"""
+        hand = HEADER.unpack_from(self.mm, 0)[3]
+        now = time.time()
+        # After one turn all slots are unreferenced: two turns at most
+        for _ in range(2 * self.slots + 1):
+            slot = hand
+            hand = (hand + 1) % self.slots
+            offset = self._slot_offset(slot)
+            in_use, ref, digest, path_digest, expires_at, size = self._read_slot(slot)
+            if not in_use or expires_at <= now:
+                break
+            if ref:
+                self.mm[offset + 1] = 0
+                continue
+            break
+        struct.pack_into('<I', self.mm, 16, hand)
+        evicted = bool(in_use) and expires_at > now
+        self._free_slot(slot)
+        return slot, evicted
+
+    def _get(self, key):
+        digest = _digest(repr(key), 16)
+        i = self._find(digest)
+        d, slot = self._read_entry(i)
+        if d != digest:
+            return None
+        in_use, ref, sdigest, path_digest, expires_at, size = self._read_slot(slot)
+        if not in_use or sdigest != digest or expires_at <= time.time():
+            return None
+        offset = self._slot_offset(slot)
+        stored_key, value = marshal.loads(self.mm[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + size])
+        if stored_key != key:
+            return None
+        self.mm[offset + 1] = 1
+        return value
+
+    def _set(self, key, value, ttl):
+        payload = marshal.dumps((key, value))
+        if len(payload) > self.slot_size - SLOT_HEADER.size:
+            log.debug("Response of %s is too large for the shared response cache" % key[0])
+            return 0
+
+        digest = _digest(repr(key), 16)
+        d, slot = self._read_entry(self._find(digest))
+        evicted = False
+        if d == digest:
+            # Overwrite the previous response
+            self._free_slot(slot)
+        else:
+            slot, evicted = self._pick_victim()
+
+        offset = self._slot_offset(slot)
+        SLOT_HEADER.pack_into(self.mm, offset, 1, 0, digest, _digest(key[0], 8), time.time() + ttl, len(payload))
+        self.mm[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(payload)] = payload
+        self._write_entry(self._find(digest), digest, slot)
+        return 1 if evicted else 0
+
+    def _invalidate(self, path):
+        if path is None:
+            self.mm[HEADER_SIZE:] = b'\0' * (self.size - HEADER_SIZE)
+            return
+        path_digest = _digest(path, 8)
+        for slot in range(self.slots):
+            in_use, ref, digest, pdigest, expires_at, size = self._read_slot(slot)
+            if in_use and pdigest == path_digest:
+                self._free_slot(slot)
+
+    def get(self, key):
+        # Setting the referenced flag is a single byte write, harmless under
+        # a shared lock
+        return self._locked(self._get, key, exclusive=False)
+
+    def set(self, key, value, ttl):
+        """Store value under key for ttl seconds, and return the number of
+        entries evicted to make room for it"""
+        return self._locked(self._set, key, value, ttl)
+
+    def invalidate(self, path=None):
+        self._locked(self._invalidate, path)
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
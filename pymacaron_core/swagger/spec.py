@@ -6,6 +6,7 @@ from bravado_core.validate import validate_schema_object
 from pymacaron_core.exceptions import ValidationError
 from pymacaron_core.models import generate_model_class
 from pymacaron_core.models import get_model
+from pymacaron_core.swagger.codec import msgpack, MSGPACK_MIMETYPE
 
 
 log = logging.getLogger(__name__)
@@ -19,9 +20,22 @@ class EndpointData():
     handler_client = None
     decorate_server = None
     decorate_request = None
+    watchdog_threshold = None
+    client_cache = None
+    hedge_delay = None
+    hedge_max_rate = 0.1
+    coalesce = False
+    cache_ttl = None
+    etag = True
+    delta = False
+    delta_history = 100
+    cache_vary = ('Authorization',)
+    coalesce_headers = ('Authorization',)
     operation = None
     produces_json = False
     produces_html = False
+    produces_msgpack = False
+    consumes_msgpack = False
 
     param_in_body = False
     param_in_query = False
@@ -44,11 +58,12 @@ class ApiSpec():
 
     host = None
     port = None
+    hosts = None
     protocol = None
     version = None
     verify_ssl = True
 
-    def __init__(self, swagger_dict, formats=None, host=None, port=None, proto=None, verify_ssl=True):
+    def __init__(self, swagger_dict, formats=None, host=None, port=None, proto=None, verify_ssl=True, hosts=None):
 
         self.swagger_dict = swagger_dict
 
@@ -91,6 +106,20 @@ class ApiSpec():
         if not verify_ssl:
             self.verify_ssl = False
 
+        # The list of (host, port) serving this api. 'hosts' entries are
+        # either 'host' or 'host:port'
+        self.hosts = [(self.host, self.port)]
+        if hosts:
+            self.hosts = []
+            for h in hosts:
+                h = str(h)
+                if ':' in h:
+                    h, p = h.rsplit(':', 1)
+                    self.hosts.append((h, int(p)))
+                else:
+                    self.hosts.append((h, self.port))
+            self.host, self.port = self.hosts[0]
+
         self.version = swagger_dict.get('info', {}).get('version', '')
 
 
@@ -177,17 +206,28 @@ class ApiSpec():
                     data.handler_server = op_spec['x-bind-server']
 
                 # Make sure that endpoint only produces 'application/json'
+                # (optionally along with 'application/msgpack')
                 if 'produces' not in op_spec:
                     raise Exception("Swagger api has no 'produces' section for %s %s" % (method, path))
-                if len(op_spec['produces']) != 1:
+                produces = [p for p in op_spec['produces'] if p != MSGPACK_MIMETYPE]
+                if len(produces) != 1:
                     raise Exception("Expecting only one type under 'produces' for %s %s" % (method, path))
-                if op_spec['produces'][0] == 'application/json':
+                if produces[0] == 'application/json':
                     data.produces_json = True
-                elif op_spec['produces'][0] == 'text/html':
+                elif produces[0] == 'text/html' and len(op_spec['produces']) == 1:
                     data.produces_html = True
                 else:
                     raise Exception("Only 'application/json' or 'text/html' are supported. See %s %s" % (method, path))
 
+                # Can the endpoint send and receive MessagePack instead of json?
+                consumes = op_spec.get('consumes', self.swagger_dict.get('consumes', []))
+                if MSGPACK_MIMETYPE in op_spec['produces'] + consumes:
+                    if msgpack:
+                        data.produces_msgpack = MSGPACK_MIMETYPE in op_spec['produces']
+                        data.consumes_msgpack = MSGPACK_MIMETYPE in consumes
+                    else:
+                        log.warn("Ignoring %s for %s %s: msgpack is not installed" % (MSGPACK_MIMETYPE, method, path))
+
                 # Which client method handles this endpoint?
                 if 'x-bind-client' in op_spec:
                     data.handler_client = op_spec['x-bind-client']
@@ -200,6 +240,47 @@ class ApiSpec():
                 if 'x-decorate-request' in op_spec:
                     data.decorate_request = op_spec['x-decorate-request']
 
+                # After how many seconds should the watchdog report this endpoint as slow?
+                if 'x-watchdog-threshold' in op_spec:
+                    data.watchdog_threshold = float(op_spec['x-watchdog-threshold'])
+
+                # Should client calls to this endpoint be cached?
+                if 'x-client-cache' in op_spec:
+                    data.client_cache = bool(op_spec['x-client-cache'])
+
+                # Should client calls to this endpoint be hedged, and after how long?
+                if 'x-hedge-delay' in op_spec:
+                    data.hedge_delay = op_spec['x-hedge-delay']
+                if 'x-hedge-max-rate' in op_spec:
+                    data.hedge_max_rate = float(op_spec['x-hedge-max-rate'])
+
+                # Should identical concurrent requests share one handler execution?
+                if 'x-coalesce' in op_spec:
+                    data.coalesce = bool(op_spec['x-coalesce'])
+                if 'x-coalesce-headers' in op_spec:
+                    data.coalesce_headers = tuple(op_spec['x-coalesce-headers'])
+
+                # Should responses get an ETag, for conditional requests?
+                if 'x-etag' in op_spec:
+                    data.etag = bool(op_spec['x-etag'])
+
+                # Should callers holding an older version get a delta response?
+                if 'x-delta' in op_spec:
+                    data.delta = bool(op_spec['x-delta'])
+                if 'x-delta-history' in op_spec:
+                    data.delta_history = int(op_spec['x-delta-history'])
+
+                # Should the server cache this endpoint's responses, and for how long?
+                if 'x-cache-ttl' in op_spec:
+                    data.cache_ttl = float(op_spec['x-cache-ttl'])
+                if 'x-cache-vary' in op_spec:
+                    data.cache_vary = tuple(op_spec['x-cache-vary'])
+
+                if data.produces_msgpack:
+                    # The format of the response depends on the caller's 'Accept'
+                    data.cache_vary = data.cache_vary + ('Accept',)
+                    data.coalesce_headers = data.coalesce_headers + ('Accept',)
+
                 # Generate a bravado-core operation object
                 data.operation = Operation.from_spec(self.spec, path, method, op_spec)
 
@@ -0,0 +1,210 @@
+import logging
+import functools
+import requests
+import urllib3
+from urllib.parse import urlencode
+from http.cookiejar import DefaultCookiePolicy
+from requests.exceptions import ReadTimeout, ConnectTimeout, ConnectionError
+from requests.utils import DEFAULT_CA_BUNDLE_PATH
+from pymacaron_core.exceptions import PyMacaronCoreException
+from pymacaron_core.swagger.codec import json_codec
+
+
+log = logging.getLogger(__name__)
+
+
+class Transport():
+    """Send the HTTP requests of an API's client callers, via a pool of
+    connections shared by all the callers of that API and all threads.
+
+    get_method(method) returns a function with the same signature and
+    exceptions as requests.get/post/etc, that is:
+
+      f(url, data=None, params=None, headers=None, timeout=(connect_timeout, read_timeout), verify=True)
+
+    returning a response object with at least the attributes status_code,
+    headers, content and text, and the method json(). Timeouts are raised as
+    requests' ConnectTimeout and ReadTimeout.
+
+    pool_size is the maximum number of connections kept open per host. If
+    pool_block is true, calls wait for a free connection instead of opening
+    extra ones when all are in use.
+    """
+
+    def __init__(self, pool_size=10, keep_alive=True, pool_block=False, verify_ssl=True):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.pool_block = pool_block
+        self.verify_ssl = verify_ssl
+
+    def get_method(self, method):
+        """Return the function sending requests with that http method"""
+        raise NotImplementedError()
+
+    def _get_pool(self, url):
+        """Return the urllib3 connection pool used to call that url"""
+        raise NotImplementedError()
+
+    def preconnect(self, url, count=1):
+        """Open count connections to the host of url (and do the TLS handshake if
+        https) and put them in the pool, so the first calls don't have to"""
+        count = min(count, self.pool_size)
+        log.info("Opening %s connections to %s" % (count, url))
+        try:
+            pool = self._get_pool(url)
+            conns = []
+            try:
+                for i in range(count):
+                    c = pool._get_conn()
+                    conns.append(c)
+                    c.connect()
+            finally:
+                for c in conns:
+                    pool._put_conn(c)
+        except Exception as e:
+            log.warn("Failed to pre-connect to %s: %s" % (url, str(e)))
+
+    def close(self):
+        """Close all pooled connections"""
+        pass
+
+
+class RequestsTransport(Transport):
+    """The default transport: one requests Session per API"""
+
+    def __init__(self, pool_size=10, keep_alive=True, pool_block=False, verify_ssl=True):
+        super().__init__(pool_size=pool_size, keep_alive=keep_alive, pool_block=pool_block, verify_ssl=verify_ssl)
+        self.session = requests.Session()
+
+        # The session is shared between unrelated calls: never store cookies
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size, pool_block=pool_block)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def get_method(self, method):
+        return getattr(self.session, method.lower())
+
+    def _get_pool(self, url):
+        adapter = self.session.get_adapter(url)
+        if hasattr(adapter, 'get_connection_with_tls_context'):
+            # requests >= 2.32
+            req = requests.Request('GET', url).prepare()
+            return adapter.get_connection_with_tls_context(req, self.verify_ssl)
+        return adapter.get_connection(url)
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Response():
+    """The subset of a requests Response used by the client callers"""
+
+    def __init__(self, r):
+        self.status_code = r.status
+        self.headers = r.headers
+        self.content = r.data
+        self.raw_bytes = self.content
+
+    @property
+    def text(self):
+        charset = 'utf-8'
+        ctype = self.headers.get('Content-Type', '')
+        if 'charset=' in ctype:
+            charset = ctype.split('charset=')[-1].split(';')[0].strip()
+        return self.content.decode(charset, errors='replace')
+
+    def json(self):
+        return json_codec.loads(self.content)
+
+
+class Urllib3Transport(Transport):
+    """A lean transport calling urllib3 connection pools directly, skipping the
+    session, adapter and hook layers of requests"""
+
+    def __init__(self, pool_size=10, keep_alive=True, pool_block=False, verify_ssl=True):
+        super().__init__(pool_size=pool_size, keep_alive=keep_alive, pool_block=pool_block, verify_ssl=verify_ssl)
+        self.managers = {}
+        self.default_headers = {
+            'User-Agent': requests.utils.default_user_agent(),
+            'Accept-Encoding': 'gzip, deflate',
+            'Accept': '*/*',
+            'Connection': 'keep-alive' if keep_alive else 'close',
+        }
+
+    def _get_manager(self, verify):
+        verify = bool(verify)
+        m = self.managers.get(verify)
+        if m is None:
+            kwargs = {'cert_reqs': 'CERT_NONE'}
+            if verify:
+                kwargs = {'cert_reqs': 'CERT_REQUIRED', 'ca_certs': DEFAULT_CA_BUNDLE_PATH}
+            m = self.managers.setdefault(verify, urllib3.PoolManager(maxsize=self.pool_size, block=self.pool_block, **kwargs))
+        return m
+
+    def _get_pool(self, url):
+        return self._get_manager(self.verify_ssl).connection_from_url(url)
+
+    def get_method(self, method):
+        return functools.partial(self.request, method.upper())
+
+    def request(self, method, url, data=None, params=None, headers=None, timeout=None, verify=True):
+        if params:
+            url = url + ('&' if '?' in url else '?') + urlencode(params, doseq=True)
+
+        h = dict(self.default_headers)
+        if headers:
+            h.update(headers)
+
+        if type(timeout) is tuple:
+            timeout = urllib3.Timeout(connect=timeout[0], read=timeout[1])
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        try:
+            r = self._get_manager(verify).urlopen(
+                method,
+                url,
+                body=data,
+                headers=h,
+                timeout=timeout,
+                # Retries are handled by the ClientCaller
+                retries=urllib3.Retry(total=False, redirect=30),
+            )
+        except urllib3.exceptions.NewConnectionError as e:
+            raise ConnectionError(e)
+        except urllib3.exceptions.ConnectTimeoutError as e:
+            raise ConnectTimeout(e)
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise ReadTimeout(e)
+        except urllib3.exceptions.HTTPError as e:
+            raise ConnectionError(e)
+
+        return Urllib3Response(r)
+
+    def close(self):
+        for m in list(self.managers.values()):
+            m.clear()
+
+
+transports = {
+    'requests': RequestsTransport,
+    'urllib3': Urllib3Transport,
+}
+
+
+def get_transport(transport=None, **kwargs):
+    """Return a transport instance: either transport itself if it is a Transport,
+    or a new instance of the transport with that name ('requests' or 'urllib3'),
+    created with kwargs"""
+    if isinstance(transport, Transport):
+        return transport
+    name = transport or 'requests'
+    if name not in transports:
+        raise PyMacaronCoreException("Unknown transport '%s'. Should be one of %s" % (name, ', '.join(sorted(transports.keys()))))
+    return transports[name](**kwargs)
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+# Headers used to propagate spans between services, next to PymCallID (used as
+# the trace id) and PymCallPath
+SPAN_HEADER = 'PymSpanID'
+SAMPLED_HEADER = 'PymTraceSampled'
+
+
+class Span():
+    """A timed operation: the handling of a request by a server endpoint, or a
+    call made by a client stub. Spans sharing a trace_id form a tree via their
+    parent_id."""
+
+    def __init__(self, name, kind, trace_id, parent_id, sampled):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.sampled = sampled
+        self.tags = {}
+        self.start = time.time()
+        self.duration = None
+        self.thread_id = threading.get_ident()
+        self._t0 = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._t0
+
+    def get_headers(self):
+        """Return the headers that a client call should send to make the callee's
+        span a child of this span"""
+        return {
+            'PymCallID': self.trace_id,
+            SPAN_HEADER: self.span_id,
+            SAMPLED_HEADER: '1' if self.sampled else '0',
+        }
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.start + (self.duration or 0),
+            'duration': self.duration,
+            'tags': self.tags,
+        }
+
+    def to_trace_event(self):
+        """Return this span as a complete event in the Chrome trace-event format"""
+        args = dict(self.tags)
+        args.update({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+        })
+        return {
+            'name': self.name,
+            'cat': self.kind,
+            'ph': 'X',
+            'ts': int(self.start * 1000000),
+            'dur': int((self.duration or 0) * 1000000),
+            'pid': os.getpid(),
+            'tid': self.thread_id,
+            'args': args,
+        }
+
+
+class FileExporter():
+    """Append finished spans to a file, either as one json object per line
+    ('jsonl') or as a Chrome trace-event array ('chrome', loadable in
+    chrome://tracing or Perfetto)"""
+
+    def __init__(self, path, format='jsonl'):
+        if format not in ('jsonl', 'chrome'):
+            raise Exception("Unsupported trace format %s (should be 'jsonl' or 'chrome')" % format)
+        self.path = path
+        self.format = format
+        self.lock = threading.Lock()
+        is_new = not os.path.isfile(path) or os.path.getsize(path) == 0
+        self.f = open(path, 'a')
+        if format == 'chrome' and is_new:
+            # The trace-event format tolerates a missing closing bracket, which
+            # lets us keep appending events
+            self.f.write('[\n')
+            self.f.flush()
+
+    def export(self, span):
+        if self.format == 'chrome':
+            line = json.dumps(span.to_trace_event()) + ',\n'
+        else:
+            line = json.dumps(span.to_dict()) + '\n'
+        with self.lock:
+            self.f.write(line)
+            self.f.flush()
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+class Tracer():
+    """Create spans and export the sampled ones. Tracing is off until
+    configure() is called."""
+
+    def __init__(self):
+        self.exporter = None
+        self.sample_rate = 1.0
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def configure(self, path=None, sample_rate=1.0, format='jsonl', exporter=None):
+        """Start exporting spans to the file at path (or to a custom exporter object
+        implementing export(span)). sample_rate is the ratio of incoming root
+        requests whose trace is recorded: the decision is then propagated to
+        all downstream calls."""
+        assert 0 <= sample_rate <= 1
+        if self.exporter and hasattr(self.exporter, 'close'):
+            self.exporter.close()
+        if path:
+            exporter = FileExporter(path, format=format)
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def disable(self):
+        self.configure(exporter=None)
+
+    def start_server_span(self, name, trace_id, headers):
+        """Start a span for a request handled by a server endpoint, as child of the
+        span of the calling client, if any"""
+        if not self.exporter:
+            return None
+        sampled = headers.get(SAMPLED_HEADER, None)
+        if sampled is None:
+            # We are the root of this trace: take the sampling decision
+            sampled = random.random() < self.sample_rate
+        else:
+            sampled = sampled == '1'
+        return Span(name, 'server', trace_id, headers.get(SPAN_HEADER, None), sampled)
+
+    def start_client_span(self, name, parent, trace_id=None):
+        """Start a span for a client call, as child of the parent span, if any"""
+        if not self.exporter:
+            return None
+        if parent:
+            return Span(name, 'client', parent.trace_id, parent.span_id, parent.sampled)
+        return Span(name, 'client', trace_id or str(uuid.uuid4()), None, random.random() < self.sample_rate)
+
+    def finish(self, span, **tags):
+        """Stop the span and export it if it is sampled"""
+        span.stop()
+        span.tags.update(tags)
+        exporter = self.exporter
+        if span.sampled and exporter:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                log.warn("Failed to export span %s: %s" % (span.name, str(e)))
+
+
+tracer = Tracer()
+
+
+def configure_tracing(path=None, sample_rate=1.0, format='jsonl', exporter=None):
+    """Configure the process-wide tracer. See Tracer.configure()"""
+    tracer.configure(path=path, sample_rate=sample_rate, format=format, exporter=exporter)
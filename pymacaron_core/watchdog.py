@@ -0,0 +1,123 @@
+import sys
+import time
+import logging
+import threading
+import traceback
+
+
+log = logging.getLogger(__name__)
+
+
+class InflightRequest():
+    """A request being handled by a server endpoint, as seen by the watchdog"""
+
+    def __init__(self, name, call_id, call_path, threshold):
+        self.name = name
+        self.call_id = call_id
+        self.call_path = call_path
+        self.threshold = threshold
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.samples = []
+        self.reported = False
+
+
+class Watchdog():
+    """A thread that watches requests in flight and, for those taking longer than
+    their endpoint's threshold, samples the stack of the thread handling them and
+    logs the samples along with the request's call_id and call_path"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.thread = None
+        self.stopping = None
+        self.threshold = 1.0
+        self.interval = 0.1
+        self.max_samples = 10
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, threshold=1.0, interval=0.1, max_samples=10):
+        """Start the watchdog thread, if not already started. threshold is the
+        default number of seconds after which a request is deemed slow, interval
+        the time between two stack samples, and max_samples the number of samples
+        taken before logging them."""
+        self.threshold = threshold
+        self.interval = interval
+        self.max_samples = max_samples
+        with self.lock:
+            if self.thread:
+                return
+            self.stopping = threading.Event()
+            self.thread = threading.Thread(target=self._run, args=(self.stopping,), name='pym-watchdog')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            if not self.thread:
+                return
+            self.stopping.set()
+            thread = self.thread
+            self.thread = None
+        thread.join()
+
+    def track(self, name, call_id, call_path, threshold=None):
+        """Start watching the request handled by the current thread"""
+        r = InflightRequest(name, call_id, call_path, threshold or self.threshold)
+        with self.lock:
+            self.inflight[id(r)] = r
+        return r
+
+    def untrack(self, r):
+        """Stop watching a request, and report it if it was slow"""
+        with self.lock:
+            self.inflight.pop(id(r), None)
+        if r.samples and not r.reported:
+            self._report(r, time.perf_counter() - r.start)
+
+    def _run(self, stopping):
+        while not stopping.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                log.warn("Watchdog failed to sample slow requests: %s" % str(e))
+
+    def _sample(self):
+        now = time.perf_counter()
+        with self.lock:
+            slow = [r for r in self.inflight.values() if not r.reported and now - r.start > r.threshold]
+        if not slow:
+            return
+
+        frames = sys._current_frames()
+        for r in slow:
+            f = frames.get(r.thread_id)
+            if f is None:
+                continue
+            r.samples.append(''.join(traceback.format_stack(f)))
+            if len(r.samples) >= self.max_samples:
+                self._report(r, now - r.start)
+
+    def _report(self, r, duration):
+        with self.lock:
+            if r.reported:
+                return
+            r.reported = True
+
+        # Group identical stacks, most frequent first
+        counts = {}
+        for s in r.samples:
+            counts[s] = counts.get(s, 0) + 1
+        stacks = sorted(counts.items(), key=lambda x: -x[1])
+
+        msg = ["SLOW REQUEST %s took more than %.3f sec (threshold %.3f sec) [call_id: %s] [call_path: %s] - %s stack samples:" % (r.name, duration, r.threshold, r.call_id, r.call_path, len(r.samples))]
+        for s, count in stacks:
+            msg.append("--- %s/%s samples in:\n%s" % (count, len(r.samples), s))
+        log.warn('\n'.join(msg))
+
+
+watchdog = Watchdog()
@@ -49,6 +49,10 @@ setup(
         'bravado-core==5.13.2',
         'PyYAML>=5.1.2',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'msgpack': ['msgpack'],
+    },
     tests_require=[
         'nose',
         'mock',
@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pymacaron_core.context import get_call_id, get_call_path, get_span, set_call_context, reset_call_context
+from pymacaron_core.context import with_call_context, submit, copy_call_context
+
+
+def get_context():
+    return get_call_id(), get_call_path()
+
+
+class Test(unittest.TestCase):
+
+    def test_set_and_reset(self):
+        self.assertEqual(get_context(), (None, None))
+        token = set_call_context(call_id='1', call_path='a')
+        self.assertEqual(get_context(), ('1', 'a'))
+
+        token2 = set_call_context(call_id='2', call_path='a.b', span='span')
+        self.assertEqual(get_context(), ('2', 'a.b'))
+        self.assertEqual(get_span(), 'span')
+
+        reset_call_context(token2)
+        self.assertEqual(get_context(), ('1', 'a'))
+        self.assertEqual(get_span(), None)
+        reset_call_context(token)
+        self.assertEqual(get_context(), (None, None))
+
+    def test_threads_start_empty(self):
+        token = set_call_context(call_id='1', call_path='a')
+        try:
+            results = []
+            t = threading.Thread(target=lambda: results.append(get_context()))
+            t.start()
+            t.join()
+            self.assertEqual(results, [(None, None)])
+
+            results = []
+            f = with_call_context(lambda: results.append(get_context()))
+            threads = [threading.Thread(target=f) for i in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(results, [('1', 'a')] * 3)
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                self.assertEqual(executor.submit(get_context).result(), (None, None))
+                self.assertEqual(submit(executor, get_context).result(), ('1', 'a'))
+
+            self.assertEqual(copy_call_context().run(get_context), ('1', 'a'))
+        finally:
+            reset_call_context(token)
+
+    def test_asyncio_tasks(self):
+
+        async def handle(call_id):
+            token = set_call_context(call_id=call_id)
+            await asyncio.sleep(0.01)
+            r = get_call_id()
+            reset_call_context(token)
+            return r
+
+        async def main():
+            return await asyncio.gather(*[handle(str(i)) for i in range(5)])
+
+        self.assertEqual(asyncio.run(main()), ['0', '1', '2', '3', '4'])
+        self.assertEqual(get_call_id(), None)
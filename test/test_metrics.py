@@ -0,0 +1,122 @@
+import imp
+import os
+import json
+import responses
+from mock import patch
+from pymacaron_core.metrics import MetricsRegistry, registry
+from pymacaron_core.swagger.server import add_metrics_route
+from pymacaron_core.models import get_model
+
+
+utils = imp.load_source('common', os.path.join(os.path.dirname(__file__), 'utils.py'))
+
+
+class Test(utils.PymTest):
+
+
+    def setUp(self):
+        super(Test, self).setUp()
+        registry.clear()
+
+
+    def test_counter_and_histogram(self):
+        r = MetricsRegistry()
+        c = r.counter('foo_total', 'Some foos', ('api',))
+        self.assertIs(c, r.counter('foo_total', 'Some foos', ('api',)))
+        c.inc(('a',))
+        c.inc(('a',), 2)
+        c.inc(('b',))
+        self.assertEqual(c.get(('a',)), 3)
+        self.assertEqual(c.get(('b',)), 1)
+        self.assertEqual(c.get(('c',)), 0)
+
+        h = r.histogram('bar_seconds', 'Some bars', ('api',), buckets=(1, 5))
+        h.observe(('a',), 0.5)
+        h.observe(('a',), 1)
+        h.observe(('a',), 3)
+        h.observe(('a',), 10)
+        self.assertEqual(h.get_count(('a',)), 4)
+        self.assertEqual(h.get_sum(('a',)), 14.5)
+
+        with self.assertRaises(Exception):
+            r.histogram('foo_total', 'Not a histogram')
+
+        self.assertEqual(
+            r.expose(),
+            '\n'.join([
+                '# HELP bar_seconds Some bars',
+                '# TYPE bar_seconds histogram',
+                'bar_seconds_bucket{api="a",le="1"} 2',
+                'bar_seconds_bucket{api="a",le="5"} 3',
+                'bar_seconds_bucket{api="a",le="+Inf"} 4',
+                'bar_seconds_sum{api="a"} 14.5',
+                'bar_seconds_count{api="a"} 4',
+                '# HELP foo_total Some foos',
+                '# TYPE foo_total counter',
+                'foo_total{api="a"} 3',
+                'foo_total{api="b"} 1',
+            ]) + '\n'
+        )
+
+
+    def test_label_escaping(self):
+        r = MetricsRegistry()
+        r.counter('foo_total', 'Some foos', ('path',)).inc(('a"b\\c',))
+        self.assertTrue('foo_total{path="a\\"b\\\\c"} 1' in r.expose())
+
+
+    @responses.activate
+    def test_client_metrics(self):
+        handler, _ = self.generate_client_and_spec(self.yaml_query_param)
+
+        responses.add(
+            responses.GET, "http://some.server.com:80/v1/some/path",
+            body=json.dumps({"foo": "a", "bar": "b"}),
+            status=200,
+            content_type="application/json"
+        )
+
+        handler(arg1='this', arg2='that')
+        handler(arg1='this', arg2='that')
+
+        labels = ('', 'GET', '/v1/some/path')
+        self.assertEqual(registry.get('pym_client_requests_total').get(labels + ('200',)), 2)
+        self.assertEqual(registry.get('pym_client_request_duration_seconds').get_count(labels), 2)
+        self.assertEqual(registry.get('pym_client_response_bytes').get_count(labels), 2)
+        self.assertEqual(registry.get('pym_client_retries_total').get(labels), 0)
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_server_metrics_route(self, func):
+        func.__name__ = 'return_token'
+
+        app, spec = self.generate_server_app(self.yaml_no_param)
+        add_metrics_route(app, '/metrics')
+        add_metrics_route(app, '/metrics')
+
+        func.return_value = get_model('SessionToken')(token='123')
+
+        with app.test_client() as c:
+            r = c.get('/v1/no/param')
+            self.assertEqual(r.status_code, 200)
+
+            r = c.get('/metrics')
+            self.assertEqual(r.status_code, 200)
+            self.assertTrue(r.content_type.startswith('text/plain'))
+            text = r.data.decode('utf-8')
+            self.assertTrue('pym_server_requests_total{api="somename",method="GET",path="/v1/no/param",status="200"} 1' in text, text)
+            self.assertTrue('pym_server_request_duration_seconds_count{api="somename",method="GET",path="/v1/no/param"} 1' in text, text)
+
+
+    def test_server_metrics_raised_error(self):
+        app, spec = self.generate_server_app(self.yaml_in_body)
+
+        # The default error callback raises the ValidationError, turned into
+        # a 400 by the app's error handler
+        with app.test_client() as c:
+            r = c.get('/v1/in/body', data=json.dumps({'bazzoom': 'thiswontwork'}))
+            self.assertEqual(r.status_code, 400)
+
+        counter = registry.get('pym_server_requests_total')
+        self.assertEqual(counter.get(('somename', 'GET', '/v1/in/body', '400')), 1)
+        self.assertEqual(counter.get(('somename', 'GET', '/v1/in/body', '500')), 0)
@@ -0,0 +1,60 @@
+import imp
+import os
+import shutil
+import pstats
+import tempfile
+from mock import patch
+from pymacaron_core.profiling import profiler, configure_profiling
+from pymacaron_core.models import get_model
+
+
+utils = imp.load_source('common', os.path.join(os.path.dirname(__file__), 'utils.py'))
+
+
+class Test(utils.PymTest):
+
+
+    def setUp(self):
+        super(Test, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        profiler.disable()
+        shutil.rmtree(self.directory)
+
+
+    def test_should_profile(self):
+        configure_profiling(self.directory, sample_every=3, token='secret')
+        self.assertEqual(
+            [profiler.should_profile('a', {}) for i in range(6)],
+            [False, False, True, False, False, True]
+        )
+        self.assertFalse(profiler.should_profile('b', {}))
+        self.assertTrue(profiler.should_profile('b', {'PymProfile': 'secret'}))
+        self.assertFalse(profiler.should_profile('b', {'PymProfile': 'wrong'}))
+
+        configure_profiling(self.directory)
+        self.assertFalse(profiler.should_profile('a', {}))
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_profile_requests(self, func):
+        func.__name__ = 'return_token'
+        app, spec = self.generate_server_app(self.yaml_no_param)
+        func.return_value = get_model('SessionToken')(token='123')
+
+        configure_profiling(self.directory, sample_every=2)
+
+        with app.test_client() as c:
+            for i in range(4):
+                r = c.get('/v1/no/param')
+                self.assertEqual(r.status_code, 200)
+
+        path = os.path.join(self.directory, 'somename_GET_v1_no_param.pstats')
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(path)])
+        stats = pstats.Stats(path)
+        names = [k[2] for k in stats.stats.keys()]
+        self.assertTrue('handle_request' in names, names)
+        # 2 requests out of 4 were profiled
+        self.assertEqual([v[0] for k, v in stats.stats.items() if k[2] == 'handle_request'], [2])
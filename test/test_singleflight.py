@@ -0,0 +1,117 @@
+import time
+import asyncio
+import threading
+import unittest
+from pymacaron_core.swagger.api import API
+from pymacaron_core.singleflight import SingleFlight
+from pymacaron_core.metrics import registry
+from utils import yaml_foo, start_stub_server
+
+
+def run_threads(n, f):
+    results = [None] * n
+
+    def run(i):
+        try:
+            results[i] = f()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_get_key(self):
+        sf = SingleFlight()
+        self.assertEqual(
+            sf.get_key('http://a/b', {'y': 1, 'x': 'a'}, {'Authorization': 'foo', 'X-Other': 'bar'}),
+            ('http://a/b', (('x', 'a'), ('y', '1')), ('foo',)),
+        )
+        self.assertEqual(sf.get_key('http://a/b', None, None), ('http://a/b',))
+
+    def test_concurrent_calls_are_coalesced(self):
+        sf = SingleFlight()
+        calls = []
+
+        def slow(value):
+            calls.append(value)
+            time.sleep(0.1)
+            return {'value': value}
+
+        results = run_threads(5, lambda: sf.do(('a',), slow, 'a'))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(coalesced for _, coalesced in results), [False, True, True, True, True])
+        for result, _ in results:
+            self.assertIs(result, results[0][0])
+
+        # Once done, the next call runs again
+        self.assertEqual(sf.do(('a',), slow, 'a'), ({'value': 'a'}, False))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sf.flights, {})
+
+    def test_exceptions_are_shared(self):
+        sf = SingleFlight()
+
+        def fail():
+            time.sleep(0.1)
+            raise Exception('boom')
+
+        results = run_threads(3, lambda: sf.do(('a',), fail))
+        self.assertEqual([str(e) for e in results], ['boom'] * 3)
+        self.assertEqual(sf.flights, {})
+
+    def test_async_calls_are_coalesced(self):
+        sf = SingleFlight()
+        calls = []
+
+        async def slow(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return value
+
+        async def main():
+            return await asyncio.gather(*[sf.async_do(('a',), slow, 'a') for i in range(4)])
+
+        results = asyncio.run(main())
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(results, [('a', False), ('a', True), ('a', True), ('a', True)])
+        self.assertEqual(sf.flights, {})
+
+
+class CoalescedCallsTest(unittest.TestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.server = start_stub_server()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_api(self, **kwargs):
+        return API('foo', yaml_str=yaml_foo, port=self.server.server_address[1], **kwargs)
+
+    def test_identical_calls_share_one_request(self):
+        api = self.get_api(coalesce=True)
+        results = run_threads(4, lambda: api.client.slow(delay=0.2))
+        self.assertEqual([r.foo for r in results], ['bar'] * 4)
+        self.assertEqual(self.server.calls, ['/v1/slow?delay=0.2'])
+        labels = ('foo', 'GET', '/v1/slow')
+        self.assertEqual(registry.get('pym_client_coalesced_total').get(labels), 3)
+
+        # Different parameters are different calls
+        self.server.calls = []
+        run_threads(2, lambda: api.client.slow(delay=0.1))
+        api.client.slow(delay=0.05)
+        self.assertEqual(self.server.calls, ['/v1/slow?delay=0.1', '/v1/slow?delay=0.05'])
+
+    def test_coalescing_is_off_by_default(self):
+        api = self.get_api()
+        run_threads(3, lambda: api.client.slow(delay=0.1))
+        self.assertEqual(self.server.calls, ['/v1/slow?delay=0.1'] * 3)
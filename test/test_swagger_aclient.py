@@ -0,0 +1,64 @@
+import time
+import asyncio
+import unittest
+from requests.exceptions import ReadTimeout, ConnectionError
+from pymacaron_core.swagger.api import API
+from pymacaron_core.swagger.aclient import aiohttp, _to_query
+from utils import yaml_foo, start_stub_server
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp is not installed")
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_stub_server()
+        self.api = API('foo', yaml_str=yaml_foo, port=self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_async(self, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                await self.api.async_transport.close()
+        return asyncio.run(run())
+
+    def test_call(self):
+        r = self.run_async(self.api.aclient.get_foo())
+        self.assertEqual(r.foo, 'bar')
+        self.assertEqual(type(r).__name__, 'Foo')
+
+    def test_body_path_and_headers(self):
+        r = self.run_async(self.api.aclient.echo(self.api.model.Foo(foo='baz'), bar='abc', request_headers={'X-Foo': 'xyz'}))
+        self.assertEqual(r.foo, '/v1/echo/abc xyz baz')
+
+    def test_concurrent_calls(self):
+        async def call_many():
+            return await asyncio.gather(*[self.api.aclient.slow(delay=0.2) for i in range(40)])
+
+        t0 = time.time()
+        results = self.run_async(call_many())
+        self.assertEqual([r.foo for r in results], ['bar'] * 40)
+        # Calls ran concurrently, over a pool of at most 10 connections
+        self.assertTrue(time.time() - t0 < 40 * 0.2 / 2)
+        self.assertTrue(len(self.server.peers) <= 10)
+
+    def test_read_timeout_is_retried(self):
+        with self.assertRaises(ReadTimeout):
+            self.run_async(self.api.aclient.slow(delay=0.3, read_timeout=0.1))
+        self.assertEqual(self.server.calls, ['/v1/slow?delay=0.3'] * 3)
+
+    def test_connection_error(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(ConnectionError):
+            self.run_async(self.api.aclient.get_foo())
+
+    def test_to_query(self):
+        self.assertEqual(
+            _to_query({'a': 'x', 'b': True, 'c': 1, 'd': 1.5, 'e': ['y', 2]}),
+            [('a', 'x'), ('b', 'True'), ('c', 1), ('d', '1.5'), ('e', 'y'), ('e', 2)]
+        )
@@ -0,0 +1,131 @@
+import time
+import unittest
+from pymacaron_core.swagger.api import API
+from pymacaron_core.swagger.spec import ApiSpec
+from pymacaron_core.swagger.balancer import Balancer, Backend
+from pymacaron_core.swagger.breaker import CircuitBreakerPolicy
+import yaml
+from utils import yaml_foo, start_stub_server
+
+
+class BalancerTest(unittest.TestCase):
+
+    def test_spec_hosts(self):
+        swagger_dict = yaml.load(yaml_foo, Loader=yaml.FullLoader)
+        spec = ApiSpec(swagger_dict)
+        self.assertEqual(spec.hosts, [('127.0.0.1', 80)])
+        spec = ApiSpec(swagger_dict, hosts=['a.com', 'b.com:8080'])
+        self.assertEqual(spec.hosts, [('a.com', 80), ('b.com', 8080)])
+        self.assertEqual((spec.host, spec.port), ('a.com', 80))
+
+    def test_ewma(self):
+        b = Backend('http', 'a', 80, decay=1.0)
+        self.assertEqual(b.base_url, 'http://a:80/')
+        self.assertEqual(b.get_cost(), 0)
+        b.start()
+        b.start()
+        self.assertEqual(b.outstanding, 2)
+        time.sleep(0.1)
+        b.finish(1.0)
+        self.assertTrue(0 < b.ewma < 1.0)
+        self.assertEqual(b.get_cost(), b.ewma * 2)
+
+    def test_failure_penalty(self):
+        # A host failing fast looks slower than a host answering slowly
+        a = Backend('http', 'a', 80, decay=1.0, failure_penalty=5.0)
+        b = Backend('http', 'b', 80, decay=1.0, failure_penalty=5.0)
+        time.sleep(0.1)
+        for backend in (a, b):
+            backend.start()
+        a.finish(0.001, failed=True)
+        b.finish(1.0)
+        self.assertTrue(a.ewma > b.ewma)
+
+        # Failures slower than the penalty weigh their own duration
+        a = Backend('http', 'a', 80, decay=1.0, failure_penalty=5.0)
+        b = Backend('http', 'b', 80, decay=1.0, failure_penalty=5.0)
+        time.sleep(0.1)
+        for backend in (a, b):
+            backend.start()
+        a.finish(0.001, failed=True)
+        b.finish(60.0, failed=True)
+        self.assertTrue(b.ewma > a.ewma)
+
+    def test_power_of_two_choices(self):
+        balancer = Balancer('http', [('a', 80), ('b', 80)])
+        a, b = balancer.backends
+        a.ewma = 0.1
+        b.ewma = 0.2
+        for i in range(10):
+            self.assertIs(balancer.pick(), a)
+
+        # a has too many requests in flight
+        for i in range(3):
+            a.start()
+        self.assertIs(balancer.pick(), b)
+
+        # Retries go to another host
+        self.assertIs(balancer.pick(exclude=[b]), a)
+        self.assertIs(balancer.pick(exclude=[a, b]), b)
+
+    def test_picks_among_all_hosts(self):
+        balancer = Balancer('http', [('a', 80), ('b', 80), ('c', 80)])
+        picked = set(balancer.pick().host for i in range(100))
+        self.assertEqual(picked, set(['a', 'b', 'c']))
+
+    def test_ejection(self):
+        policy = CircuitBreakerPolicy(window=2, min_calls=2, open_duration=0.1)
+        balancer = Balancer('http', [('a', 80), ('b', 80)], circuit_breaker=policy)
+        a, b = balancer.backends
+        for i in range(2):
+            a.breaker.record(False)
+        self.assertFalse(a.is_available())
+        for i in range(10):
+            self.assertIs(balancer.pick(), b)
+
+        for i in range(2):
+            b.breaker.record(False)
+        self.assertEqual(balancer.pick(), None)
+
+        # Until the circuit breakers let probes through
+        time.sleep(0.15)
+        self.assertTrue(balancer.pick() in (a, b))
+
+
+class BalancedCallsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+        for i in range(2):
+            server = start_stub_server()
+            self.servers.append(server)
+        self.hosts = ['127.0.0.1:%s' % s.server_address[1] for s in self.servers]
+
+    def tearDown(self):
+        for s in self.servers:
+            s.shutdown()
+            s.server_close()
+
+    def test_calls_are_spread(self):
+        api = API('foo', yaml_str=yaml_foo, hosts=self.hosts)
+        for i in range(20):
+            self.assertEqual(api.client.get_foo().foo, 'bar')
+        for s in self.servers:
+            self.assertTrue(len(s.calls) > 0)
+        self.assertEqual(sum(len(s.calls) for s in self.servers), 20)
+
+    def test_failover(self):
+        policy = CircuitBreakerPolicy(window=2, min_calls=2, open_duration=10)
+        api = API('foo', yaml_str=yaml_foo, hosts=self.hosts, circuit_breaker=policy)
+        self.servers[0].shutdown()
+        self.servers[0].server_close()
+
+        # Calls to the dead host are retried on the other one
+        for i in range(10):
+            self.assertEqual(api.client.get_foo().foo, 'bar')
+        self.assertEqual(len(self.servers[1].calls), 10)
+
+        # And the dead host is avoided after its first failure
+        dead, live = api.balancer.backends
+        self.assertEqual(list(dead.breaker.outcomes), [False])
+        self.assertTrue(dead.get_cost() > live.get_cost())
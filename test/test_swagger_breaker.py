@@ -0,0 +1,66 @@
+import time
+import unittest
+from pymacaron_core.swagger.breaker import CircuitBreaker, CircuitBreakerPolicy, CLOSED, OPEN, HALF_OPEN
+
+
+class Test(unittest.TestCase):
+
+    def record(self, b, *outcomes):
+        for success in outcomes:
+            self.assertTrue(b.allow())
+            b.record(success)
+
+    def test_opens_on_failure_rate(self):
+        b = CircuitBreaker('foo', failure_rate=0.5, window=4, min_calls=4)
+
+        # Not enough calls yet
+        self.record(b, False, False, False)
+        self.assertEqual(b.state, CLOSED)
+
+        # 3 failures out of 4
+        self.record(b, True)
+        self.assertEqual(b.state, OPEN)
+        self.assertFalse(b.allow())
+
+    def test_stays_closed_below_failure_rate(self):
+        b = CircuitBreaker('foo', failure_rate=0.5, window=4, min_calls=4)
+        self.record(b, True, False, True, True, True, False, True)
+        self.assertEqual(b.state, CLOSED)
+
+        # The window slides: 2 failures out of the last 4
+        self.record(b, False)
+        self.assertEqual(b.state, OPEN)
+
+    def test_half_open_probe(self):
+        b = CircuitBreaker('foo', failure_rate=0.5, window=2, min_calls=2, open_duration=0.1, probes=1)
+        self.record(b, False, False)
+        self.assertEqual(b.state, OPEN)
+        self.assertFalse(b.allow())
+
+        time.sleep(0.15)
+
+        # Only one probe at a time
+        self.assertTrue(b.allow())
+        self.assertEqual(b.state, HALF_OPEN)
+        self.assertFalse(b.allow())
+
+        # Failed probe: open again
+        b.record(False)
+        self.assertEqual(b.state, OPEN)
+        self.assertFalse(b.allow())
+
+        time.sleep(0.15)
+
+        # Successful probe: closed
+        self.assertTrue(b.allow())
+        b.record(True)
+        self.assertEqual(b.state, CLOSED)
+        self.assertTrue(b.allow())
+
+    def test_policy(self):
+        p = CircuitBreakerPolicy(window=3, min_calls=3)
+        b = p.get('foo:80')
+        self.assertIs(p.get('foo:80'), b)
+        self.assertIsNot(p.get('bar:80'), b)
+        self.assertEqual(b.outcomes.maxlen, 3)
+        self.assertEqual(b.min_calls, 3)
@@ -3,8 +3,9 @@ import os
 import pprint
 import json
 import responses
-from mock import patch, MagicMock
+from mock import patch
 from pymacaron_core.swagger.client import _format_flask_url
+from pymacaron_core.swagger.codec import json_codec
 from pymacaron_core.exceptions import PyMacaronCoreException, ValidationError
 from pymacaron_core.models import get_model
 
@@ -38,16 +39,15 @@ class Test(utils.PymTest):
         self.assertEqual(res.bar, 'b')
 
 
-    @patch('pymacaron_core.swagger.client.requests')
+    @patch('pymacaron_core.swagger.transport.requests')
     def test_requests_parameters_with_query_param(self, requests):
-        requests.get = MagicMock()
         handler, _ = self.generate_client_and_spec(self.yaml_query_param)
 
         with self.assertRaises(PyMacaronCoreException):
             handler(arg1='this', arg2='that')
         # self.assertEqual("Expected 1 caller, got 0", str(e.exception))
 
-        requests.get.assert_called_once_with(
+        requests.Session.return_value.get.assert_called_once_with(
             'http://some.server.com:80/v1/some/path',
             data=None,
             headers={'Content-Type': 'application/json'},
@@ -85,7 +85,7 @@ class Test(utils.PymTest):
         self.assertEqual(res.bar, 'b')
 
 
-    @patch('pymacaron_core.swagger.client.requests')
+    @patch('pymacaron_core.swagger.transport.requests')
     def test_requests_parameters_with_body_param(self, requests):
         handler, spec = self.generate_client_and_spec(self.yaml_body_param)
         model_class = get_model('Param')
@@ -94,9 +94,9 @@ class Test(utils.PymTest):
         with self.assertRaises(PyMacaronCoreException):
             handler(param)
 
-        requests.post.assert_called_once_with(
+        requests.Session.return_value.post.assert_called_once_with(
             'http://some.server.com:80/v1/some/path',
-            data=json.dumps({"arg1": "a", "arg2": "b"}),
+            data=json_codec.dumps({"arg1": "a", "arg2": "b"}),
             headers={'Content-Type': 'application/json'},
             params=None,
             timeout=(10, 10),
@@ -160,14 +160,14 @@ class Test(utils.PymTest):
         self.assertEqual(res.bar, 'b')
 
 
-    @patch('pymacaron_core.swagger.client.requests')
+    @patch('pymacaron_core.swagger.transport.requests')
     def test_requests_parameters_with_path_params(self, requests):
         handler, spec = self.generate_client_and_spec(self.yaml_path_param)
 
         with self.assertRaises(PyMacaronCoreException):
             handler(foo=123, bar=456)
 
-        requests.get.assert_called_once_with(
+        requests.Session.return_value.get.assert_called_once_with(
             'http://some.server.com:80/v1/some/123/path/456',
             data=None,
             headers={'Content-Type': 'application/json'},
@@ -176,7 +176,7 @@ class Test(utils.PymTest):
             verify=True)
 
 
-    @patch('pymacaron_core.swagger.client.requests')
+    @patch('pymacaron_core.swagger.transport.requests')
     def test_handler_extra_parameters(self, requests):
         handler, spec = self.generate_client_and_spec(self.yaml_path_param)
 
@@ -189,7 +189,7 @@ class Test(utils.PymTest):
                 connect_timeout=8
             )
 
-        requests.get.assert_called_once_with(
+        requests.Session.return_value.get.assert_called_once_with(
             'http://some.server.com:80/v1/some/123/path/456',
             data=None,
             headers={'Content-Type': 'application/json'},
@@ -218,14 +218,14 @@ class Test(utils.PymTest):
         self.assertEqual(res.bar, 'b')
 
 
-    @patch('pymacaron_core.swagger.client.requests')
+    @patch('pymacaron_core.swagger.transport.requests')
     def test_requests_parameters_with_path_query_params(self, requests):
         handler, spec = self.generate_client_and_spec(self.yaml_path_query_param)
 
         with self.assertRaises(PyMacaronCoreException):
             handler(foo=123, bar=456)
 
-        requests.get.assert_called_once_with(
+        requests.Session.return_value.get.assert_called_once_with(
             'http://some.server.com:80/v1/some/123/path',
             data=None,
             headers={'Content-Type': 'application/json'},
@@ -270,7 +270,7 @@ class Test(utils.PymTest):
         self.assertTrue('Missing some arguments' in str(e.exception))
 
 
-    @patch('pymacaron_core.swagger.client.requests')
+    @patch('pymacaron_core.swagger.transport.requests')
     def test_requests_parameters_with_path_body_params(self, requests):
         handler, spec = self.generate_client_and_spec(self.yaml_path_body_param)
 
@@ -280,9 +280,9 @@ class Test(utils.PymTest):
         with self.assertRaises(PyMacaronCoreException):
             handler(param, foo=123)
 
-        requests.get.assert_called_once_with(
+        requests.Session.return_value.get.assert_called_once_with(
             'http://some.server.com:80/v1/some/123/path',
-            data=json.dumps({"arg1": "a", "arg2": "b"}),
+            data=json_codec.dumps({"arg1": "a", "arg2": "b"}),
             headers={'Content-Type': 'application/json'},
             params=None,
             timeout=(10, 10),
@@ -300,14 +300,14 @@ class Test(utils.PymTest):
         self.assertTrue('BUG: method FOOBAR for /v1/some/path is not supported' in str(e.exception))
 
 
-    @patch('pymacaron_core.swagger.client.requests')
+    @patch('pymacaron_core.swagger.transport.requests')
     def test_requests_client_override_read_timeout(self, requests):
         handler, spec = self.generate_client_and_spec(self.yaml_path_query_param)
 
         with self.assertRaises(PyMacaronCoreException):
             handler(read_timeout=50, foo='123', bar='456')
 
-        requests.get.assert_called_once_with(
+        requests.Session.return_value.get.assert_called_once_with(
             'http://some.server.com:80/v1/some/123/path',
             data=None,
             headers={'Content-Type': 'application/json'},
@@ -316,14 +316,14 @@ class Test(utils.PymTest):
             verify=True)
 
 
-    @patch('pymacaron_core.swagger.client.requests')
+    @patch('pymacaron_core.swagger.transport.requests')
     def test_requests_client_override_connect_timeout(self, requests):
         handler, spec = self.generate_client_and_spec(self.yaml_path_query_param)
 
         with self.assertRaises(PyMacaronCoreException):
             handler(connect_timeout=50, foo='123', bar='456')
 
-        requests.get.assert_called_once_with(
+        requests.Session.return_value.get.assert_called_once_with(
             'http://some.server.com:80/v1/some/123/path',
             data=None,
             headers={'Content-Type': 'application/json'},
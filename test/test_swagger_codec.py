@@ -0,0 +1,52 @@
+import json
+import uuid
+import unittest
+import datetime
+from flask import Flask
+from flask import json as flask_json
+from markupsafe import Markup
+from pymacaron_core.exceptions import PyMacaronCoreException
+from pymacaron_core.swagger.codec import JsonCodec, CODECS, _get_codec
+
+
+class JsonCodecTest(unittest.TestCase):
+
+    def get_codecs(self):
+        return [JsonCodec(name) for name in CODECS if _get_codec(name)]
+
+    def test_dumps_loads(self):
+        j = {'b': [1, 2.5, None, True], 'a': 'é/"', 'c': {'d': {}}}
+        for codec in self.get_codecs():
+            data = codec.dumps(j)
+            self.assertTrue(isinstance(data, bytes), codec.name)
+            self.assertEqual(data.index(b'"a"'), 1, codec.name)
+            self.assertEqual(codec.loads(data), j, codec.name)
+            self.assertEqual(codec.loads(data.decode('utf-8')), j, codec.name)
+            self.assertEqual(codec.dumps(2 ** 70), b'1180591620717411303424', codec.name)
+            with self.assertRaises(ValueError):
+                codec.loads(b'{"a":')
+
+    def test_datetimes_like_jsonify(self):
+        # As in the json of models marshalled with keep_datetime=True
+        d = datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+        j = {
+            'datetime': d,
+            'date': d.date(),
+            'uuid': uuid.UUID('12345678123456781234567812345678'),
+            'string': '2020-01-02T03:04:05Z',
+            'html': Markup('<b>foo</b>'),
+        }
+        with Flask('test').app_context():
+            expected = json.loads(flask_json.dumps(j))
+        for codec in self.get_codecs():
+            self.assertEqual(codec.loads(codec.dumps(j)), expected, codec.name)
+        self.assertEqual(expected['datetime'], 'Thu, 02 Jan 2020 03:04:05 GMT')
+
+        for codec in self.get_codecs():
+            with self.assertRaises(TypeError):
+                codec.dumps({'a': object()})
+
+    def test_auto(self):
+        self.assertEqual(JsonCodec('auto').name, [name for name in ('orjson', 'ujson', 'json') if _get_codec(name)][0])
+        with self.assertRaises(PyMacaronCoreException):
+            JsonCodec('simplejson')
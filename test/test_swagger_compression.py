@@ -0,0 +1,126 @@
+import json
+import gzip
+import zlib
+import asyncio
+import unittest
+from mock import patch
+from pymacaron_core.swagger.compression import compress, decompress, DataTooLarge
+from pymacaron_core.models import get_model
+from utils import FlaskServerTest, get_catalog_yaml
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_compress_decompress(self):
+        data = b'{"a": 1}' * 100
+        for encoding in ('gzip', 'deflate'):
+            self.assertEqual(decompress(compress(data, encoding), encoding), data)
+        self.assertEqual(gzip.decompress(compress(data, 'gzip')), data)
+        self.assertEqual(zlib.decompress(compress(data, 'deflate')), data)
+        with self.assertRaises(ValueError):
+            decompress(b'not gzip', 'gzip')
+        with self.assertRaises(ValueError):
+            compress(data, 'br')
+        with self.assertRaises(ValueError):
+            decompress(compress(data, 'gzip')[:-10], 'gzip')
+
+    def test_decompress_max_size(self):
+        data = b'0' * 10000
+        for encoding in ('gzip', 'deflate'):
+            self.assertEqual(decompress(compress(data, encoding), encoding, max_size=10000), data)
+            with self.assertRaises(DataTooLarge):
+                decompress(compress(data, encoding), encoding, max_size=9999)
+
+
+class CompressedResponsesTest(FlaskServerTest):
+
+    def setUp(self):
+        super(CompressedResponsesTest, self).setUp()
+        self.api = self.get_api('compression', get_catalog_yaml(), compress_min_size=1024, compress_level=9)
+
+    @patch('pymacaron_core.test.return_token')
+    def test_compressed_response(self, func):
+        func.__name__ = 'return_token'
+        Catalog = get_model('Catalog')
+        items = ['item %s' % i for i in range(200)]
+        func.return_value = Catalog(name='foo', items=items)
+        self.start(self.api, compress_level=6, compress_min_size=1024)
+
+        with self.app.test_client() as c:
+            r = c.get('/v1/catalog', headers={'Accept-Encoding': 'gzip, deflate'})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(r.headers['Vary'], 'Accept-Encoding')
+            self.assertTrue(r.headers['ETag'].startswith('W/'))
+            self.assertEqual(json.loads(gzip.decompress(r.data).decode('utf-8'))['items'], items)
+
+            # The weak ETag still matches
+            r = c.get('/v1/catalog', headers={'Accept-Encoding': 'gzip', 'If-None-Match': r.headers['ETag']})
+            self.assertEqual(r.status_code, 304)
+
+            r = c.get('/v1/catalog', headers={'Accept-Encoding': 'deflate'})
+            self.assertEqual(r.headers['Content-Encoding'], 'deflate')
+            self.assertEqual(json.loads(zlib.decompress(r.data).decode('utf-8'))['items'], items)
+
+            # Not accepted by the caller
+            r = c.get('/v1/catalog')
+            self.assertTrue('Content-Encoding' not in r.headers)
+            self.assertEqual(json.loads(r.data.decode('utf-8'))['items'], items)
+
+            # Too small to be worth it
+            func.return_value = Catalog(name='foo', items=[])
+            r = c.get('/v1/catalog', headers={'Accept-Encoding': 'gzip'})
+            self.assertTrue('Content-Encoding' not in r.headers)
+            self.assertEqual(json.loads(r.data.decode('utf-8')), {'name': 'foo', 'items': []})
+
+        # Clients decompress responses
+        func.return_value = Catalog(name='foo', items=items)
+        self.assertEqual(self.api.client.get_catalog().items, items)
+
+    async def acall(self, catalog):
+        try:
+            return await self.api.aclient.set_catalog(catalog)
+        finally:
+            await self.api.async_transport.close()
+
+    @patch('pymacaron_core.test.return_token')
+    def test_compressed_request(self, func):
+        func.__name__ = 'return_token'
+        Catalog = get_model('Catalog')
+        func.side_effect = lambda body: body
+        self.start(self.api, compress_level=6, compress_min_size=1024)
+
+        items = ['item %s' % i for i in range(200)]
+        with self.app.test_client() as c:
+            data = compress(json.dumps({'name': 'foo', 'items': items}).encode('utf-8'), 'gzip')
+            r = c.post('/v1/catalog', data=data, headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(json.loads(r.data.decode('utf-8'))['items'], items)
+
+            r = c.post('/v1/catalog', data=b'not gzip', headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+            self.assertEqual(r.status_code, 400)
+
+            # A small body decompressing to a large one
+            bomb = compress(json.dumps({'name': 'x' * 20 * 1024 * 1024}).encode('utf-8'), 'gzip')
+            self.assertTrue(len(bomb) < 100 * 1024)
+            r = c.post('/v1/catalog', data=bomb, headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+            self.assertEqual(r.status_code, 413)
+
+            # Capped by the app's MAX_CONTENT_LENGTH
+            self.app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+            r = c.post('/v1/catalog', data=compress(b'[' + b'1,' * 1024 * 1024 + b'1]', 'gzip'), headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+            self.assertEqual(r.status_code, 413)
+            self.app.config['MAX_CONTENT_LENGTH'] = None
+
+        with patch('pymacaron_core.swagger.client.compress', wraps=compress) as m:
+            r = self.api.client.set_catalog(Catalog(name='foo', items=items))
+            self.assertEqual(r.items, items)
+            r = asyncio.run(self.acall(Catalog(name='foo', items=items)))
+            self.assertEqual(r.items, items)
+            self.assertEqual(m.call_count, 2)
+            self.assertEqual([call[0][2] for call in m.call_args_list], [9, 9])
+
+            # Small bodies are sent as is
+            r = self.api.client.set_catalog(Catalog(name='foo', items=[]))
+            self.assertEqual(r.items, [])
+            self.assertEqual(m.call_count, 2)
@@ -0,0 +1,103 @@
+import json
+import unittest
+from mock import patch
+from pymacaron_core.swagger.delta import make_merge_patch, apply_merge_patch, DeltaHistory
+from pymacaron_core.models import get_model
+from pymacaron_core.metrics import registry
+from utils import FlaskServerTest, get_catalog_yaml
+
+
+class MergePatchTest(unittest.TestCase):
+
+    def test_make_and_apply(self):
+        old = {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [1, 2]}
+        new = {'a': 1, 'b': {'c': 4}, 'e': [1, 2, 3], 'f': 'g'}
+        patch = make_merge_patch(old, new)
+        self.assertEqual(patch, {'b': {'c': 4, 'd': None}, 'e': [1, 2, 3], 'f': 'g'})
+        self.assertEqual(apply_merge_patch(old, patch), new)
+        self.assertEqual(old, {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': [1, 2]})
+
+    def test_null_values_cannot_be_patched(self):
+        self.assertEqual(make_merge_patch({'a': 1}, {'a': None}), None)
+        self.assertEqual(make_merge_patch({'a': 1}, [1]), None)
+
+    def test_history(self):
+        h = DeltaHistory(max_size=2)
+        old = {'name': 'foo', 'items': ['x' * 100]}
+        new = {'name': 'bar', 'items': ['x' * 100]}
+        body = json.dumps(new).encode('utf-8')
+        h.add('v1', old)
+        self.assertEqual(h.get_patch(['v0', 'v1'], 'v2', body), ('v1', b'{"name":"bar"}'))
+
+        # Patches larger than the body are not worth it
+        self.assertEqual(h.get_patch(['v1'], 'v3', b'{}'), (None, None))
+
+        # Versions fall out of the history
+        h.add('v4', old)
+        h.add('v5', old)
+        self.assertEqual(h.get_patch(['v1'], 'v2', body), (None, None))
+
+
+class DeltaResponsesTest(FlaskServerTest):
+
+    def setUp(self):
+        super(DeltaResponsesTest, self).setUp()
+        registry.clear()
+        self.api = self.get_api('delta', get_catalog_yaml(delta='true'))
+
+    @patch('pymacaron_core.test.return_token')
+    def test_delta_response(self, func):
+        func.__name__ = 'return_token'
+        Catalog = get_model('Catalog')
+        items = ['item %s' % i for i in range(50)]
+        func.return_value = Catalog(name='foo', items=items)
+        self.start(self.api)
+
+        with self.app.test_client() as c:
+            r = c.get('/v1/catalog')
+            etag = r.headers['ETag']
+
+            func.return_value = Catalog(name='bar', items=items)
+            r = c.get('/v1/catalog', headers={'If-None-Match': etag, 'A-IM': 'merge-patch'})
+            self.assertEqual(r.status_code, 226)
+            self.assertEqual(json.loads(r.data.decode('utf-8')), {'name': 'bar'})
+            self.assertEqual(r.headers['IM'], 'merge-patch')
+            self.assertEqual(r.headers['Delta-Base'], etag)
+            self.assertEqual(r.headers['Content-Type'], 'application/merge-patch+json')
+            self.assertNotEqual(r.headers['ETag'], etag)
+
+            # Without A-IM, the full response
+            r = c.get('/v1/catalog', headers={'If-None-Match': etag})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(json.loads(r.data.decode('utf-8'))['name'], 'bar')
+
+    @patch('pymacaron_core.test.return_token')
+    def test_client_applies_delta(self, func):
+        func.__name__ = 'return_token'
+        Catalog = get_model('Catalog')
+        items = ['item %s' % i for i in range(50)]
+        func.return_value = Catalog(name='foo', items=items)
+        self.start(self.api)
+
+        r = self.api.client.get_catalog()
+        self.assertEqual(r.name, 'foo')
+
+        # Unchanged
+        r = self.api.client.get_catalog()
+        self.assertEqual(r.name, 'foo')
+
+        func.return_value = Catalog(name='bar', items=items)
+        r = self.api.client.get_catalog()
+        self.assertEqual(r.name, 'bar')
+        self.assertEqual(r.items, items)
+
+        # The patched version is the new base
+        func.return_value = Catalog(name='baz', items=items)
+        r = self.api.client.get_catalog()
+        self.assertEqual((r.name, r.items), ('baz', items))
+
+        counter = registry.get('pym_client_cache_total')
+        labels = ('delta', 'GET', '/v1/catalog')
+        self.assertEqual(counter.get(labels + ('miss',)), 1)
+        self.assertEqual(counter.get(labels + ('revalidated',)), 1)
+        self.assertEqual(counter.get(labels + ('delta',)), 2)
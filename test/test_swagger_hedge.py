@@ -0,0 +1,150 @@
+import time
+import asyncio
+import threading
+import unittest
+from pymacaron_core.swagger.api import API
+from pymacaron_core.swagger.hedge import Hedger, parse_hedge_delay
+from pymacaron_core.metrics import registry
+from utils import yaml_foo, start_stub_server
+
+
+class SlowThenFast():
+    """Sleep a long time on the first call, then answer right away"""
+
+    def __init__(self, first_delay=0.5):
+        self.first_delay = first_delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def next_call(self):
+        with self.lock:
+            self.calls += 1
+            return self.calls
+
+    def __call__(self, value):
+        n = self.next_call()
+        if n == 1:
+            time.sleep(self.first_delay)
+        return '%s-%s' % (value, n)
+
+    async def acall(self, value):
+        n = self.next_call()
+        if n == 1:
+            await asyncio.sleep(self.first_delay)
+        return '%s-%s' % (value, n)
+
+
+class HedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        registry.clear()
+
+    def test_parse_hedge_delay(self):
+        self.assertEqual(parse_hedge_delay(None), (None, None))
+        self.assertEqual(parse_hedge_delay(0.1), (0.1, None))
+        self.assertEqual(parse_hedge_delay('0.1'), (0.1, None))
+        self.assertEqual(parse_hedge_delay('p95'), (None, 95))
+        with self.assertRaises(ValueError):
+            parse_hedge_delay('p100')
+
+    def test_hedge_wins(self):
+        labels = ('foo', 'GET', '/v1/foo')
+        h = Hedger(0.05, labels=labels)
+        f = SlowThenFast()
+        threads = []
+
+        def call(value):
+            threads.append(threading.current_thread().name)
+            return f(value)
+
+        t0 = time.time()
+        self.assertEqual(h.call(h.get_delay(), call, 'a'), 'a-2')
+        self.assertTrue(time.time() - t0 < 0.3)
+        self.assertEqual(registry.get('pym_client_hedges_total').get(labels), 1)
+        self.assertEqual(registry.get('pym_client_hedges_won_total').get(labels), 1)
+
+        # Only the hedge is sent from the thread pool
+        self.assertEqual(threads[0], 'pym-hedge-first')
+        self.assertTrue(threads[1].startswith('pym-hedge_'))
+
+    def test_no_hedge_if_fast(self):
+        h = Hedger(0.2)
+        f = SlowThenFast(first_delay=0)
+        self.assertEqual(h.call(h.get_delay(), f, 'a'), 'a-1')
+        self.assertEqual(f.calls, 1)
+
+        # Hedging disabled for that call
+        f = SlowThenFast(first_delay=0.1)
+        self.assertEqual(h.call(h.get_delay(False), f, 'a'), 'a-1')
+        self.assertEqual(f.calls, 1)
+
+    def test_exceptions(self):
+        h = Hedger(0.01)
+        calls = []
+
+        def fail_first(value):
+            calls.append(value)
+            if len(calls) == 1:
+                time.sleep(0.05)
+                raise Exception('boom')
+            time.sleep(0.1)
+            return 'ok'
+
+        # The first call fails: wait for the hedge
+        self.assertEqual(h.call(0.01, fail_first, 'a'), 'ok')
+
+        def fail(value):
+            raise Exception('boom %s' % value)
+
+        with self.assertRaises(Exception):
+            h.call(0, fail, 'a')
+
+    def test_hedge_rate_is_capped(self):
+        h = Hedger(0, max_rate=0.5)
+        h.budget.tokens = 0
+        for i in range(4):
+            f = SlowThenFast(first_delay=0.02)
+            h.call(h.get_delay(), f, 'a')
+        self.assertEqual(h.budget.tokens, 0)
+
+    def test_percentile_delay(self):
+        h = Hedger('p90', min_samples=10)
+        self.assertEqual(h.get_delay(), None)
+        for i in range(100):
+            h.observe(i / 1000.0)
+        self.assertEqual(h.get_delay(), 0.09)
+        self.assertEqual(h.get_delay('p50'), 0.05)
+        self.assertEqual(h.get_delay(0.3), 0.3)
+
+    def test_async_hedge(self):
+        h = Hedger(0.05)
+        f = SlowThenFast()
+
+        async def main():
+            t0 = time.time()
+            r = await h.async_call(h.get_delay(), f.acall, 'a')
+            return r, time.time() - t0
+
+        r, duration = asyncio.run(main())
+        self.assertEqual(r, 'a-2')
+        self.assertTrue(duration < 0.3)
+
+
+class HedgedCallsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_stub_server()
+        self.api = API('foo', yaml_str=yaml_foo, port=self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_hedge_delay_kwarg(self):
+        self.assertEqual(self.api.client.slow(delay=0.1, hedge_delay=0.02).foo, 'bar')
+        time.sleep(0.15)
+        self.assertEqual(self.server.calls, ['/v1/slow?delay=0.1'] * 2)
+
+        self.server.calls = []
+        self.assertEqual(self.api.client.get_foo().foo, 'bar')
+        self.assertEqual(self.server.calls, ['/v1/foo'])
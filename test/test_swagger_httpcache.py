@@ -0,0 +1,125 @@
+import time
+import unittest
+from mock import MagicMock
+from pymacaron_core.swagger.api import API
+from pymacaron_core.swagger.httpcache import ClientCache, parse_cache_control
+from pymacaron_core.metrics import registry
+from utils import yaml_foo, start_stub_server
+
+
+class ClientCacheTest(unittest.TestCase):
+
+    def test_parse_cache_control(self):
+        self.assertEqual(parse_cache_control('max-age=30, Private, no-cache="Set-Cookie"'), {'max-age': '30', 'private': True, 'no-cache': 'set-cookie'})
+        self.assertEqual(parse_cache_control(None), {})
+
+    def test_store(self):
+        cache = ClientCache(max_ttl=60)
+        cache.store('a', 'A', {'Cache-Control': 'max-age=30'})
+        self.assertTrue(cache.get('a').is_fresh())
+        self.assertEqual(cache.get('a').result, 'A')
+
+        # Not cacheable
+        cache.store('b', 'B', {})
+        cache.store('c', 'C', {'Cache-Control': 'no-store, max-age=30'})
+        cache.store('d', 'D', {'Cache-Control': 'max-age=10', 'Age': '20'})
+        for k in ('b', 'c', 'd'):
+            self.assertEqual(cache.get(k), None)
+
+        # Stale, but revalidatable
+        cache.store('e', 'E', {'Cache-Control': 'no-cache', 'ETag': '"1"'})
+        self.assertFalse(cache.get('e').is_fresh())
+        self.assertEqual(cache.get('e').etag, '"1"')
+
+        # Capped by max_ttl
+        cache.store('f', 'F', {'Cache-Control': 'max-age=3600'})
+        self.assertTrue(cache.get('f').expires_at < time.monotonic() + 61)
+
+    def test_ttl_and_lru(self):
+        cache = ClientCache(max_size=2, default_ttl=0.1)
+        cache.store('a', 'A', {})
+        time.sleep(0.15)
+        self.assertEqual(cache.get('a'), None)
+
+        cache.store('a', 'A', {})
+        cache.store('b', 'B', {})
+        cache.get('a')
+        cache.store('c', 'C', {})
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a').result, 'A')
+
+    def test_key(self):
+        cache = ClientCache()
+        k = cache.get_key('http://a/b', {'y': 1, 'x': 'z'}, {'Authorization': 'foo', 'PymCallID': '123'})
+        self.assertEqual(k, cache.get_key('http://a/b', {'x': 'z', 'y': '1'}, {'Authorization': 'foo', 'PymCallID': '456'}))
+        self.assertNotEqual(k, cache.get_key('http://a/b', {'x': 'z', 'y': '1'}, {'Authorization': 'bar'}))
+
+    def test_is_enabled(self):
+        endpoint = MagicMock(method='GET', client_cache=None, delta=False)
+        self.assertTrue(ClientCache().is_enabled(endpoint))
+        self.assertFalse(ClientCache(all_endpoints=False).is_enabled(endpoint))
+        endpoint.delta = True
+        self.assertTrue(ClientCache(all_endpoints=False).is_enabled(endpoint))
+        endpoint.client_cache = True
+        self.assertTrue(ClientCache(all_endpoints=False).is_enabled(endpoint))
+        endpoint.method = 'POST'
+        self.assertFalse(ClientCache().is_enabled(endpoint))
+
+
+class CachedCallsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_stub_server()
+        self.port = self.server.server_address[1]
+        registry.clear()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_cache_count(self, result):
+        return registry.get('pym_client_cache_total').get(('foo', 'GET', '/v1/foo', result))
+
+    def test_not_cached_by_default(self):
+        api = API('foo', yaml_str=yaml_foo, port=self.port)
+        self.server.response_headers = {'Cache-Control': 'max-age=30'}
+        api.client.get_foo()
+        api.client.get_foo()
+        self.assertEqual(len(self.server.calls), 2)
+
+    def test_max_age(self):
+        api = API('foo', yaml_str=yaml_foo, port=self.port, client_cache=True)
+        self.server.response_headers = {'Cache-Control': 'max-age=30'}
+        r1 = api.client.get_foo()
+        r2 = api.client.get_foo()
+        self.assertEqual(r1.foo, 'bar')
+        self.assertIs(r1, r2)
+        self.assertEqual(self.server.calls, ['/v1/foo'])
+        self.assertEqual(self.get_cache_count('hit'), 1)
+        self.assertEqual(self.get_cache_count('miss'), 1)
+
+        # Query parameters are part of the key
+        api.client.slow(delay=0)
+        api.client.slow(delay=0.01)
+        api.client.slow(delay=0)
+        self.assertEqual(len(self.server.calls), 3)
+
+        api.client_cache.invalidate()
+        api.client.get_foo()
+        self.assertEqual(len(self.server.calls), 4)
+
+    def test_etag_revalidation(self):
+        api = API('foo', yaml_str=yaml_foo, port=self.port, client_cache=True)
+        self.server.response_headers = {'Cache-Control': 'no-cache', 'ETag': '"v1"'}
+        r1 = api.client.get_foo()
+        r2 = api.client.get_foo()
+        self.assertIs(r1, r2)
+        self.assertEqual(len(self.server.calls), 2)
+        self.assertEqual(self.get_cache_count('revalidated'), 1)
+
+        # The resource changed
+        self.server.response_headers = {'Cache-Control': 'no-cache', 'ETag': '"v2"'}
+        self.server.foo = 'baz'
+        r3 = api.client.get_foo()
+        self.assertEqual(r3.foo, 'baz')
+        self.assertEqual(self.get_cache_count('miss'), 2)
@@ -0,0 +1,127 @@
+import json
+import asyncio
+import unittest
+import msgpack
+from mock import patch
+from pymacaron_core.swagger.api import API
+from pymacaron_core.swagger.codec import msgpack_dumps
+from pymacaron_core.swagger.servercache import configure_response_cache
+from pymacaron_core.models import get_model
+from utils import FlaskServerTest, get_catalog_yaml
+
+
+yaml_str = get_catalog_yaml(msgpack=True, cache_ttl=30)
+
+
+class MsgpackSpecTest(unittest.TestCase):
+
+    def test_spec(self):
+        endpoints = []
+        API('msgpack', yaml_str=yaml_str).api_spec.call_on_each_endpoint(endpoints.append)
+        get, post = sorted(endpoints, key=lambda e: e.method)
+        self.assertEqual((get.produces_json, get.produces_msgpack, get.consumes_msgpack), (True, True, False))
+        self.assertEqual((post.produces_json, post.produces_msgpack, post.consumes_msgpack), (True, True, True))
+        self.assertEqual(get.cache_vary, ('Authorization', 'Accept'))
+
+
+class MsgpackTest(FlaskServerTest):
+
+    def setUp(self):
+        super(MsgpackTest, self).setUp()
+        configure_response_cache()
+        self.api = self.get_api('msgpack', yaml_str, prefer_msgpack=True)
+
+    def tearDown(self):
+        super(MsgpackTest, self).tearDown()
+        configure_response_cache()
+
+    @patch('pymacaron_core.test.return_token')
+    def test_negotiate_response(self, func):
+        func.__name__ = 'return_token'
+        Catalog = get_model('Catalog')
+        func.return_value = Catalog(name='foo', items=['a', 'b'])
+        self.start(self.api)
+
+        with self.app.test_client() as c:
+            for i in range(2):
+                r = c.get('/v1/catalog', headers={'Accept': 'application/msgpack, application/json;q=0.9'})
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(r.headers['Content-Type'], 'application/msgpack')
+                self.assertEqual(r.headers['Vary'], 'Accept')
+                self.assertEqual(msgpack.unpackb(r.data, raw=False), {'name': 'foo', 'items': ['a', 'b']})
+
+                # The cached msgpack response is not sent to json callers
+                for accept in (None, '*/*', 'application/json'):
+                    r = c.get('/v1/catalog', headers={'Accept': accept} if accept else {})
+                    self.assertEqual(r.headers['Content-Type'], 'application/json')
+                    self.assertEqual(json.loads(r.data.decode('utf-8')), {'name': 'foo', 'items': ['a', 'b']})
+
+        self.assertEqual(func.call_count, 4)
+
+    @patch('pymacaron_core.test.return_token')
+    def test_msgpack_request(self, func):
+        func.__name__ = 'return_token'
+        Catalog = get_model('Catalog')
+        func.side_effect = lambda body: body
+        self.start(self.api)
+
+        with self.app.test_client() as c:
+            r = c.post('/v1/catalog', data=msgpack_dumps({'name': 'foo', 'items': ['a']}), headers={'Content-Type': 'application/msgpack'})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(json.loads(r.data.decode('utf-8')), {'name': 'foo', 'items': ['a']})
+            func.assert_called_once_with(Catalog(name='foo', items=['a']))
+
+            # Same validation as json
+            r = c.post('/v1/catalog', data=msgpack_dumps({'name': 'foo', 'items': 'a'}), headers={'Content-Type': 'application/msgpack'})
+            self.assertEqual(r.status_code, 400)
+
+            r = c.post('/v1/catalog', data=b'\xc1', headers={'Content-Type': 'application/msgpack'})
+            self.assertEqual(r.status_code, 400)
+            self.assertTrue('Cannot parse MessagePack data' in r.data.decode('utf-8'), r.data)
+
+    @patch('pymacaron_core.test.return_token')
+    def test_msgpack_request_not_consumed(self, func):
+        func.__name__ = 'return_token'
+        func.side_effect = lambda body: body
+        self.start(self.get_api('json', get_catalog_yaml()))
+
+        # The endpoint does not list application/msgpack in its 'consumes'
+        with self.app.test_client() as c:
+            r = c.post('/v1/catalog', data=msgpack_dumps({'name': 'foo', 'items': ['a']}), headers={'Content-Type': 'application/msgpack'})
+            self.assertEqual(r.status_code, 400)
+            self.assertTrue('Cannot parse json data' in r.data.decode('utf-8'), r.data)
+        func.assert_not_called()
+
+    async def acall(self, catalog):
+        try:
+            return await self.api.aclient.set_catalog(catalog)
+        finally:
+            await self.api.async_transport.close()
+
+    @patch('pymacaron_core.test.return_token')
+    def test_client_prefers_msgpack(self, func):
+        func.__name__ = 'return_token'
+        Catalog = get_model('Catalog')
+        func.side_effect = lambda body=None: body or Catalog(name='foo', items=['a'])
+        self.start(self.api)
+
+        with patch('pymacaron_core.swagger.server.msgpack_dumps', wraps=msgpack_dumps) as dumps_response, \
+                patch('pymacaron_core.swagger.client.msgpack_dumps', wraps=msgpack_dumps) as dumps_request:
+            r = self.api.client.get_catalog()
+            self.assertEqual((r.name, r.items), ('foo', ['a']))
+            self.assertEqual(dumps_response.call_count, 1)
+            self.assertEqual(dumps_request.call_count, 0)
+
+            r = self.api.client.set_catalog(Catalog(name='bar', items=['b']))
+            self.assertEqual((r.name, r.items), ('bar', ['b']))
+            r = asyncio.run(self.acall(Catalog(name='baz', items=['c'])))
+            self.assertEqual((r.name, r.items), ('baz', ['c']))
+            self.assertEqual(dumps_response.call_count, 3)
+            self.assertEqual(dumps_request.call_count, 2)
+
+        # Unless told otherwise, clients stick to json
+        api = self.get_api('msgpack', yaml_str)
+        with patch('pymacaron_core.swagger.server.msgpack_dumps', wraps=msgpack_dumps) as dumps_response:
+            r = api.client.set_catalog(Catalog(name='bar', items=['b']))
+            self.assertEqual((r.name, r.items), ('bar', ['b']))
+            dumps_response.assert_not_called()
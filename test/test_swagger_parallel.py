@@ -0,0 +1,102 @@
+import imp
+import os
+import json
+import time
+import threading
+import responses
+from pymacaron_core.swagger.apipool import ApiPool
+from pymacaron_core.context import get_call_id, get_call_path, set_call_context, reset_call_context
+
+
+utils = imp.load_source('common', os.path.join(os.path.dirname(__file__), 'utils.py'))
+
+
+def get_context(delay=0):
+    time.sleep(delay)
+    return (get_call_id(), get_call_path(), threading.current_thread().name)
+
+
+def fail(msg):
+    raise Exception(msg)
+
+
+class Test(utils.PymTest):
+
+
+    def test_results_in_order(self):
+        t0 = time.time()
+        results = ApiPool.parallel([
+            (time.sleep, [0.2]),
+            (sorted, [[3, 1, 2]], {'reverse': True}),
+            (fail, ['boom']),
+            lambda: 'foo',
+            (time.sleep, [0.2]),
+        ])
+        # Calls ran concurrently
+        self.assertTrue(time.time() - t0 < 0.35)
+        self.assertEqual(results[0], None)
+        self.assertEqual(results[1], [3, 2, 1])
+        self.assertEqual(str(results[2]), 'boom')
+        self.assertEqual(results[3], 'foo')
+
+        with self.assertRaises(Exception) as e:
+            ApiPool.parallel([(fail, ['boom1']), (fail, ['boom2'])], raise_errors=True)
+        self.assertEqual(str(e.exception), 'boom1')
+
+
+    def test_max_workers(self):
+        t0 = time.time()
+        ApiPool.parallel([(time.sleep, [0.1])] * 4, max_workers=2)
+        self.assertTrue(time.time() - t0 >= 0.2)
+
+
+    def test_call_context_is_propagated(self):
+        token = set_call_context(call_id='1234', call_path='foo.bar')
+        try:
+            results = ApiPool.parallel([(get_context, [0.1])] * 3)
+        finally:
+            reset_call_context(token)
+        self.assertEqual(get_call_id(), None)
+
+        for call_id, call_path, thread_name in results:
+            self.assertEqual(call_id, '1234')
+            self.assertEqual(call_path, 'foo.bar')
+            self.assertTrue(thread_name.startswith('pym-parallel'))
+
+
+    def test_nested_calls(self):
+        results = ApiPool.parallel([
+            (ApiPool.parallel, [[get_context, get_context]]),
+            (ApiPool.parallel, [[get_context, get_context]]),
+        ])
+        self.assertEqual(len(results), 2)
+        for r in results:
+            # Run sequentially in the same thread
+            self.assertEqual(r[0][2], r[1][2])
+
+
+    @responses.activate
+    def test_client_calls(self):
+        handler, _ = self.generate_client_and_spec(self.yaml_query_param)
+
+        responses.add(
+            responses.GET, "http://some.server.com:80/v1/some/path",
+            body=json.dumps({"foo": "a", "bar": "b"}),
+            status=200,
+            content_type="application/json"
+        )
+
+        token = set_call_context(call_id='1234', call_path='foo.bar')
+        try:
+            results = ApiPool.parallel([
+                (handler, [], {'arg1': 'a', 'arg2': 'b'}),
+                (handler, [], {'arg1': 'c', 'arg2': 'd'}),
+            ])
+        finally:
+            reset_call_context(token)
+
+        self.assertEqual([r.foo for r in results], ['a', 'a'])
+        self.assertEqual(len(responses.calls), 2)
+        for c in responses.calls:
+            self.assertEqual(c.request.headers['PymCallID'], '1234')
+            self.assertEqual(c.request.headers['PymCallPath'], 'foo.bar')
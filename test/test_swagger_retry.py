@@ -0,0 +1,61 @@
+import time
+import unittest
+from mock import patch
+from pymacaron_core.swagger.retry import RetryPolicy, RetryBudget
+
+
+class Test(unittest.TestCase):
+
+    def test_backoff_with_full_jitter(self):
+        p = RetryPolicy(backoff=0.1, backoff_max=1)
+        for retry, cap in ((0, 0.1), (1, 0.2), (2, 0.4), (3, 0.8), (4, 1), (10, 1)):
+            delays = [p.get_delay(retry) for i in range(200)]
+            self.assertTrue(min(delays) >= 0)
+            self.assertTrue(max(delays) <= cap)
+            # Jittered over the whole range
+            self.assertTrue(max(delays) > cap / 2)
+
+        self.assertEqual(RetryPolicy(backoff=0).get_delay(3), 0)
+
+    def test_budget(self):
+        b = RetryBudget(ratio=0.5, min_per_sec=0, burst=2)
+        self.assertTrue(b.withdraw())
+        self.assertTrue(b.withdraw())
+        self.assertFalse(b.withdraw())
+
+        # Every 2 calls earn one retry
+        b.deposit()
+        self.assertFalse(b.withdraw())
+        b.deposit()
+        self.assertTrue(b.withdraw())
+        self.assertFalse(b.withdraw())
+
+        # Up to burst tokens
+        for i in range(10):
+            b.deposit()
+        self.assertEqual(b.tokens, 2)
+
+    def test_budget_refills_over_time(self):
+        b = RetryBudget(ratio=0, min_per_sec=10, burst=1)
+        self.assertTrue(b.withdraw())
+        self.assertFalse(b.withdraw())
+        time.sleep(0.15)
+        self.assertTrue(b.withdraw())
+
+    def test_no_budget(self):
+        p = RetryPolicy(budget=None)
+        for i in range(100):
+            self.assertTrue(p.can_retry())
+
+    @patch('pymacaron_core.swagger.retry.random.uniform')
+    def test_policy(self, uniform):
+        uniform.return_value = 0.5
+        p = RetryPolicy(backoff=1, backoff_max=3, budget=0.1, budget_min_per_sec=0, budget_burst=1)
+        self.assertEqual(p.get_delay(2), 0.5)
+        uniform.assert_called_once_with(0, 3)
+
+        self.assertTrue(p.can_retry())
+        self.assertFalse(p.can_retry())
+        for i in range(11):
+            p.on_call()
+        self.assertTrue(p.can_retry())
@@ -3,11 +3,23 @@ import os
 import pprint
 import json
 import logging
+import time
+import threading
+import yaml
 
-from flask import jsonify
+from flask import Flask, jsonify, request
 from mock import patch
+from werkzeug.serving import make_server
 
 from pymacaron_core.models import get_model
+from pymacaron_core.swagger.spec import ApiSpec
+from pymacaron_core.swagger.api import default_error_callback
+from pymacaron_core.swagger.server import spawn_server_api, get_request_timing, set_etag
+from pymacaron_core.swagger.client import generate_client_callers
+from pymacaron_core.exceptions import PyMacaronCoreException, ValidationError
+from pymacaron_core.metrics import registry
+from pymacaron_core.swagger.servercache import configure_response_cache, invalidate_response_cache
+from pymacaron_core.context import get_call_id, get_call_path
 
 
 utils = imp.load_source('common', os.path.join(os.path.dirname(__file__), 'utils.py'))
@@ -251,3 +263,398 @@ class Test(utils.PymTest):
 #         r = c.get('/v1/in/query?bar=bbbb')
 #         self.assertError(r, 400, 'BAD REQUEST')
 #         func.assert_not_called()
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_timing(self, func):
+        func.__name__ = 'return_token'
+
+        swagger_dict = yaml.load(self.yaml_in_body, Loader=yaml.FullLoader)
+        spec = ApiSpec(swagger_dict)
+        spec.load_models()
+        app = Flask('test')
+
+        timings = []
+
+        def decorator(f):
+            def wrapper(*args, **kwargs):
+                r = f(*args, **kwargs)
+                timings.append(get_request_timing().to_dict())
+                return r
+            return wrapper
+
+        spawn_server_api('somename', app, spec, default_error_callback, decorator, server_timing=True)
+
+        SessionToken = get_model('SessionToken')
+        func.return_value = SessionToken(token='456')
+
+        with app.test_client() as c:
+            r = c.get('/v1/in/body', data=json.dumps({
+                'email': 'a@a.a',
+                'int': '123123',
+            }))
+            self.assertReplyOK(r, '456')
+            header = r.headers['Server-Timing']
+            stages = [s.split(';')[0] for s in header.split(', ')]
+            self.assertEqual(stages, ['parse', 'unmarshal', 'convert', 'handler', 'serialize', 'jsonify', 'total'])
+
+        self.assertEqual(len(timings), 1)
+        self.assertEqual(list(timings[0].keys()), stages)
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_call_context(self, func):
+        func.__name__ = 'return_token'
+
+        app, spec = self.generate_server_app(self.yaml_no_param)
+
+        SessionToken = get_model('SessionToken')
+        contexts = []
+
+        def return_token():
+            contexts.append((get_call_id(), get_call_path()))
+            return SessionToken(token='123')
+        func.side_effect = return_token
+
+        with app.test_client() as c:
+            r = c.get('/v1/no/param', headers={'PymCallID': 'abcd', 'PymCallPath': 'public'})
+            self.assertReplyOK(r, '123')
+            r = c.get('/v1/no/param')
+            self.assertReplyOK(r, '123')
+
+        self.assertEqual(contexts[0], ('abcd', 'public.somename'))
+        self.assertEqual(contexts[1][1], 'somename')
+        self.assertEqual(len(contexts[1][0]), 36)
+
+        # The call context does not outlive the request
+        self.assertEqual((get_call_id(), get_call_path()), (None, None))
+
+        # Without flask's context stacks (removed in flask 2.3)
+        with patch('pymacaron_core.swagger.server.stack', None), app.test_client() as c:
+            r = c.get('/v1/no/param', headers={'PymCallID': 'efgh'})
+            self.assertReplyOK(r, '123')
+        self.assertEqual(contexts[2], ('efgh', 'somename'))
+
+
+    def generate_direct_client(self, yaml_str, callback=default_error_callback, decorator=None, with_http=False):
+        yaml_str = yaml_str.replace('x-auth-required', 'x-bind-client: do_test\n      x-auth-required')
+        swagger_dict = yaml.load(yaml_str, Loader=yaml.FullLoader)
+        app = Flask('test')
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.addCleanup(server.server_close)
+        spec = ApiSpec(swagger_dict, host='127.0.0.1', port=server.server_port)
+        spec.load_models()
+        direct_handlers = spawn_server_api('somename', app, spec, callback, decorator)
+        callers = generate_client_callers(spec, 10, callback, True, app, api_name='somename', direct_handlers=direct_handlers)
+        if with_http:
+            # Also return a caller of the same endpoint over HTTP
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.addCleanup(server.shutdown)
+            return callers['do_test'], generate_client_callers(spec, 10, callback, False, None, api_name='somename')['do_test']
+        return callers['do_test']
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_direct_call(self, func):
+        func.__name__ = 'return_token'
+
+        do_test = self.generate_direct_client(self.yaml_in_body)
+
+        SessionToken = get_model('SessionToken')
+        Credentials = get_model('Credentials')
+        token = SessionToken(token='456')
+        contexts = []
+
+        def return_token(body):
+            contexts.append((get_call_id(), get_call_path()))
+            return token
+        func.side_effect = return_token
+
+        # The handler and the caller get copies of the body and result
+        body = Credentials(email='a@a.a', int='123123')
+        r = do_test(body, request_headers={'Authorization': 'Bearer foo'})
+        self.assertIsNot(r, token)
+        self.assertEqual(r.token, '456')
+        func.assert_called_once_with(body)
+        self.assertIsNot(func.call_args[0][0], body)
+        self.assertEqual(contexts[0][1], 'somename')
+        self.assertEqual(len(contexts[0][0]), 36)
+        self.assertEqual((get_call_id(), get_call_path()), (None, None))
+
+        # The body is validated before reaching the handler
+        with self.assertRaises(ValidationError):
+            do_test(Credentials(email=123, int='123123'))
+        self.assertEqual(func.call_count, 1)
+
+        # And so is the result
+        token.token = 123
+        with self.assertRaises(ValidationError):
+            do_test(body)
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_direct_call_same_as_http(self, func):
+        func.__name__ = 'return_token'
+
+        SessionToken = get_model('SessionToken')
+        Credentials = get_model('Credentials')
+        func.side_effect = lambda body: SessionToken(token=body.email)
+        paths = []
+
+        def decorator(f):
+            def wrapper(*args, **kwargs):
+                paths.append(request.path)
+                return f(*args, **kwargs)
+            return wrapper
+
+        direct, http = self.generate_direct_client(self.yaml_in_body, decorator=decorator, with_http=True)
+
+        body = Credentials(email='a@a.a', int='123123')
+        r1 = direct(body)
+        r2 = http(body)
+        self.assertEqual(type(r1), type(r2))
+        self.assertEqual(r1, r2)
+        self.assertEqual(r1.token, 'a@a.a')
+        self.assertEqual(func.call_args_list[0], func.call_args_list[1])
+        self.assertEqual(type(func.call_args_list[0][0][0]), type(func.call_args_list[1][0][0]))
+
+        # Both go through the global decorator
+        self.assertEqual(paths, ['/v1/in/body', '/v1/in/body'])
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_direct_call_query_and_path(self, func):
+        func.__name__ = 'return_token'
+
+        SessionToken = get_model('SessionToken')
+        func.return_value = SessionToken(token='456')
+
+        do_test = self.generate_direct_client(self.yaml_in_query)
+        r = do_test(foo='aaaa', bar='bbbb')
+        self.assertEqual(r.token, '456')
+        func.assert_called_once_with(foo='aaaa', bar='bbbb')
+
+        # Required parameters are checked as over HTTP
+        with self.assertRaises(ValidationError):
+            do_test(foo='aaaa', bar=None)
+        self.assertEqual(func.call_count, 1)
+
+        func.reset_mock()
+        do_test = self.generate_direct_client(self.yaml_in_path)
+        r = do_test(item='a', path='b')
+        self.assertEqual(r.token, '456')
+        func.assert_called_once_with(item='a', path='b')
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_direct_call_errors(self, func):
+        func.__name__ = 'return_token'
+
+        errors = []
+
+        def callback(e):
+            errors.append(e)
+            return 'error'
+
+        do_test = self.generate_direct_client(self.yaml_no_param, callback=callback)
+
+        func.return_value = None
+        self.assertEqual(do_test(), 'error')
+        self.assertEqual(errors[-1].status_code, 500)
+
+        func.return_value = {'token': '123'}
+        self.assertEqual(do_test(), 'error')
+        self.assertTrue('did not return a class instance' in str(errors[-1]))
+
+        func.side_effect = PyMacaronCoreException('boom')
+        self.assertEqual(do_test(), 'error')
+        self.assertEqual(str(errors[-1]), 'boom')
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_coalesce(self, func):
+        func.__name__ = 'return_token'
+        registry.clear()
+
+        yaml_str = self.yaml_in_query.replace('x-auth-required', 'x-coalesce: true\n      x-auth-required')
+        app, spec = self.generate_server_app(yaml_str)
+
+        SessionToken = get_model('SessionToken')
+
+        def return_token(foo, bar):
+            time.sleep(0.2)
+            return SessionToken(token=foo)
+        func.side_effect = return_token
+
+        replies = []
+
+        def get(url, headers={}):
+            with app.test_client() as c:
+                replies.append(c.get(url, headers=headers))
+
+        urls = ['/v1/in/query?foo=a&bar=b'] * 3 + ['/v1/in/query?bar=b&foo=a', '/v1/in/query?foo=c&bar=b']
+        threads = [threading.Thread(target=get, args=(url,)) for url in urls]
+        threads.append(threading.Thread(target=get, args=(urls[0], {'Authorization': 'Bearer foo'})))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # One execution per distinct path, query and Authorization header
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(sorted(json.loads(r.data.decode("utf-8"))['token'] for r in replies), ['a'] * 5 + ['c'])
+        for r in replies:
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.headers['Content-Type'], 'application/json')
+        labels = ('somename', 'GET', '/v1/in/query')
+        self.assertEqual(registry.get('pym_server_coalesced_total').get(labels), 3)
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_response_cache(self, func):
+        func.__name__ = 'return_token'
+        registry.clear()
+        configure_response_cache(max_size=2)
+        self.addCleanup(configure_response_cache)
+
+        yaml_str = self.yaml_in_query.replace('x-auth-required', 'x-cache-ttl: 30\n      x-auth-required')
+        app, spec = self.generate_server_app(yaml_str)
+
+        SessionToken = get_model('SessionToken')
+        func.side_effect = lambda foo, bar: SessionToken(token=foo + bar)
+
+        with app.test_client() as c:
+            self.assertReplyOK(c.get('/v1/in/query?foo=a&bar=b'), 'ab')
+            self.assertReplyOK(c.get('/v1/in/query?bar=b&foo=a'), 'ab')
+            self.assertEqual(func.call_count, 1)
+
+            # Vary on query and Authorization header
+            self.assertReplyOK(c.get('/v1/in/query?foo=c&bar=b'), 'cb')
+            self.assertReplyOK(c.get('/v1/in/query?foo=a&bar=b', headers={'Authorization': 'foo'}), 'ab')
+            self.assertEqual(func.call_count, 3)
+
+            labels = ('somename', 'GET', '/v1/in/query')
+            self.assertEqual(registry.get('pym_server_cache_total').get(labels + ('hit',)), 1)
+            self.assertEqual(registry.get('pym_server_cache_total').get(labels + ('miss',)), 3)
+            self.assertEqual(registry.get('pym_server_cache_evictions_total').get(labels), 1)
+
+            invalidate_response_cache('/v1/in/query')
+            self.assertReplyOK(c.get('/v1/in/query?foo=c&bar=b'), 'cb')
+            self.assertEqual(func.call_count, 4)
+
+            # Errors are not cached
+            with app.test_request_context('/'):
+                r = jsonify({'foo': 'bar'})
+                r.status_code = 534
+            func.side_effect = None
+            func.return_value = r
+            invalidate_response_cache()
+            self.assertEqual(c.get('/v1/in/query?foo=a&bar=b').status_code, 534)
+            self.assertEqual(c.get('/v1/in/query?foo=a&bar=b').status_code, 534)
+            self.assertEqual(func.call_count, 6)
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_etag(self, func):
+        func.__name__ = 'return_token'
+
+        app, spec = self.generate_server_app(self.yaml_no_param)
+
+        SessionToken = get_model('SessionToken')
+        func.return_value = SessionToken(token='123')
+
+        with app.test_client() as c:
+            r = c.get('/v1/no/param')
+            self.assertReplyOK(r, '123')
+            etag = r.headers['ETag']
+            self.assertEqual(len(etag), 34)
+
+            r = c.get('/v1/no/param', headers={'If-None-Match': etag})
+            self.assertEqual(r.status_code, 304)
+            self.assertEqual(r.data, b'')
+            self.assertEqual(r.headers['ETag'], etag)
+
+            # The content changed
+            func.return_value = SessionToken(token='456')
+            r = c.get('/v1/no/param', headers={'If-None-Match': etag})
+            self.assertReplyOK(r, '456')
+            self.assertNotEqual(r.headers['ETag'], etag)
+
+        # Unless disabled
+        app, spec = self.generate_server_app(self.yaml_no_param.replace('x-auth-required', 'x-etag: false\n      x-auth-required'))
+        with app.test_client() as c:
+            r = c.get('/v1/no/param')
+            self.assertReplyOK(r, '456')
+            self.assertTrue('ETag' not in r.headers)
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_etag_version(self, func):
+        func.__name__ = 'return_token'
+
+        app, spec = self.generate_server_app(self.yaml_no_param)
+
+        SessionToken = get_model('SessionToken')
+        matches = []
+
+        def return_token():
+            matches.append(set_etag(42))
+            if matches[-1]:
+                return None
+            return SessionToken(token='123')
+        func.side_effect = return_token
+
+        with app.test_client() as c:
+            r = c.get('/v1/no/param')
+            self.assertReplyOK(r, '123')
+            self.assertEqual(r.headers['ETag'], '"42"')
+
+            with patch.object(spec, 'model_to_json') as model_to_json:
+                r = c.get('/v1/no/param', headers={'If-None-Match': '"41", "42"'})
+                self.assertEqual(r.status_code, 304)
+                model_to_json.assert_not_called()
+
+        self.assertEqual(matches, [False, True])
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_etag_version_direct_call(self, func):
+        func.__name__ = 'return_token'
+
+        SessionToken = get_model('SessionToken')
+        matches = []
+
+        def return_token():
+            matches.append(set_etag(42))
+            return SessionToken(token='123')
+        func.side_effect = return_token
+
+        # Outside of a request, the caller never has the version
+        do_test = self.generate_direct_client(self.yaml_no_param)
+        self.assertEqual(do_test().token, '123')
+        self.assertEqual(matches, [False])
+
+        # Nor during a request holding that version: it is the caller's
+        with Flask('outer').test_request_context('/', headers={'If-None-Match': '"42"'}):
+            self.assertEqual(do_test().token, '123')
+            self.assertEqual(set_etag(42), True)
+        self.assertEqual(matches, [False, False])
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_swagger_server_etag_cached(self, func):
+        func.__name__ = 'return_token'
+        configure_response_cache()
+        self.addCleanup(configure_response_cache)
+
+        app, spec = self.generate_server_app(self.yaml_no_param.replace('x-auth-required', 'x-cache-ttl: 30\n      x-auth-required'))
+
+        SessionToken = get_model('SessionToken')
+        func.return_value = SessionToken(token='123')
+
+        with app.test_client() as c:
+            etag = c.get('/v1/no/param').headers['ETag']
+            r = c.get('/v1/no/param', headers={'If-None-Match': etag})
+            self.assertEqual(r.status_code, 304)
+            self.assertReplyOK(c.get('/v1/no/param'), '123')
+            self.assertEqual(func.call_count, 1)
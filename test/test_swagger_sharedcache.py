@@ -0,0 +1,150 @@
+import os
+import time
+import random
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from werkzeug.datastructures import MultiDict, Headers
+from pymacaron_core.swagger.sharedcache import SharedMemoryBackend
+from pymacaron_core.swagger.servercache import ResponseCache
+from pymacaron_core.metrics import registry
+
+
+def key(path, i=0):
+    return (path, (('i', str(i)),), ('',))
+
+
+def value(s):
+    return (s.encode('utf-8'), 200, [('Content-Type', 'application/json')])
+
+
+def store_in_child(path):
+    backend = SharedMemoryBackend(path, slots=8, slot_size=256)
+    backend.set(key('/v1/child'), value('from child'), 30)
+
+
+class SharedMemoryBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get_backend(self, slots=8, slot_size=256):
+        backend = SharedMemoryBackend(self.path, slots=slots, slot_size=slot_size)
+        self.addCleanup(backend.close)
+        return backend
+
+    def test_set_get(self):
+        b = self.get_backend()
+        self.assertEqual(b.get(key('/v1/a')), None)
+        self.assertEqual(b.set(key('/v1/a'), value('a'), 30), 0)
+        self.assertEqual(b.get(key('/v1/a')), value('a'))
+        self.assertEqual(b.get(key('/v1/a', 1)), None)
+
+        # Overwrite
+        b.set(key('/v1/a'), value('b'), 30)
+        self.assertEqual(b.get(key('/v1/a')), value('b'))
+
+    def test_ttl(self):
+        b = self.get_backend()
+        b.set(key('/v1/a'), value('a'), 0.05)
+        self.assertEqual(b.get(key('/v1/a')), value('a'))
+        time.sleep(0.1)
+        self.assertEqual(b.get(key('/v1/a')), None)
+
+    def test_too_large(self):
+        b = self.get_backend(slot_size=128)
+        self.assertEqual(b.set(key('/v1/a'), value('a' * 200), 30), 0)
+        self.assertEqual(b.get(key('/v1/a')), None)
+
+    def test_clock_eviction(self):
+        b = self.get_backend(slots=4)
+        for i in range(4):
+            self.assertEqual(b.set(key('/v1/a', i), value(str(i)), 30), 0)
+
+        # Entry 0 was read: entry 1 goes first
+        b.get(key('/v1/a', 0))
+        self.assertEqual(b.set(key('/v1/a', 4), value('4'), 30), 1)
+        self.assertEqual(b.get(key('/v1/a', 0)), value('0'))
+        self.assertEqual(b.get(key('/v1/a', 1)), None)
+        for i in (2, 3, 4):
+            self.assertEqual(b.get(key('/v1/a', i)), value(str(i)))
+
+    def test_invalidate(self):
+        b = self.get_backend()
+        b.set(key('/v1/a', 0), value('a0'), 30)
+        b.set(key('/v1/a', 1), value('a1'), 30)
+        b.set(key('/v1/b'), value('b'), 30)
+        b.invalidate('/v1/a')
+        self.assertEqual(b.get(key('/v1/a', 0)), None)
+        self.assertEqual(b.get(key('/v1/a', 1)), None)
+        self.assertEqual(b.get(key('/v1/b')), value('b'))
+        b.invalidate()
+        self.assertEqual(b.get(key('/v1/b')), None)
+
+    def test_index_stays_consistent(self):
+        b = self.get_backend(slots=16)
+        model = {}
+        random.seed(1)
+        for n in range(2000):
+            k = key('/v1/%s' % random.randint(0, 5), random.randint(0, 20))
+            if random.random() < 0.1:
+                b.invalidate(k[0])
+                model = {kk: v for kk, v in model.items() if kk[0] != k[0]}
+            else:
+                b.set(k, value(str(n)), 30)
+                model[k] = value(str(n))
+        # Every entry found is the latest one stored, and all the responses
+        # stored in slots are found via the index
+        found = 0
+        for k, v in model.items():
+            r = b.get(k)
+            if r is not None:
+                self.assertEqual(r, v)
+                found += 1
+        self.assertEqual(found, sum(b._read_slot(i)[0] for i in range(16)))
+
+    def test_shared_across_processes(self):
+        b = self.get_backend()
+        b.set(key('/v1/parent'), value('from parent'), 30)
+
+        # The child opens the existing cache without resetting it
+        p = multiprocessing.get_context('fork').Process(target=store_in_child, args=(self.path,))
+        p.start()
+        p.join()
+        self.assertEqual(p.exitcode, 0)
+        self.assertEqual(b.get(key('/v1/child')), value('from child'))
+        self.assertEqual(b.get(key('/v1/parent')), value('from parent'))
+
+        # A cache of another geometry is not wiped from under its users
+        with self.assertRaises(ValueError):
+            SharedMemoryBackend(self.path, slots=16, slot_size=256)
+        with self.assertRaises(ValueError):
+            SharedMemoryBackend(self.path, slots=8, slot_size=512)
+        self.assertEqual(b.get(key('/v1/parent')), value('from parent'))
+        self.assertEqual(self.get_backend().get(key('/v1/parent')), value('from parent'))
+
+        # Nor is a file that isn't a cache
+        with open(os.path.join(self.dir, 'other'), 'wb') as f:
+            f.write(b'foo')
+        with self.assertRaises(ValueError):
+            SharedMemoryBackend(os.path.join(self.dir, 'other'))
+
+    def test_response_cache_backend(self):
+        registry.clear()
+        cache = ResponseCache(backend=self.get_backend(slots=1))
+        labels = ('foo', 'GET', '/v1/a')
+        k = cache.get_key('/v1/a', MultiDict([('x', '1')]), Headers({'Authorization': 'bar'}), ('Authorization',))
+        self.assertEqual(cache.get(k, labels), None)
+        cache.store(k, value('a'), 30, labels)
+        self.assertEqual(cache.get(k, labels), value('a'))
+        k2 = cache.get_key('/v1/a', MultiDict([('x', '2')]), Headers(), ('Authorization',))
+        cache.store(k2, value('b'), 30, labels)
+        self.assertEqual(cache.get(k, labels), None)
+        self.assertEqual(registry.get('pym_server_cache_total').get(labels + ('hit',)), 1)
+        self.assertEqual(registry.get('pym_server_cache_total').get(labels + ('miss',)), 2)
+        self.assertEqual(registry.get('pym_server_cache_evictions_total').get(labels), 1)
@@ -0,0 +1,157 @@
+import time
+import threading
+import unittest
+from requests.exceptions import ReadTimeout, ConnectionError
+from pymacaron_core.swagger.api import API
+from pymacaron_core.swagger.transport import get_transport, RequestsTransport, Urllib3Transport
+from pymacaron_core.swagger.retry import RetryPolicy
+from pymacaron_core.swagger.breaker import CircuitBreakerPolicy
+from pymacaron_core.metrics import registry
+from pymacaron_core.exceptions import PyMacaronCoreException, CircuitOpenError
+from utils import yaml_foo, start_stub_server
+
+
+class TransportTests():
+    """Tests run against each transport"""
+
+    transport = None
+
+    def setUp(self):
+        self.server = start_stub_server()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_api(self, **kwargs):
+        return API('foo', yaml_str=yaml_foo, port=self.port, transport=self.transport, **kwargs)
+
+    def test_connections_are_reused(self):
+        api = self.get_api()
+        for i in range(5):
+            self.assertEqual(api.client.get_foo().foo, 'bar')
+        self.assertEqual(len(self.server.peers), 1)
+
+    def test_connections_are_shared_across_threads(self):
+        api = self.get_api(pool_size=4, preconnect=2)
+
+        def call():
+            for i in range(10):
+                self.assertEqual(api.client.get_foo().foo, 'bar')
+
+        threads = [threading.Thread(target=call) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(api.client.get_foo().foo, 'bar')
+        # At most 4 concurrent connections, instead of one per call
+        self.assertTrue(len(self.server.peers) <= 4, self.server.peers)
+
+    def test_no_keep_alive(self):
+        api = self.get_api(keep_alive=False)
+        for i in range(3):
+            self.assertEqual(api.client.get_foo().foo, 'bar')
+        self.assertEqual(len(self.server.peers), 3)
+
+    def test_preconnect(self):
+        api = self.get_api(preconnect=1)
+        pool = api.transport._get_pool(api.get_base_url())
+        self.assertEqual(pool.num_connections, 1)
+        api.client.get_foo()
+        self.assertEqual(pool.num_connections, 1)
+
+    def test_body_path_and_headers(self):
+        api = self.get_api()
+        r = api.client.echo(api.model.Foo(foo='baz'), bar='abc', request_headers={'X-Foo': 'xyz'})
+        self.assertEqual(r.foo, '/v1/echo/abc xyz baz')
+
+    def test_read_timeout_is_retried(self):
+        api = self.get_api()
+        with self.assertRaises(ReadTimeout):
+            api.client.slow(delay=0.3, read_timeout=0.1)
+        self.assertEqual(self.server.calls, ['/v1/slow?delay=0.3'] * 3)
+
+        self.server.calls = []
+        with self.assertRaises(ReadTimeout):
+            api.client.slow(delay=0.3, read_timeout=0.1, max_attempts=1)
+        self.assertEqual(len(self.server.calls), 1)
+
+        self.assertEqual(api.client.slow(delay=0.01, read_timeout=1).foo, 'bar')
+
+    def test_retries_are_capped_by_budget(self):
+        registry.clear()
+        policy = RetryPolicy(backoff=0.01, budget=0.5, budget_min_per_sec=0, budget_burst=1)
+        api = self.get_api(retry_policy=policy)
+
+        # The budget allows one retry...
+        with self.assertRaises(ReadTimeout):
+            api.client.slow(delay=0.3, read_timeout=0.1)
+        self.assertEqual(len(self.server.calls), 2)
+
+        # ... after which calls are not retried
+        self.server.calls = []
+        with self.assertRaises(ReadTimeout):
+            api.client.slow(delay=0.3, read_timeout=0.1)
+        self.assertEqual(len(self.server.calls), 1)
+
+        labels = ('foo', 'GET', '/v1/slow')
+        self.assertEqual(registry.get('pym_client_retries_total').get(labels), 1)
+        self.assertEqual(registry.get('pym_client_retries_throttled_total').get(labels), 2)
+
+    def test_circuit_breaker(self):
+        errors = []
+
+        def error_callback(e):
+            errors.append(e)
+            return 'failed'
+
+        policy = CircuitBreakerPolicy(window=2, min_calls=2, open_duration=0.2)
+        api = self.get_api(circuit_breaker=policy, error_callback=error_callback)
+        breaker = policy.get('127.0.0.1:%s' % self.port)
+
+        # Two timeouts open the circuit...
+        for i in range(2):
+            with self.assertRaises(ReadTimeout):
+                api.client.slow(delay=0.3, read_timeout=0.1, max_attempts=1)
+        self.assertEqual(breaker.state, 'open')
+
+        # ... and calls fail fast via the error callback
+        t0 = time.time()
+        self.assertEqual(api.client.slow(delay=0.3, read_timeout=0.1), 'failed')
+        self.assertTrue(time.time() - t0 < 0.05)
+        self.assertEqual(len(self.server.calls), 2)
+        self.assertTrue(isinstance(errors[0], CircuitOpenError))
+        self.assertEqual(errors[0].status_code, 503)
+
+        # Until a probe succeeds
+        time.sleep(0.25)
+        self.assertEqual(api.client.get_foo().foo, 'bar')
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_connection_error(self):
+        api = self.get_api()
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(ConnectionError):
+            api.client.get_foo()
+
+
+class RequestsTransportTest(TransportTests, unittest.TestCase):
+    transport = 'requests'
+
+
+class Urllib3TransportTest(TransportTests, unittest.TestCase):
+    transport = 'urllib3'
+
+
+class GetTransportTest(unittest.TestCase):
+
+    def test_get_transport(self):
+        self.assertTrue(isinstance(get_transport(), RequestsTransport))
+        self.assertTrue(isinstance(get_transport('urllib3', pool_size=3), Urllib3Transport))
+        t = Urllib3Transport()
+        self.assertIs(get_transport(t), t)
+        with self.assertRaises(PyMacaronCoreException):
+            get_transport('foo')
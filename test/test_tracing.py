@@ -0,0 +1,126 @@
+import imp
+import os
+import json
+import tempfile
+import responses
+from mock import patch
+from pymacaron_core.tracing import tracer, configure_tracing
+from pymacaron_core.models import get_model
+
+
+utils = imp.load_source('common', os.path.join(os.path.dirname(__file__), 'utils.py'))
+
+
+class MemoryExporter():
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class Test(utils.PymTest):
+
+
+    def setUp(self):
+        super(Test, self).setUp()
+        self.exporter = MemoryExporter()
+        configure_tracing(exporter=self.exporter)
+
+
+    def tearDown(self):
+        tracer.disable()
+
+
+    def test_server_span_raised_error(self):
+        app, spec = self.generate_server_app(self.yaml_in_body)
+
+        with app.test_client() as c:
+            r = c.get('/v1/in/body', data=json.dumps({'bazzoom': 'thiswontwork'}), headers={'PymTraceSampled': '1'})
+            self.assertEqual(r.status_code, 400)
+
+        self.assertEqual(len(self.exporter.spans), 1)
+        self.assertEqual(self.exporter.spans[0].to_dict()['tags']['status'], 400)
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_server_span(self, func):
+        func.__name__ = 'return_token'
+        app, spec = self.generate_server_app(self.yaml_no_param)
+        func.return_value = get_model('SessionToken')(token='123')
+
+        with app.test_client() as c:
+            r = c.get('/v1/no/param', headers={
+                'PymCallID': 'abc',
+                'PymSpanID': '1234',
+                'PymTraceSampled': '1',
+            })
+            self.assertEqual(r.status_code, 200)
+
+        self.assertEqual(len(self.exporter.spans), 1)
+        d = self.exporter.spans[0].to_dict()
+        self.assertEqual(d['name'], 'somename GET /v1/no/param')
+        self.assertEqual(d['kind'], 'server')
+        self.assertEqual(d['trace_id'], 'abc')
+        self.assertEqual(d['parent_id'], '1234')
+        self.assertEqual(d['tags'], {'status': 200, 'call_path': 'somename'})
+        self.assertTrue(d['end'] >= d['start'])
+
+        # Not sampled upstream
+        with app.test_client() as c:
+            c.get('/v1/no/param', headers={'PymSpanID': '1234', 'PymTraceSampled': '0'})
+        self.assertEqual(len(self.exporter.spans), 1)
+
+        # Root request, with head sampling
+        configure_tracing(exporter=self.exporter, sample_rate=0)
+        with app.test_client() as c:
+            c.get('/v1/no/param')
+        self.assertEqual(len(self.exporter.spans), 1)
+
+
+    @responses.activate
+    def test_client_span(self):
+        handler, _ = self.generate_client_and_spec(self.yaml_query_param)
+
+        responses.add(
+            responses.GET, "http://some.server.com:80/v1/some/path",
+            body=json.dumps({"foo": "a", "bar": "b"}),
+            status=200,
+            content_type="application/json"
+        )
+
+        handler(arg1='this', arg2='that')
+
+        self.assertEqual(len(self.exporter.spans), 1)
+        span = self.exporter.spans[0]
+        self.assertEqual(span.kind, 'client')
+        self.assertEqual(span.parent_id, None)
+
+        headers = responses.calls[0].request.headers
+        self.assertEqual(headers['PymSpanID'], span.span_id)
+        self.assertEqual(headers['PymCallID'], span.trace_id)
+        self.assertEqual(headers['PymTraceSampled'], '1')
+
+
+    def test_file_exporters(self):
+        for format in ('jsonl', 'chrome'):
+            path = tempfile.mktemp()
+            try:
+                configure_tracing(path=path, format=format)
+                for i in range(2):
+                    span = tracer.start_client_span('foo', None)
+                    tracer.finish(span, bar=i)
+                tracer.disable()
+
+                with open(path) as f:
+                    content = f.read()
+                if format == 'jsonl':
+                    lines = [json.loads(line) for line in content.splitlines()]
+                    self.assertEqual([d['tags']['bar'] for d in lines], [0, 1])
+                else:
+                    events = json.loads(content.rstrip(',\n') + ']')
+                    self.assertEqual([e['args']['bar'] for e in events], [0, 1])
+                    self.assertEqual(events[0]['ph'], 'X')
+            finally:
+                os.remove(path)
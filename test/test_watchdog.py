@@ -0,0 +1,58 @@
+import imp
+import os
+import time
+from mock import patch
+from pymacaron_core.watchdog import watchdog
+from pymacaron_core.models import get_model
+
+
+utils = imp.load_source('common', os.path.join(os.path.dirname(__file__), 'utils.py'))
+
+
+class Test(utils.PymTest):
+
+
+    def tearDown(self):
+        watchdog.stop()
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_slow_request(self, func):
+        func.__name__ = 'return_token'
+        app, spec = self.generate_server_app(self.yaml_no_param)
+
+        def sleep_and_return():
+            time.sleep(0.3)
+            return get_model('SessionToken')(token='123')
+        func.side_effect = sleep_and_return
+
+        watchdog.start(threshold=0.05, interval=0.01, max_samples=5)
+        self.assertTrue(watchdog.running)
+
+        with self.assertLogs('pymacaron_core.watchdog', level='WARNING') as logs:
+            with app.test_client() as c:
+                r = c.get('/v1/no/param', headers={'PymCallID': 'abcd'})
+                self.assertEqual(r.status_code, 200)
+
+        self.assertEqual(len(logs.output), 1)
+        msg = logs.output[0]
+        self.assertTrue('SLOW REQUEST somename GET /v1/no/param' in msg, msg)
+        self.assertTrue('[call_id: abcd] [call_path: somename] - 5 stack samples' in msg, msg)
+        self.assertTrue('in sleep_and_return' in msg, msg)
+        self.assertEqual(watchdog.inflight, {})
+
+
+    @patch('pymacaron_core.test.return_token')
+    def test_fast_request(self, func):
+        func.__name__ = 'return_token'
+        app, spec = self.generate_server_app(self.yaml_no_param)
+        func.return_value = get_model('SessionToken')(token='123')
+
+        watchdog.start(threshold=10, interval=0.01)
+
+        with patch.object(watchdog, '_report') as report:
+            with app.test_client() as c:
+                r = c.get('/v1/no/param')
+                self.assertEqual(r.status_code, 200)
+            report.assert_not_called()
+        self.assertEqual(watchdog.inflight, {})
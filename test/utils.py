@@ -1,8 +1,14 @@
+import json
+import time
+import threading
 import unittest
 import yaml
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from flask import Flask
+from werkzeug.serving import make_server
 from pymacaron_core.swagger.spec import ApiSpec
-from pymacaron_core.swagger.api import default_error_callback
+from pymacaron_core.swagger.api import API, default_error_callback
 from pymacaron_core.swagger.client import generate_client_callers
 from pymacaron_core.swagger.server import spawn_server_api
 
@@ -372,7 +378,7 @@ paths:
       x-bind-server: pymacaron_core.test.return_token
       x-auth-required: false
       responses:
-        200:
+        '200':
           description: A session token
           schema:
             $ref: '#/definitions/SessionToken'
@@ -396,7 +402,7 @@ paths:
       x-bind-server: pymacaron_core.test.return_token
       x-auth-required: false
       responses:
-        200:
+        '200':
           description: A session token
           schema:
             $ref: '#/definitions/SessionToken'
@@ -424,7 +430,7 @@ paths:
       x-bind-server: pymacaron_core.test.return_token
       x-auth-required: false
       responses:
-        200:
+        '200':
           description: A session token
           schema:
             $ref: '#/definitions/SessionToken'
@@ -452,8 +458,216 @@ paths:
       x-bind-server: pymacaron_core.test.return_token
       x-auth-required: false
       responses:
-        200:
+        '200':
           description: A session token
           schema:
             $ref: '#/definitions/SessionToken'
 """
+
+
+# An api served by StubHandler, for tests calling a real HTTP server
+yaml_foo = """
+swagger: '2.0'
+info:
+  version: '0.0.1'
+host: 127.0.0.1
+schemes:
+  - http
+produces:
+  - application/json
+paths:
+  /v1/foo:
+    get:
+      produces:
+        - application/json
+      x-bind-server: pymacaron_core.test.return_token
+      x-bind-client: get_foo
+      responses:
+        '200':
+          description: result
+          schema:
+            $ref: '#/definitions/Foo'
+  /v1/echo/{bar}:
+    post:
+      parameters:
+        - in: path
+          name: bar
+          type: string
+          required: true
+        - in: body
+          name: body
+          required: true
+          schema:
+            $ref: '#/definitions/Foo'
+      produces:
+        - application/json
+      x-bind-server: pymacaron_core.test.return_token
+      x-bind-client: echo
+      responses:
+        '200':
+          description: result
+          schema:
+            $ref: '#/definitions/Foo'
+  /v1/slow:
+    get:
+      parameters:
+        - in: query
+          name: delay
+          type: number
+          required: true
+      produces:
+        - application/json
+      x-bind-server: pymacaron_core.test.return_token
+      x-bind-client: slow
+      responses:
+        '200':
+          description: result
+          schema:
+            $ref: '#/definitions/Foo'
+
+definitions:
+
+  Foo:
+    type: object
+    description: foo
+    properties:
+      foo:
+        type: string
+        description: blabla
+"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def reply(self, j, status=200):
+        body = json.dumps(j).encode('utf-8') if j is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            # As real servers do, or the client may reuse the connection
+            # before noticing it is closed
+            self.send_header('Connection', 'close')
+        for k, v in getattr(self.server, 'response_headers', {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.peers.add(self.client_address)
+        self.server.calls.append(self.path)
+        u = urlparse(self.path)
+        if u.path == '/v1/slow':
+            time.sleep(float(parse_qs(u.query)['delay'][0]))
+        etag = getattr(self.server, 'response_headers', {}).get('ETag')
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.reply(None, status=304)
+            return
+        self.reply({'foo': getattr(self.server, 'foo', 'bar')})
+
+    def do_POST(self):
+        self.server.calls.append(self.path)
+        j = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.reply({'foo': '%s %s %s' % (self.path, self.headers['X-Foo'], j['foo'])})
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server():
+    """Start serving yaml_foo with StubHandler on a random port, recording the
+    peers and paths of the calls it gets"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.peers = set()
+    server.calls = []
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_catalog_yaml(msgpack=False, **extensions):
+    """Return the spec of an api getting and setting a Catalog. The GET endpoint
+    gets the given 'x-' extensions (such as cache_ttl=30 for 'x-cache-ttl: 30'),
+    and both endpoints also support MessagePack if msgpack is true"""
+    formats = '\n        - application/json'
+    if msgpack:
+        formats += '\n        - application/msgpack'
+    x = ''.join('\n      x-%s: %s' % (k.replace('_', '-'), v) for k, v in sorted(extensions.items()))
+    return """
+swagger: '2.0'
+info:
+  version: '0.0.1'
+host: 127.0.0.1
+schemes:
+  - http
+produces:
+  - application/json
+paths:
+  /v1/catalog:
+    get:
+      produces:%(formats)s
+      x-bind-server: pymacaron_core.test.return_token
+      x-bind-client: get_catalog%(x)s
+      responses:
+        '200':
+          description: result
+          schema:
+            $ref: '#/definitions/Catalog'
+    post:
+      parameters:
+        - in: body
+          name: body
+          required: true
+          schema:
+            $ref: '#/definitions/Catalog'
+      consumes:%(formats)s
+      produces:%(formats)s
+      x-bind-server: pymacaron_core.test.return_token
+      x-bind-client: set_catalog
+      responses:
+        '200':
+          description: result
+          schema:
+            $ref: '#/definitions/Catalog'
+
+definitions:
+
+  Catalog:
+    type: object
+    description: catalog
+    properties:
+      name:
+        type: string
+        description: blabla
+      items:
+        type: array
+        items:
+          type: string
+""" % {'formats': formats, 'x': x}
+
+
+class FlaskServerTest(unittest.TestCase):
+    """Serve a flask app on a random port, for tests calling it both via its
+    test_client and with an API's client callers"""
+
+    def setUp(self):
+        self.app = Flask('test')
+        self.server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        self.serving = False
+
+    def tearDown(self):
+        if self.serving:
+            self.server.shutdown()
+        self.server.server_close()
+
+    def get_api(self, name, yaml_str, **kwargs):
+        return API(name, yaml_str=yaml_str, port=self.server.server_port, **kwargs)
+
+    def start(self, api, **kwargs):
+        """Spawn the api on the app, with the given spawn_api kwargs, and start
+        serving it. Call it once the handler is mocked"""
+        api.spawn_api(self.app, **kwargs)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.serving = True